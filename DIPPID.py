@@ -1,9 +1,13 @@
 import sys
+import os
 import json
-from threading import Thread
-from time import sleep
-from datetime import datetime
-from enum import Enum
+import atexit
+import functools
+import math
+import struct
+from collections import deque
+from threading import Thread, Lock, get_ident, get_native_id
+from time import sleep, perf_counter, perf_counter_ns, time_ns
 import signal
 
 # those modules are imported dynamically during runtime
@@ -12,18 +16,620 @@ import signal
 #import serial
 #import wiimote
 
+# lightweight profiler for the hot paths of DIPPID, the flowchart nodes and the game
+# configured with environment variables:
+#   DIPPID_PROFILE=1            collect timings and print a summary on exit
+#   DIPPID_PROFILE=trace.json   additionally write a Chrome trace (chrome://tracing or ui.perfetto.dev)
+#   DIPPID_PROFILE_SUMMARY=5    print a live summary every 5 seconds
+# when DIPPID_PROFILE is not set, profile() returns the undecorated function
+# and span(), count() and observe() return immediately
+class Profiler():
+    # maximum number of events kept for the trace, older events are dropped
+    MAX_TRACE_EVENTS = 1000000
+    # only every n-th span of a name is added to its histogram
+    HISTOGRAM_SAMPLE_RATE = 4
+
+    def __init__(self, enabled=False, trace_path=None):
+        self.enabled = enabled
+        self.trace_path = trace_path
+        self._start_ns = perf_counter_ns()
+        self._events = deque(maxlen=Profiler.MAX_TRACE_EVENTS)
+        # name -> [count, total_ns, max_ns]
+        self._spans = {}
+        self._counters = {}
+        # name -> {bucket: count}, bucket n holds values in [2^(n-1), 2^n)
+        self._histograms = {}
+        self._lock = Lock()
+
+    # decorator that records a span for every call of the decorated function
+    def profile(self, name):
+        def decorator(func):
+            if not self.enabled:
+                return func
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                start = perf_counter_ns()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self._add_span(name, start, perf_counter_ns() - start)
+            return wrapper
+        return decorator
+
+    # context manager that records a span for the enclosed code
+    def span(self, name):
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name)
+
+    def count(self, name, n=1):
+        if not self.enabled:
+            return
+        with self._lock:
+            value = self._counters.get(name, 0) + n
+            self._counters[name] = value
+            self._events.append(('C', name, perf_counter_ns(), value, get_ident()))
+
+    # adds a value (e.g. a latency in ns) to the histogram of the given name
+    def observe(self, name, value):
+        if not self.enabled:
+            return
+        with self._lock:
+            histogram = self._histograms.setdefault(name, {})
+            bucket = int(value).bit_length()
+            histogram[bucket] = histogram.get(bucket, 0) + 1
+
+    def _add_span(self, name, start, duration):
+        with self._lock:
+            stats = self._spans.get(name)
+            if stats is None:
+                stats = self._spans[name] = [0, 0, 0]
+            stats[0] += 1
+            stats[1] += duration
+            if duration > stats[2]:
+                stats[2] = duration
+            self._events.append(('X', name, start, duration, get_ident()))
+
+            if stats[0] % Profiler.HISTOGRAM_SAMPLE_RATE == 0:
+                histogram = self._histograms.setdefault(name, {})
+                bucket = duration.bit_length()
+                histogram[bucket] = histogram.get(bucket, 0) + 1
+
+    # upper bound of the bucket that contains the given quantile
+    def _quantile(self, histogram, q):
+        total = sum(histogram.values())
+        seen = 0
+        for bucket in sorted(histogram):
+            seen += histogram[bucket]
+            if seen >= q * total:
+                return 2 ** bucket
+        return 0
+
+    # returns a text table with all spans, counters and histograms
+    def summary(self):
+        with self._lock:
+            spans = {name: list(stats) for name, stats in self._spans.items()}
+            counters = dict(self._counters)
+            histograms = {name: dict(histogram) for name, histogram in self._histograms.items()}
+
+        lines = [f'{"span":<32}{"count":>10}{"total ms":>12}{"mean us":>10}{"p50 us":>10}{"p99 us":>10}{"max us":>10}']
+        for name, (count, total, maximum) in sorted(spans.items(), key=lambda item: -item[1][1]):
+            histogram = histograms.pop(name, {})
+            lines.append(f'{name:<32}{count:>10}{total / 1e6:>12.1f}{total / count / 1e3:>10.1f}'
+                         f'{min(self._quantile(histogram, 0.5), maximum) / 1e3:>10.1f}'
+                         f'{min(self._quantile(histogram, 0.99), maximum) / 1e3:>10.1f}'
+                         f'{maximum / 1e3:>10.1f}')
+        for name, histogram in sorted(histograms.items()):
+            lines.append(f'{name:<32}{sum(histogram.values()):>10}{"":>22}'
+                         f'{self._quantile(histogram, 0.5):>10}{self._quantile(histogram, 0.99):>10}')
+        for name, value in sorted(counters.items()):
+            lines.append(f'{name:<32}{value:>10}')
+        return '\n'.join(lines)
+
+    # writes all recorded events in the Chrome trace event format
+    def write_trace(self, path):
+        pid = os.getpid()
+        with self._lock:
+            events = list(self._events)
+
+        trace_events = []
+        for kind, name, timestamp, value, tid in events:
+            event = {'name': name, 'ph': kind, 'ts': (timestamp - self._start_ns) / 1000, 'pid': pid, 'tid': tid}
+            if kind == 'X':
+                event['dur'] = value / 1000
+            else:
+                event['args'] = {name: value}
+            trace_events.append(event)
+
+        with open(path, 'w') as trace_file:
+            json.dump({'traceEvents': trace_events, 'displayTimeUnit': 'ms'}, trace_file)
+
+    def _print_live_summary(self, interval):
+        while True:
+            sleep(interval)
+            print(self.summary(), file=sys.stderr)
+
+    def _on_exit(self):
+        print(self.summary(), file=sys.stderr)
+        if self.trace_path:
+            self.write_trace(self.trace_path)
+            print(f'profiler trace written to {self.trace_path}', file=sys.stderr)
+
+    @staticmethod
+    def from_environment():
+        setting = os.environ.get('DIPPID_PROFILE', '')
+        if setting in ('', '0'):
+            return Profiler()
+
+        trace_path = None if setting == '1' else setting
+        profiler = Profiler(True, trace_path)
+        atexit.register(profiler._on_exit)
+
+        interval = os.environ.get('DIPPID_PROFILE_SUMMARY')
+        if interval:
+            Thread(target=profiler._print_live_summary, args=(float(interval),), daemon=True).start()
+        return profiler
+
+
+class _Span():
+    def __init__(self, profiler, name):
+        self._profiler = profiler
+        self._name = name
+
+    def __enter__(self):
+        self._start = perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._profiler._add_span(self._name, self._start, perf_counter_ns() - self._start)
+        return False
+
+
+class _NullSpan():
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+profiler = Profiler.from_environment()
+
+
+# receiver side of the optional sequence numbers of the DIPPID protocol:
+# a sender may add a top level field "seq" (an integer that is increased by one for every packet),
+# e.g. {"seq": 42, "accelerometer": {"x": 0.1, "y": 0.2, "z": 9.8}}
+# packets without "seq" are processed immediately, as before
+# packets that arrive too early are held back until the missing packets arrive,
+# but never for more than REORDER_WINDOW packets or REORDER_TIMEOUT seconds
+# a packet with sequence number 0, a packet more than LATE_DISTANCE behind the expected one
+# or more than REORDER_WINDOW packets in a row that are behind (and not given up) mean the sender was restarted,
+# a single old packet is a duplicate
+class PacketSequencer():
+    REORDER_WINDOW = 4
+    REORDER_TIMEOUT = 0.02
+    # packets that were given up are recognized as late for this many sequence numbers
+    LATE_DISTANCE = 1000
+
+    def __init__(self):
+        self._expected = None
+        # seq -> (arrival time, packet)
+        self._held = {}
+        # sequence numbers that were given up as lost, to tell late packets from duplicates
+        self._missing = set()
+        # packets in a row that were behind the expected one
+        self._behind = 0
+        self.stats = {
+            'received': 0,      # packets with a sequence number
+            'delivered': 0,
+            'lost': 0,          # given up and not arrived since
+            'late': 0,          # arrived after they were given up, not processed
+            'duplicates': 0,
+            'reordered': 0,     # held back and delivered in order
+            'resets': 0,
+        }
+
+    # takes a packet with sequence number seq and returns the packets that can be processed now, in order
+    def push(self, seq, packet):
+        self.stats['received'] += 1
+
+        if self._expected is None or self._is_restart(seq):
+            if self._expected is not None:
+                self.stats['resets'] += 1
+            self._held.clear()
+            self._missing.clear()
+            self._behind = 0
+            self._expected = seq
+
+        if seq < self._expected:
+            if seq in self._missing:
+                self._missing.discard(seq)
+                self.stats['lost'] -= 1
+                self.stats['late'] += 1
+            else:
+                self.stats['duplicates'] += 1
+            return []
+
+        if seq in self._held:
+            self.stats['duplicates'] += 1
+            return []
+
+        if seq > self._expected:
+            self._held[seq] = (perf_counter(), packet)
+            return self.flush()
+
+        ready = [packet]
+        self._expected += 1
+        ready += self._release_in_order()
+        self.stats['delivered'] += len(ready)
+        return ready
+
+    def _is_restart(self, seq):
+        if seq >= self._expected:
+            self._behind = 0
+            return False
+        if seq in self._missing:
+            return False
+        if seq == 0 or seq < self._expected - self.LATE_DISTANCE:
+            return True
+        if seq < self._expected - self.REORDER_WINDOW:
+            # a restarted sender keeps sending packets behind, duplicates come alone
+            self._behind += 1
+            return self._behind > self.REORDER_WINDOW
+        return False
+
+    # gives up on missing packets if too many packets are held back or the oldest one waited too long
+    # called for every packet and by receivers that did not receive anything for REORDER_TIMEOUT
+    def flush(self):
+        ready = []
+        while self._held and (len(self._held) > self.REORDER_WINDOW or
+                              perf_counter() - min(arrival for arrival, _ in self._held.values()) > self.REORDER_TIMEOUT):
+            first = min(self._held)
+            self.stats['lost'] += first - self._expected
+            self._missing.update(range(max(self._expected, first - self.LATE_DISTANCE), first))
+            self._expected = first
+            ready += self._release_in_order()
+
+        # forget old gaps, a packet that late would be dropped anyway
+        if len(self._missing) > self.LATE_DISTANCE:
+            self._missing = {seq for seq in self._missing if seq >= self._expected - self.LATE_DISTANCE}
+
+        self.stats['delivered'] += len(ready)
+        return ready
+
+    def _release_in_order(self):
+        ready = []
+        while self._expected in self._held:
+            ready.append(self._held.pop(self._expected)[1])
+            self.stats['reordered'] += 1
+            self._expected += 1
+        return ready
+
+
+# policies for register_callback(): the sensor aggregates the values of a capability
+# and only calls the callback with the values the policy lets through
+# every subscription needs its own policy object, policies keep state
+class CallbackPolicy():
+    # returns the value that is passed to the callback or SKIP
+    def filter(self, value):
+        return value
+
+
+# returned by CallbackPolicy.filter() when the callback should not be called
+SKIP = object()
+
+
+# calls the callback at most max_rate times per second, values in between are dropped
+class MaxRate(CallbackPolicy):
+    def __init__(self, max_rate):
+        self.interval = 1.0 / max_rate
+        self._last = -self.interval
+
+    def filter(self, value):
+        now = perf_counter()
+        if now - self._last < self.interval:
+            return SKIP
+        self._last = now
+        return value
+
+
+# calls the callback for every factor-th value
+# with average=True the callback gets the mean of the last factor values (anti-aliasing),
+# values that can't be averaged (e.g. strings) are passed through as they are
+class Decimate(CallbackPolicy):
+    def __init__(self, factor, average=True):
+        self.factor = factor
+        self.average = average
+        self._count = 0
+        self._sums = None
+
+    def filter(self, value):
+        self._count += 1
+        if self.average:
+            self._accumulate(value)
+        if self._count < self.factor:
+            return SKIP
+
+        self._count = 0
+        sums, self._sums = self._sums, None
+        if not self.average or sums is None:
+            return value
+        if isinstance(sums, dict):
+            return {key: total / self.factor for key, total in sums.items()}
+        return sums / self.factor
+
+    def _accumulate(self, value):
+        try:
+            if isinstance(value, dict):
+                if self._sums is None:
+                    self._sums = dict.fromkeys(value, 0.0)
+                for key, component in value.items():
+                    self._sums[key] += component
+            else:
+                self._sums = (self._sums or 0.0) + value
+        except (TypeError, KeyError):
+            self.average = False
+            self._sums = None
+
+
+# calls the callback only if a value (or a component of a dict value) differs by at least
+# threshold from the value the callback got last
+class OnChange(CallbackPolicy):
+    def __init__(self, threshold):
+        self.threshold = threshold
+        self._last = None
+
+    def filter(self, value):
+        if self._last is not None and self._difference(value) < self.threshold:
+            return SKIP
+        self._last = value
+        return value
+
+    def _difference(self, value):
+        try:
+            if isinstance(value, dict):
+                return max(abs(component - self._last[key]) for key, component in value.items())
+            return abs(value - self._last)
+        except (TypeError, KeyError, ValueError):
+            # not comparable, treat it as a change
+            return float('inf')
+
+
+# statistics of the last `window` values of a stream, every add() costs O(1) (amortized)
+# no matter how long the window is:
+#   mean and variance with Welford's method (a value is added and the oldest one removed),
+#   min and max with monotonic deques,
+#   percentiles with a histogram of `bins` bins between low and high (values outside are clamped),
+#   so a percentile is exact to (high - low) / bins and costs O(bins) to query,
+#   results are limited to min and max (a bin center may lie outside the values)
+class SlidingWindowStats():
+    def __init__(self, window, low=-4.0, high=4.0, bins=256):
+        self.window = window
+        self.low = low
+        self.high = high
+        self.bins = bins
+        self.reset()
+
+    def reset(self):
+        self._values = deque()
+        self._index = 0
+        self._mean = 0.0
+        self._m2 = 0.0
+        # (index, value), values increasing / decreasing
+        self._min = deque()
+        self._max = deque()
+        self._histogram = [0] * self.bins
+        self._bin_width = (self.high - self.low) / self.bins
+
+    def _bin(self, x):
+        return min(max(int((x - self.low) / self._bin_width), 0), self.bins - 1)
+
+    def add(self, x):
+        self._values.append(x)
+        n = len(self._values)
+        delta = x - self._mean
+        self._mean += delta / n
+        self._m2 += delta * (x - self._mean)
+
+        while self._min and self._min[-1][1] >= x:
+            self._min.pop()
+        self._min.append((self._index, x))
+        while self._max and self._max[-1][1] <= x:
+            self._max.pop()
+        self._max.append((self._index, x))
+        self._histogram[self._bin(x)] += 1
+
+        if n > self.window:
+            self._remove(self._values.popleft())
+        self._index += 1
+
+    def _remove(self, x):
+        n = len(self._values)
+        delta = x - self._mean
+        self._mean -= delta / n
+        self._m2 = max(self._m2 - delta * (x - self._mean), 0.0)
+
+        oldest = self._index - n
+        if self._min[0][0] <= oldest:
+            self._min.popleft()
+        if self._max[0][0] <= oldest:
+            self._max.popleft()
+        self._histogram[self._bin(x)] -= 1
+
+    def add_block(self, values):
+        for x in values:
+            self.add(float(x))
+
+    @property
+    def count(self):
+        return len(self._values)
+
+    @property
+    def mean(self):
+        return self._mean
+
+    @property
+    def sum(self):
+        return self._mean * len(self._values)
+
+    @property
+    def variance(self):
+        n = len(self._values)
+        return self._m2 / (n - 1) if n > 1 else 0.0
+
+    @property
+    def std(self):
+        return math.sqrt(self.variance)
+
+    @property
+    def min(self):
+        return self._min[0][1] if self._min else None
+
+    @property
+    def max(self):
+        return self._max[0][1] if self._max else None
+
+    # q in percent (0 - 100), the value is the center of the histogram bin
+    def percentile(self, q):
+        n = len(self._values)
+        if n == 0:
+            return None
+        rank = q / 100 * (n - 1)
+        seen = 0
+        value = self.high
+        for i, count in enumerate(self._histogram):
+            seen += count
+            if seen > rank:
+                value = self.low + (i + 0.5) * self._bin_width
+                break
+        return min(max(value, self.min), self.max)
+
+
+# scheduling of the receive threads of the sensors (Linux, partly other Unix systems)
+# the receive threads also run the callbacks, so they compete for the CPU (and the GIL) with
+# Qt rendering and NumPy work; assign Sensor.scheduling before the sensors are created,
+# every receive thread applies the options to itself when it starts:
+#   cpus             CPU numbers the thread may run on, e.g. {3}
+#                    (helps most if other work is kept off these CPUs, e.g. with taskset)
+#   nice             nice value of the thread, values below 0 need CAP_SYS_NICE
+#   realtime         SCHED_FIFO priority (1-99), needs CAP_SYS_NICE or RLIMIT_RTPRIO
+#   switch_interval  seconds after which a running thread has to hand over the GIL
+#                    (sys.setswitchinterval(), the whole process, Python default 0.005)
+#   measure_latency  record for every UDP packet the time from its arrival in the kernel
+#                    until the receive thread handles it (see Sensor.get_receive_latency())
+# options that are not supported or not permitted are skipped with a warning on stderr
+class ReceiveScheduling():
+    # latency of the last LATENCY_WINDOW packets, percentiles exact to LATENCY_RANGE / LATENCY_BINS ms
+    LATENCY_WINDOW = 10000
+    LATENCY_RANGE = 20.0
+    LATENCY_BINS = 2000
+
+    def __init__(self, cpus=None, nice=None, realtime=None, switch_interval=None, measure_latency=False):
+        self.cpus = set(cpus) if cpus is not None else None
+        self.nice = nice
+        self.realtime = realtime
+        self.switch_interval = switch_interval
+        self.measure_latency = measure_latency
+
+    # applies the options to the calling thread (on Linux pid 0 and the native id refer to the thread)
+    # returns the names of the options that could not be applied
+    def apply(self, name='receive thread'):
+        failed = []
+        if self.switch_interval is not None:
+            sys.setswitchinterval(self.switch_interval)
+        if self.cpus is not None:
+            self._try(failed, name, 'cpus', lambda: os.sched_setaffinity(0, self.cpus))
+        if self.nice is not None:
+            self._try(failed, name, 'nice', lambda: os.setpriority(os.PRIO_PROCESS, get_native_id(), self.nice))
+        if self.realtime is not None:
+            self._try(failed, name, 'realtime',
+                      lambda: os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(self.realtime)))
+        return failed
+
+    @staticmethod
+    def _try(failed, name, option, func):
+        try:
+            func()
+        except (AttributeError, OSError, ValueError) as e:
+            # AttributeError: not available on this platform
+            print(f'{name}: could not apply scheduling option "{option}" ({e})', file=sys.stderr)
+            failed.append(option)
+
+    def new_latency_stats(self):
+        return SlidingWindowStats(ReceiveScheduling.LATENCY_WINDOW, 0.0,
+                                  ReceiveScheduling.LATENCY_RANGE, ReceiveScheduling.LATENCY_BINS)
+
+
+# parses a CPU list like "3", "2,3" or "0-1,4"
+def parse_cpus(text):
+    cpus = set()
+    for part in text.split(','):
+        first, _, last = part.partition('-')
+        cpus.update(range(int(first), int(last or first) + 1))
+    return cpus
+
+# command line options for ReceiveScheduling (argparse), see scheduling_from_params()
+# latency=False for programs that do not report the receive latency
+def add_scheduling_params(parser, latency=True):
+    group = parser.add_argument_group('receive threads')
+    group.add_argument('--receive-cpus', type=parse_cpus, metavar='CPUS',
+                       help="pin the receive threads to these CPUs, e.g. 3 or 2,3 or 2-3")
+    group.add_argument('--receive-nice', type=int, metavar='N',
+                       help="nice value of the receive threads (below 0 needs privileges)")
+    group.add_argument('--receive-fifo', type=int, metavar='PRIORITY',
+                       help="run the receive threads with SCHED_FIFO and this priority (1-99, needs privileges)")
+    group.add_argument('--switch-interval', type=float, metavar='MS',
+                       help="GIL switch interval in ms, lower values let waiting receive threads run sooner "
+                            "(Python default: 5)")
+    if latency:
+        group.add_argument('--receive-latency', action='store_true',
+                           help="measure the time UDP packets wait before the receive thread handles them")
+
+def scheduling_from_params(params):
+    switch_interval = params.switch_interval / 1000 if params.switch_interval is not None else None
+    return ReceiveScheduling(params.receive_cpus, params.receive_nice, params.receive_fifo,
+                             switch_interval, getattr(params, 'receive_latency', False))
+
+# one line per sensor with its receive latency (ms), for the summaries printed on exit
+def format_receive_latency(name, sensor):
+    stats = sensor.get_receive_latency()
+    if stats is None:
+        return f'{name}: no receive latency measured'
+    return (f'{name}: receive latency of {stats["count"]} packets: mean {stats["mean"]:.3f} ms, '
+            f'jitter {stats["jitter"]:.3f} ms, p50 {stats["p50"]:.3f} ms, p99 {stats["p99"]:.3f} ms, '
+            f'max {stats["max"]:.3f} ms')
+
+
 class Sensor():
     # class variable that stores all instances of Sensor
     instances = []
+    # scheduling of the receive threads of sensors that are created afterwards
+    scheduling = ReceiveScheduling()
 
     def __init__(self):
         # list of strings which represent capabilites, such as 'buttons' or 'accelerometer'
         self._capabilities = []
         # for each capability, store a list of callback functions
         self._callbacks = {}
+        # for each capability, the policy of every callback (same order, None: every value)
+        self._policies = {}
         # for each capability, store the last value as an object
         self._data = {}
         self._receiving = False
+        # set by _connect(), stays None if the connection fails
+        self._connection_thread = None
+        # reorders packets with sequence numbers and counts lost packets
+        self._sequencer = PacketSequencer()
+        # packets that could not be parsed
+        self._parse_errors = 0
+        self._scheduling = Sensor.scheduling
+        # SlidingWindowStats of the receive latency (ms) if it is measured
+        self.receive_latency = None
+        # see add_dispatch_listener(), replaced on change so the receive thread can iterate it without a lock
+        self._dispatch_listeners = []
         Sensor.instances.append(self)
 
     # stops the loop in _receive() and kills the thread
@@ -34,16 +640,93 @@ class Sensor():
         if self._connection_thread:
             self._connection_thread.join()
 
+    def _start_receive_thread(self):
+        self._connection_thread = Thread(target=self._run_receive)
+        self._connection_thread.start()
+
+    def _run_receive(self):
+        self._scheduling.apply(f'{type(self).__name__} receive thread')
+        self._receive()
+
+    # called by receivers of UDP sockets before the thread starts,
+    # the kernel then adds its receive time to every packet (Linux)
+    def _measure_receive_latency(self, sock):
+        if not self._scheduling.measure_latency:
+            return False
+        import socket
+
+        try:
+            # missing in the socket module of Python, value of Linux (same as SCM_TIMESTAMPNS)
+            sock.setsockopt(socket.SOL_SOCKET, getattr(socket, 'SO_TIMESTAMPNS', 35), 1)
+        except OSError as e:
+            print(f'receive latency can not be measured ({e})', file=sys.stderr)
+            return False
+        self.receive_latency = self._scheduling.new_latency_stats()
+        return True
+
+    # recvfrom() that records how long the packet waited after it arrived in the kernel
+    def _recvfrom_timed(self, sock, bufsize=1024):
+        data, ancdata, flags, addr = sock.recvmsg(bufsize, 64)
+        now = time_ns()
+        for level, kind, cdata in ancdata:
+            # struct timespec, two native longs
+            if len(cdata) >= struct.calcsize('ll'):
+                seconds, nanoseconds = struct.unpack_from('ll', cdata)
+                self.receive_latency.add((now - seconds * 1000000000 - nanoseconds) / 1e6)
+        return data, addr
+
+    # time (ms) between the arrival of a UDP packet in the kernel and its handling by the receive thread
+    # of the last ReceiveScheduling.LATENCY_WINDOW packets (jitter: standard deviation)
+    # or None if it is not measured (see ReceiveScheduling.measure_latency)
+    def get_receive_latency(self):
+        stats = self.receive_latency
+        if stats is None or stats.count == 0:
+            return None
+        return {
+            'count': stats.count,
+            'mean': stats.mean,
+            'jitter': stats.std,
+            'p50': stats.percentile(50),
+            'p99': stats.percentile(99),
+            'max': stats.max,
+        }
+
     # runs as a thread
     # receives json formatted data from sensor,
     # stores it and notifies callbacks
+    @profiler.profile('Sensor._update')
     def _update(self, data):
         try:
-            data_json = json.loads(data)
+            with profiler.span('Sensor.parse'):
+                data_json = json.loads(data)
         except json.decoder.JSONDecodeError:
             # incomplete data
+            profiler.count('Sensor.parse_errors')
+            self._parse_errors += 1
             return
 
+        seq = data_json.pop('seq', None) if isinstance(data_json, dict) else None
+        if seq is None:
+            self._apply(data_json)
+            return
+
+        if not isinstance(seq, int) or isinstance(seq, bool) or seq < 0:
+            # not a sequence number, the packet can not be ordered
+            profiler.count('Sensor.parse_errors')
+            self._parse_errors += 1
+            return
+
+        for packet in self._sequencer.push(seq, data_json):
+            self._apply(packet)
+
+    # processes packets that were held back for too long, for receivers that got nothing for a while
+    def _flush_packets(self):
+        for packet in self._sequencer.flush():
+            self._apply(packet)
+
+    # stores the values of a packet and notifies callbacks
+    def _apply(self, data_json):
+        start = perf_counter() if self._dispatch_listeners else None
         for key, value in data_json.items():
             self._add_capability(key)
 
@@ -57,6 +740,18 @@ class Sensor():
                 self._data[key] = value
                 self._notify_callbacks(key)
 
+        if start is not None:
+            self._report_dispatch(start)
+
+    # statistics of the packets with sequence numbers (see PacketSequencer)
+    # and the number of packets that could not be parsed (processing drops, not network loss)
+    def get_packet_stats(self):
+        stats = dict(self._sequencer.stats)
+        stats['parse_errors'] = self._parse_errors
+        received = stats['delivered'] + stats['lost']
+        stats['loss_rate'] = stats['lost'] / received if received else 0.0
+        return stats
+
     # checks if capability is available
     def has_capability(self, key):
         return key in self._capabilities
@@ -65,6 +760,7 @@ class Sensor():
         if not self.has_capability(key):
             self._capabilities.append(key)
             self._callbacks[key] = []
+            self._policies[key] = []
             self._data[key] = []
 
     # returns a list of all current capabilities
@@ -81,22 +777,50 @@ class Sensor():
             return None
 
     # register a callback function for a change in specified capability
-    def register_callback(self, key, func):
+    # an optional policy (MaxRate, Decimate, OnChange) reduces how often func is called
+    def register_callback(self, key, func, policy=None):
         self._add_capability(key)
         self._callbacks[key].append(func)
+        self._policies[key].append(policy)
 
     # remove already registered callback function for specified capability
     def unregister_callback(self, key, func):
-        if key in self._callbacks:
-            self._callbacks[key].remove(func)
+        if key in self._callbacks and func in self._callbacks[key]:
+            index = self._callbacks[key].index(func)
+            del self._callbacks[key][index]
+            del self._policies[key][index]
             return True
         else:
             # in case somebody wants to check if the callback was present before
             return False
 
+    # func(seconds) is called on the receive thread with the time spent in the callbacks of every packet
+    # (of every value for sensors that receive the values one by one, e.g. SensorWiimote)
+    def add_dispatch_listener(self, func):
+        self._dispatch_listeners = self._dispatch_listeners + [func]
+
+    def remove_dispatch_listener(self, func):
+        if func in self._dispatch_listeners:
+            self._dispatch_listeners = [listener for listener in self._dispatch_listeners if listener != func]
+            return True
+        return False
+
+    def _report_dispatch(self, start):
+        duration = perf_counter() - start
+        for func in self._dispatch_listeners:
+            func(duration)
+
+    @profiler.profile('Sensor._notify_callbacks')
     def _notify_callbacks(self, key):
-        for func in self._callbacks[key]:
-            func(self._data[key])
+        value = self._data[key]
+        for func, policy in zip(self._callbacks[key], self._policies[key]):
+            if policy is None:
+                func(value)
+                continue
+
+            filtered = policy.filter(value)
+            if filtered is not SKIP:
+                func(filtered)
 
 # sensor connected via WiFi/UDP
 # initialized with a UDP port
@@ -114,13 +838,26 @@ class SensorUDP(Sensor):
 
         self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self._sock.bind((self._ip, self._port))
-        self._connection_thread = Thread(target=self._receive)
-        self._connection_thread.start()
+        # wake up regularly to release held back packets (and to notice disconnect())
+        self._sock.settimeout(PacketSequencer.REORDER_TIMEOUT)
+        self._measure_receive_latency(self._sock)
+        self._start_receive_thread()
 
     def _receive(self):
+        import socket
+
+        timed = self.receive_latency is not None
         self._receiving = True
         while self._receiving:
-            data, addr = self._sock.recvfrom(1024)
+            try:
+                if timed:
+                    data, addr = self._recvfrom_timed(self._sock)
+                else:
+                    data, addr = self._sock.recvfrom(1024)
+            except socket.timeout:
+                self._flush_packets()
+                continue
+            profiler.count('SensorUDP.packets')
             try:
                 data_decoded = data.decode()
             except UnicodeDecodeError:
@@ -143,8 +880,7 @@ class SensorSerial(Sensor):
 
         self._serial = serial.Serial(self._tty)
         self._serial.baudrate = self._baudrate
-        self._connection_thread = Thread(target=self._receive)
-        self._connection_thread.start()
+        self._start_receive_thread()
 
     def _receive(self):
         self._receiving = True
@@ -174,8 +910,7 @@ class SensorWiimote(Sensor):
         import wiimote
 
         self._wiimote = wiimote.connect(self._btaddr)
-        self._connection_thread = Thread(target=self._receive)
-        self._connection_thread.start()
+        self._start_receive_thread()
 
     def _receive(self):
         self._receiving = True
@@ -192,6 +927,7 @@ class SensorWiimote(Sensor):
                 self._update(f'button_' + button.lower(), state)
             sleep(0.001)
 
+    @profiler.profile('SensorWiimote._update')
     def _update(self, key, value):
         self._add_capability(key)
         
@@ -203,7 +939,10 @@ class SensorWiimote(Sensor):
         # notify callbacks only if data has changed
         if self._data[key] != value:
             self._data[key] = value
+            start = perf_counter() if self._dispatch_listeners else None
             self._notify_callbacks(key)
+            if start is not None:
+                self._report_dispatch(start)
 
 
 class SensorCapabilities:
@@ -214,12 +953,102 @@ class SensorCapabilities:
     ACCELEROMETER = 'accelerometer'
     GYROSCOPE = 'gyroscope'
     GRAVITY = 'gravity'
+    # published by OnsetDetector
+    TAP = 'tap'
+    SHAKE = 'shake'
+
+
+# detects taps and shakes in the accelerometer samples of a sensor and publishes them as the
+# capabilities 'tap' and 'shake', so they can be used with register_callback() like buttons:
+#   OnsetDetector(sensor)
+#   sensor.register_callback(SensorCapabilities.TAP, on_tap)
+# runs on the receive thread for every sample, so an onset is reported with the sample that
+# contains it and not with the next poll of the application:
+# the samples are high-pass filtered (removes gravity and slow tilting), an onset is a magnitude
+# above an adaptive threshold (mean + SENSITIVITY * mean deviation of the quiet signal),
+# after an onset no other onset is reported for REFRACTORY seconds
+# every onset is a tap, SHAKE_ONSETS onsets within SHAKE_WINDOW seconds are also a shake
+class OnsetDetector():
+    # cutoff frequency of the high-pass filter (Hz)
+    CUTOFF = 5.0
+    SENSITIVITY = 8.0
+    # the threshold never gets lower than this (units of the accelerometer)
+    MIN_THRESHOLD = 0.3
+    # weight of a new quiet sample in the running mean and deviation
+    ADAPTATION = 0.02
+    REFRACTORY = 0.1
+    SHAKE_ONSETS = 4
+    SHAKE_WINDOW = 0.8
+
+    def __init__(self, sensor, capability='accelerometer'):
+        self.sensor = sensor
+        self.onsets = 0
+        self._tau = 1.0 / (2 * math.pi * self.CUTOFF)
+        self._previous = None
+        self._time = 0.0
+        self._high_pass = (0.0, 0.0, 0.0)
+        self._mean = 0.0
+        self._deviation = self.MIN_THRESHOLD / self.SENSITIVITY
+        self._last_onset = -math.inf
+        self._recent_onsets = deque()
+        sensor.register_callback(capability, self.on_sample)
+
+    # timestamp defaults to the time of arrival (seconds, perf_counter())
+    @profiler.profile('OnsetDetector.on_sample')
+    def on_sample(self, value, timestamp=None):
+        now = perf_counter() if timestamp is None else timestamp
+        x, y, z = value['x'], value['y'], value['z']
+        if self._previous is None:
+            self._previous = (x, y, z)
+            self._time = now
+            return
+
+        alpha = self._tau / (self._tau + max(now - self._time, 0.0))
+        px, py, pz = self._previous
+        hx, hy, hz = self._high_pass
+        hx = alpha * (hx + x - px)
+        hy = alpha * (hy + y - py)
+        hz = alpha * (hz + z - pz)
+        self._high_pass = (hx, hy, hz)
+        self._previous = (x, y, z)
+        self._time = now
+
+        magnitude = math.sqrt(hx * hx + hy * hy + hz * hz)
+        threshold = max(self._mean + self.SENSITIVITY * self._deviation, self.MIN_THRESHOLD)
+        if magnitude <= threshold:
+            # only the quiet signal adapts the threshold
+            self._mean += self.ADAPTATION * (magnitude - self._mean)
+            self._deviation += self.ADAPTATION * (abs(magnitude - self._mean) - self._deviation)
+            return
+
+        if now - self._last_onset < self.REFRACTORY:
+            return
+
+        self._last_onset = now
+        self.onsets += 1
+        self._publish(SensorCapabilities.TAP, {'magnitude': magnitude, 'threshold': threshold, 'time': now})
+
+        self._recent_onsets.append(now)
+        while now - self._recent_onsets[0] > self.SHAKE_WINDOW:
+            self._recent_onsets.popleft()
+        if len(self._recent_onsets) >= self.SHAKE_ONSETS:
+            self._recent_onsets.clear()
+            self._publish(SensorCapabilities.SHAKE, {'onsets': self.SHAKE_ONSETS, 'time': now})
+
+    def _publish(self, key, event):
+        self.sensor._add_capability(key)
+        self.sensor._data[key] = event
+        self.sensor._notify_callbacks(key)
 
 
 # close the program softly when ctrl+c is pressed
 def handle_interrupt_signal(signal, frame):
-    for sensor in Sensor.instances:
+    # disconnect() removes the sensor from Sensor.instances
+    for sensor in Sensor.instances[:]:
         sensor.disconnect()
     sys.exit(0)
 
-signal.signal(signal.SIGINT, handle_interrupt_signal)
+# installs handle_interrupt_signal() for SIGINT
+# applications have to call this themselves, importing DIPPID has no global side effects
+def install_interrupt_handler():
+    signal.signal(signal.SIGINT, handle_interrupt_signal)
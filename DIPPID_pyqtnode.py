@@ -8,7 +8,11 @@ import pyqtgraph.flowchart.library as fclib
 from pyqtgraph.Qt import QtGui, QtCore
 import pyqtgraph as pg
 import numpy as np
-from DIPPID import SensorUDP, SensorSerial, SensorWiimote
+from collections import deque
+from threading import Lock
+from time import perf_counter
+from DIPPID import SensorUDP, SensorSerial, SensorWiimote, SlidingWindowStats, profiler, install_interrupt_handler
+from gestures import GestureRecognizer, TEMPLATE_FILE
 import sys
 
 
@@ -28,31 +32,182 @@ class BufferNode(Node):
         }
 
         self.buffer_size = 32
+        # with a decimation of n, the mean of every n inputs is buffered (e.g. set by a LoadController)
+        self.decimation = 1
         self._buffer = np.array([])
+        self._pending = []
         Node.__init__(self, name, terminals=terminals)
 
+    @profiler.profile('BufferNode.process')
     def process(self, **kwds):
-        self._buffer = np.append(self._buffer, kwds['dataIn'])[-self.buffer_size:]
+        data = kwds['dataIn']
+        if self.decimation > 1:
+            self._pending.append(np.mean(data))
+            if len(self._pending) < self.decimation:
+                return {'dataOut': self._buffer}
+            data = np.mean(self._pending)
+            self._pending = []
+
+        self._buffer = np.append(self._buffer, data)[-self.buffer_size:]
 
         return {'dataOut': self._buffer}
 
-fclib.registerNodeType(BufferNode, [('Data',)])
+
+def minmax_decimate(x, y, width):
+    """
+    Reduces y to at most two points (min and max) per pixel column.
+    Spikes stay visible, unlike with plain subsampling.
+    """
+    n = len(y)
+    if width <= 0 or n <= 2 * width:
+        return x, y
+
+    bin_size = n // width
+    used = bin_size * width
+    bins = y[:used].reshape(width, bin_size)
+
+    y_out = np.empty(2 * width + n - used)
+    y_out[0:2 * width:2] = bins.min(axis=1)
+    y_out[1:2 * width:2] = bins.max(axis=1)
+    y_out[2 * width:] = y[used:]
+
+    x_out = np.empty(len(y_out))
+    x_out[0:2 * width] = np.repeat(x[0:used:bin_size], 2)
+    x_out[2 * width:] = x[used:]
+    return x_out, y_out
+
+
+class ScrollingPlotNode(Node):
+    """
+    Plots a long history of samples (e.g. directly from DIPPIDNode) in a PlotWidget.
+    Samples are stored in a preallocated ring buffer of `capacity` samples, so appending never allocates.
+    Only the visible part of the history is drawn and it is min/max decimated to the width
+    of the plot in pixels, so the drawing cost does not grow with the length of the history.
+    Redraws happen at most once per screen refresh.
+    A block of a DIPPIDNode capability output (structured array) is plotted as its `field`
+    (e.g. 'x' for the accelerometer output), every value of the block is appended.
+    """
+    nodeName = "ScrollingPlot"
+
+    def __init__(self, name, capacity=2 ** 16):
+        terminals = {
+            'In': dict(io='in'),
+        }
+
+        self.capacity = capacity
+        # every sample is written twice (at i and i + capacity), so the last `capacity`
+        # samples are always available as one contiguous slice without copying
+        self._buffer = np.zeros(2 * capacity)
+        self._count = 0
+        self._dirty = False
+        # draws width / decimation points (e.g. set by a LoadController)
+        self.decimation = 1
+        # field of structured input blocks that is plotted
+        self.field = 'x'
+        self.plot = None
+        self.curve = None
+
+        self.redraw_timer = QtCore.QTimer()
+        self.redraw_timer.timeout.connect(self.redraw)
+
+        Node.__init__(self, name, terminals=terminals)
+
+    def setPlot(self, plot):
+        self.plot = plot
+        self.curve = plot.plot()
+        plot.getViewBox().sigXRangeChanged.connect(self._set_dirty)
+
+        screen = QtGui.QGuiApplication.primaryScreen()
+        refresh_rate = screen.refreshRate() if screen is not None else 60
+        self.redraw_timer.start(int(1000 / max(refresh_rate, 1)))
+
+    def _set_dirty(self, *args):
+        self._dirty = True
+
+    def append(self, samples):
+        samples = np.ravel(samples)
+        total = len(samples)
+        # samples that don't fit into the buffer anyway are skipped
+        samples = samples[-self.capacity:]
+        start = (self._count + total - len(samples)) % self.capacity
+        end = start + len(samples)
+
+        # the second copy is shifted by capacity, both may wrap around the end of the buffer
+        first = min(end, self.capacity) - start
+        self._buffer[start:start + first] = samples[:first]
+        self._buffer[start + self.capacity:start + self.capacity + first] = samples[:first]
+        self._buffer[0:len(samples) - first] = samples[first:]
+        self._buffer[self.capacity:self.capacity + len(samples) - first] = samples[first:]
+
+        self._count += total
+        self._dirty = True
+
+    def history(self):
+        """
+        Returns the sample numbers and a view of the stored samples (oldest first)
+        """
+        length = min(self._count, self.capacity)
+        end = self._count % self.capacity + self.capacity
+        x = np.arange(self._count - length, self._count)
+        return x, self._buffer[end - length:end]
+
+    @profiler.profile('ScrollingPlotNode.redraw')
+    def redraw(self):
+        if not self._dirty or self.curve is None:
+            return
+        self._dirty = False
+
+        x, y = self.history()
+        if len(y) == 0:
+            return
+
+        # while the plot auto-ranges it scrolls with the whole history,
+        # after zooming or panning only the visible samples are drawn
+        view_box = self.plot.getViewBox()
+        if not view_box.autoRangeEnabled()[0]:
+            x_min, x_max = view_box.viewRange()[0]
+            first = int(np.clip(np.floor(x_min) - x[0], 0, len(x)))
+            last = int(np.clip(np.ceil(x_max) - x[0] + 1, first, len(x)))
+            if last - first >= 2:
+                x, y = x[first:last], y[first:last]
+
+        x, y = minmax_decimate(x, y, max(int(view_box.width()) // self.decimation, 1))
+        self.curve.setData(x, y)
+
+    @profiler.profile('ScrollingPlotNode.process')
+    def process(self, **kwds):
+        samples = kwds['In']
+        if samples is None:
+            return
+        if getattr(samples, 'dtype', None) is not None and samples.dtype.names:
+            samples = samples[self.field]
+        self.append(samples)
 
 
 class DIPPIDNode(Node):
     """
     Outputs sensor data from DIPPID supported hardware.
 
-    Supported sensors: accelerometer (3 axis)
+    Supported sensors: accelerometer (3 axis) on accelX/Y/Z (latest value)
+    and every capability the device reports (accelerometer, gyroscope, gravity, buttons, ...):
+    an output terminal is added for each capability as soon as it is discovered.
+    It outputs the values received since the last update as one structured array
+    (see capability_dtype()), e.g. block['x'] for the x values of the block, block['time'] for their arrival time,
+    capabilities without new values output an empty block.
+    accelX/Y/Z carry the latest accelerometer value (a view, no values are copied), like before,
+    also if it did not change; connect the accelerometer output to get every value.
+    At most MAX_PENDING values per capability are kept between two updates.
     Text input box allows for setting a Bluetooth MAC address or Port.
     Pressing the "connect" button tries connecting to the DIPPID device.
     Update rate can be changed via a spinbox widget. Setting it to "0"
-    activates callbacks every time a new sensor value arrives (which is
-    quite often -> performance hit)
+    stops the updates, values that arrive in the meantime are not collected
+    (see poll_externally() for owners that update the node themselves).
     """
 
     nodeName = "DIPPID"
 
+    MAX_PENDING = 1024
+
     def __init__(self, name):
         terminals = {
             'accelX': dict(io='out'),
@@ -61,7 +216,18 @@ class DIPPIDNode(Node):
         }
 
         self.dippid = None
-        self._acc_vals = []
+        # capability -> values received since the last update (appended on the receive thread)
+        self._pending = {}
+        self._pending_lock = Lock()
+        # set while the update timer runs, the receive thread only collects values then
+        self._collecting = False
+        self._dtypes = {}
+        # capability -> structured array of the values collected by the last update
+        self._blocks = {}
+        # capability -> empty block, output for capabilities without new values
+        self._empty_blocks = {}
+        # the latest accelerometer value for accelX/Y/Z
+        self._latest_accel = None
 
         self._init_ui()
 
@@ -74,7 +240,7 @@ class DIPPIDNode(Node):
         self.ui = QtGui.QWidget()
         self.layout = QtGui.QGridLayout()
 
-        label = QtGui.QLabel("Port, BTADDR or TTY:")
+        label = QtGui.QLabel("Port, BTADDR, TTY or shm:Port")
         self.layout.addWidget(label)
 
         self.text = QtGui.QLineEdit()
@@ -98,20 +264,67 @@ class DIPPIDNode(Node):
         self.ui.setLayout(self.layout)
 
     def update_all_sensors(self):
-        if self.dippid is None or not self.dippid.has_capability('accelerometer'):
+        if self.dippid is None:
             return
 
-        v = self.dippid.get_value('accelerometer')
-        self._acc_vals = [v['x'], v['y'], v['z']]
+        self._discover_capabilities()
+        self._collect_blocks()
+        if not self._blocks:
+            return
 
         self.update()
 
-    def update_accel(self, acc_vals):
-        if not self.dippid.has_capability('accelerometer'):
+    def _discover_capabilities(self):
+        for capability in self.dippid.get_capabilities():
+            if capability in self._pending:
+                continue
+
+            with self._pending_lock:
+                self._pending[capability] = deque(maxlen=self.MAX_PENDING)
+            self.dippid.register_callback(capability, lambda value, key=capability: self._on_value(key, value))
+            if capability not in self.outputs():
+                self.addOutput(capability)
+
+            # the value that was received before the callback was registered
+            value = self.dippid.get_value(capability)
+            if value is not None and value != []:
+                self._on_value(capability, value)
+
+    def _on_value(self, capability, value):
+        # receive thread
+        if not self._collecting:
             return
-
-        self._acc_vals = [acc_vals['x'], acc_vals['y'], acc_vals['z']]
-        self.update()
+        with self._pending_lock:
+            self._pending[capability].append((perf_counter(), value))
+
+    def _collect_blocks(self):
+        with self._pending_lock:
+            pending = {key: values for key, values in self._pending.items() if values}
+            for key in pending:
+                self._pending[key] = deque(maxlen=self.MAX_PENDING)
+
+        self._blocks = {}
+        for capability, values in pending.items():
+            block = self._to_block(capability, values)
+            if block is not None:
+                self._blocks[capability] = block
+        if 'accelerometer' in self._blocks:
+            self._latest_accel = self._blocks['accelerometer'][-1:]
+
+    def _to_block(self, capability, values):
+        if capability not in self._dtypes:
+            self._dtypes[capability] = capability_dtype(values[0][1])
+        dtype = self._dtypes[capability]
+
+        try:
+            if isinstance(values[0][1], dict):
+                rows = [(t,) + tuple(value[field] for field in dtype.names[1:]) for t, value in values]
+            else:
+                rows = values
+            return np.array(rows, dtype=dtype)
+        except (TypeError, ValueError, KeyError):
+            # e.g. a value that is not a number
+            return None
 
     def ctrlWidget(self):
         return self.ui
@@ -123,15 +336,22 @@ class DIPPIDNode(Node):
         address = self.text.text().strip()
         self.connect_button.setText("connecting...")
 
-        if '/dev/tty' in address: # serial tty
-            self.dippid = SensorSerial(address)
-        elif ':' in address:
-            self.dippid = SensorWiimote(address)
-        elif address.isnumeric():
-            self.dippid = SensorUDP(int(address))
-        else:
-            print(f'invalid address: {address}')
-            print('allowed types: UDP port, bluetooth address, path to /dev/tty*')
+        try:
+            if '/dev/tty' in address: # serial tty
+                self.dippid = SensorSerial(address)
+            elif address.startswith('shm:'): # shared memory of a running dippid_shm.py receiver
+                from dippid_shm import SharedMemorySensor
+                self.dippid = SharedMemorySensor(address[len('shm:'):])
+            elif ':' in address:
+                self.dippid = SensorWiimote(address)
+            elif address.isnumeric():
+                self.dippid = SensorUDP(int(address))
+            else:
+                print(f'invalid address: {address}')
+                print('allowed types: UDP port, bluetooth address, path to /dev/tty*, shm:<port>')
+        except OSError as e:
+            # e.g. the port is in use or the receiver of shm:<port> is not running
+            print(f'could not connect to {address}: {e}', file=sys.stderr)
 
         if self.dippid is None:
             self.connect_button.setText("try again")
@@ -145,19 +365,249 @@ class DIPPIDNode(Node):
         if self.dippid is None:
             return
 
-        self.dippid.unregister_callback('accelerometer', self.update_accel)
-
         if rate == 0:
+            self._collecting = False
             self.update_timer.stop()
         else:
+            self._collecting = True
             self.update_timer.start(int(1000 / rate))
 
+    def poll_externally(self):
+        """
+        For owners that call update_all_sensors() themselves (e.g. the dashboard of analyze.py):
+        stops the update timer, but the values are still collected
+        """
+        self.update_rate_input.setValue(0)
+        self.update_timer.stop()
+        self._collecting = True
+
+    def _empty_block(self, capability):
+        if capability not in self._empty_blocks:
+            self._empty_blocks[capability] = np.empty(0, self._dtypes[capability])
+        return self._empty_blocks[capability]
+
+    @profiler.profile('DIPPIDNode.process')
     def process(self, **kwdargs):
-        return {'accelX': np.array([self._acc_vals[0]]), 'accelY': np.array([self._acc_vals[1]]), 'accelZ': np.array([self._acc_vals[2]])}
+        out = {capability: self._blocks[capability] if capability in self._blocks else self._empty_block(capability)
+               for capability in self._dtypes if capability in self.outputs()}
+        accel = self._latest_accel
+        if accel is not None:
+            out.update(accelX=accel['x'], accelY=accel['y'], accelZ=accel['z'])
+        return out
+
+
+def capability_dtype(value):
+    """
+    Structured dtype for the values of a capability: the arrival time and one float field per
+    component of a dict value (e.g. x, y, z) or a single field 'value' (e.g. for buttons)
+    """
+    if isinstance(value, dict):
+        return np.dtype([('time', 'f8')] + [(str(key), 'f8') for key in value])
+    return np.dtype([('time', 'f8'), ('value', 'f8')])
+
+
+class GestureNode(Node):
+    """
+    Recognizes gestures in the accelerometer (and optionally gyroscope) samples, see gestures.py.
+    Outputs the name of a recognized gesture on 'gesture' (None otherwise) and the
+    energy of every channel in the latest window on 'energy'.
+    Templates are recorded with the "record" button (perform the gesture right after pressing it)
+    and stored in gesture_templates.npz.
+    """
+    nodeName = "Gesture"
+
+    def __init__(self, name):
+        terminals = {
+            'accelX': dict(io='in'),
+            'accelY': dict(io='in'),
+            'accelZ': dict(io='in'),
+            'gyro': dict(io='in', optional=True),
+            'gesture': dict(io='out'),
+            'energy': dict(io='out'),
+        }
+
+        self.recognizer = GestureRecognizer()
+        try:
+            self.recognizer.load_templates()
+        except FileNotFoundError:
+            pass
+        self._record_until = None
+        self._last_gyro = np.zeros(3)
+
+        self._init_ui()
+
+        Node.__init__(self, name, terminals=terminals)
+
+    def _init_ui(self):
+        self.ui = QtGui.QWidget()
+        self.layout = QtGui.QGridLayout()
+
+        label = QtGui.QLabel("Gesture name:")
+        self.layout.addWidget(label)
+
+        self.name_input = QtGui.QLineEdit()
+        self.layout.addWidget(self.name_input)
+
+        self.record_button = QtGui.QPushButton("record")
+        self.record_button.clicked.connect(self.start_recording)
+        self.layout.addWidget(self.record_button)
+        self.ui.setLayout(self.layout)
+
+    def ctrlWidget(self):
+        return self.ui
+
+    def start_recording(self):
+        name = self.name_input.text().strip()
+        if not name:
+            return
+
+        self._record_until = self.recognizer.samples + self.recognizer.window
+        self.record_button.setText("recording...")
+
+    def _finish_recording(self):
+        self.recognizer.add_template(self.name_input.text().strip(), self.recognizer.last_window())
+        self.recognizer.save_templates(TEMPLATE_FILE)
+        self._record_until = None
+        self.record_button.setText("record")
+
+    def _align_gyro(self, gyro, length):
+        """
+        Gyroscope values for length accelerometer samples, shape (length, 3).
+        A block of values (e.g. the gyroscope output of DIPPIDNode) is aligned to the newest
+        accelerometer samples, missing rows repeat the oldest gyroscope value.
+        An empty block repeats the last value of the previous block.
+        A single value (dict or 3-vector) is used for all samples.
+        """
+        if gyro is None:
+            gyro = (0, 0, 0)
+        elif isinstance(gyro, dict):
+            gyro = (gyro['x'], gyro['y'], gyro['z'])
+        elif getattr(gyro, 'dtype', None) is not None and gyro.dtype.names:
+            rows = np.column_stack((gyro['x'], gyro['y'], gyro['z']))
+            # an empty block means no new values, the device keeps its last rotation rate
+            if len(rows) == 0:
+                return np.broadcast_to(self._last_gyro, (length, 3))
+            self._last_gyro = rows[-1]
+            missing = np.broadcast_to(rows[0], (max(length - len(rows), 0), 3))
+            return np.concatenate((missing, rows[max(len(rows) - length, 0):]))
+
+        return np.broadcast_to(np.ravel(gyro), (length, 3))
+
+    @profiler.profile('GestureNode.process')
+    def process(self, **kwds):
+        accel = np.column_stack((kwds['accelX'], kwds['accelY'], kwds['accelZ']))
+        samples = np.column_stack((accel, self._align_gyro(kwds.get('gyro'), len(accel))))
+        events = self.recognizer.add_samples(samples)
+
+        if self._record_until is not None and self.recognizer.samples >= self._record_until:
+            self._finish_recording()
+
+        energy = self.recognizer.features['energy'][-1] if self.recognizer.features is not None else None
+        return {'gesture': events[-1].name if events else None, 'energy': energy}
+
+
+class WindowStatsNode(Node):
+    """
+    Statistics of the last n samples on its input (e.g. directly from DIPPIDNode),
+    updated incrementally (see DIPPID.SlidingWindowStats), so every sample costs the same
+    no matter how long the window is.
+    Every output is an array with one value, like the outputs of DIPPIDNode,
+    so they can be connected to NormalVectorNode or a BufferNode for plotting.
+    A spinbox widget allows for setting the size of the window.
+    Default size is 32 samples.
+    median, p5 and p95 come from a histogram between "low" and "high" (default -4 to 4, fits the
+    accelerometer in g), values outside count as the nearest border, so set the range to the
+    values of the input (e.g. several hundred for a gyroscope in deg/s).
+    """
+    nodeName = "WindowStats"
+
+    OUTPUTS = ('mean', 'std', 'min', 'max', 'median', 'p5', 'p95')
+
+    def __init__(self, name):
+        terminals = {'dataIn': dict(io='in')}
+        for output in self.OUTPUTS:
+            terminals[output] = dict(io='out')
+
+        self.stats = SlidingWindowStats(32)
+        self._init_ui()
+
+        Node.__init__(self, name, terminals=terminals)
+
+    def _init_ui(self):
+        self.ui = QtGui.QWidget()
+        self.layout = QtGui.QGridLayout()
+
+        label = QtGui.QLabel("Window (samples)")
+        self.layout.addWidget(label)
+
+        self.window_input = QtGui.QSpinBox()
+        self.window_input.setMinimum(2)
+        self.window_input.setMaximum(100000)
+        self.window_input.setValue(self.stats.window)
+        self.window_input.valueChanged.connect(self.set_window)
+        self.layout.addWidget(self.window_input)
+
+        label2 = QtGui.QLabel("Percentile range (low, high)")
+        self.layout.addWidget(label2)
+
+        self.low_input = QtGui.QDoubleSpinBox()
+        self.high_input = QtGui.QDoubleSpinBox()
+        for spinbox, value in ((self.low_input, self.stats.low), (self.high_input, self.stats.high)):
+            spinbox.setRange(-1e6, 1e6)
+            spinbox.setValue(value)
+            spinbox.valueChanged.connect(self.set_range)
+            self.layout.addWidget(spinbox)
+        self.ui.setLayout(self.layout)
+
+    def ctrlWidget(self):
+        return self.ui
+
+    def set_window(self, window):
+        self.stats.window = window
+        self.stats.reset()
+
+    def set_range(self):
+        low = self.low_input.value()
+        high = self.high_input.value()
+        if high <= low:
+            return
+        self.stats = SlidingWindowStats(self.stats.window, low, high, self.stats.bins)
+
+    @profiler.profile('WindowStatsNode.process')
+    def process(self, **kwds):
+        if kwds['dataIn'] is None:
+            return None
+        self.stats.add_block(np.ravel(kwds['dataIn']))
+
+        stats = self.stats
+        values = (stats.mean, stats.std, stats.min, stats.max,
+                  stats.percentile(50), stats.percentile(5), stats.percentile(95))
+        return {output: np.array([value]) for output, value in zip(self.OUTPUTS, values)}
+
+
+# node types of this module and their paths in the flowchart library
+NODE_TYPES = [
+    (BufferNode, [('Data',)]),
+    (ScrollingPlotNode, [('Display',)]),
+    (DIPPIDNode, [('Sensor',)]),
+    (GestureNode, [('Data',)]),
+    (WindowStatsNode, [('Data',)]),
+]
+
+
+def register_nodes():
+    """
+    Registers the nodes of this module in the flowchart library.
+    This is not done on import, so only applications that use the nodes pay for it.
+    """
+    for node_type, paths in NODE_TYPES:
+        fclib.registerNodeType(node_type, paths, override=True)
 
-fclib.registerNodeType(DIPPIDNode, [('Sensor',)])
 
 if __name__ == '__main__':
+    install_interrupt_handler()
+    register_nodes()
+
     app = QtGui.QApplication([])
     win = QtGui.QMainWindow()
     win.setWindowTitle('DIPPIDNode demo')
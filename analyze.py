@@ -6,9 +6,27 @@ from pyqtgraph.Qt import QtGui, QtCore
 import pyqtgraph as pg
 from enum import Enum
 import numpy as np
-from DIPPID import SensorUDP, SensorSerial, SensorWiimote
-from DIPPID_pyqtnode import BufferNode, DIPPIDNode
+from DIPPID import Sensor, SensorUDP, SensorSerial, SensorWiimote, MaxRate, profiler, install_interrupt_handler
+from DIPPID import add_scheduling_params, scheduling_from_params, format_receive_latency
+import DIPPID_pyqtnode
+from DIPPID_pyqtnode import BufferNode, DIPPIDNode, ScrollingPlotNode
+import analyze_worker
+import analyze_stream
+from analyze_worker import PipelineWorker, normal_vector
+from dippid_scheduler import FlowchartScheduler
+from dippid_load import LoadController, LoadStep
+import argparse
+import atexit
 import sys
+from time import perf_counter
+
+# how often the results of the worker are drawn (Hz)
+WORKER_DRAW_RATE = 60
+# how often the dashboard evaluates its devices and redraws (Hz)
+DASHBOARD_RATE = 30
+# a device of the dashboard without new values for this long is paused (seconds)
+QUIET_TIMEOUT = 2.0
+DASHBOARD_COLUMNS = 4
 
 
 class Axis(Enum):
@@ -35,6 +53,7 @@ class NormalVectorNode(Node):
 
         self.normal_vector = ()
 
+    @profiler.profile('NormalVectorNode.process')
     def process(self, **kargs):
         """
         Processes the two inputs and returns the value
@@ -42,17 +61,11 @@ class NormalVectorNode(Node):
         Without negating, the rotation would only be shown properly when pointing the charging port at the screen,
         instead of the usual "top" of the phone.
         """
-        accel_1 = -kargs[self.AXIS_1_IN][0]  # negated because this seemed more logical on my device
-        accel_2 = kargs[self.AXIS_2_IN][0]
-
         # didn't work with list of tuples, using np.array instead like in DIPPIDNode
-        self.normal_vector = np.array([[0, 0], [accel_1, accel_2]])
+        self.normal_vector = normal_vector(kargs[self.AXIS_1_IN][0], kargs[self.AXIS_2_IN][0])
         return {self.DATA_OUT: self.normal_vector}
 
 
-fclib.registerNodeType(NormalVectorNode, [('Assignment 7',)])
-
-
 class LogNode(Node):
     INPUT = "input"
 
@@ -64,11 +77,222 @@ class LogNode(Node):
         }
         Node.__init__(self, name, terminals=terminals)
 
+        # switched off by the LoadController when the application can't keep up
+        self.enabled = True
+
+    @profiler.profile('LogNode.process')
     def process(self, **kargs):
-        print(kargs[self.INPUT][0])
+        if self.enabled:
+            print(kargs[self.INPUT][0])
 
 
-fclib.registerNodeType(LogNode, [('Assignment 7',)])
+class WorkerNode(Node):
+    """
+    Hands the accelerometer values over to a PipelineWorker, which does the buffering,
+    the normal vector and the logging outside of the GUI thread.
+    The results are drawn by draw_worker_results().
+    """
+    ACCEL_X_IN = "accelX"
+    ACCEL_Y_IN = "accelY"
+    ACCEL_Z_IN = "accelZ"
+
+    nodeName = "Worker"
+
+    def __init__(self, name):
+        terminals = {
+            self.ACCEL_X_IN: dict(io='in'),
+            self.ACCEL_Y_IN: dict(io='in'),
+            self.ACCEL_Z_IN: dict(io='in'),
+        }
+        Node.__init__(self, name, terminals=terminals)
+
+        self.worker = None
+
+    def process(self, **kargs):
+        if self.worker is None:
+            return
+        self.worker.submit((kargs[self.ACCEL_X_IN][0], kargs[self.ACCEL_Y_IN][0], kargs[self.ACCEL_Z_IN][0]))
+
+
+class DashboardDevice:
+    """
+    The DIPPID -> Buffer (x, y, z) and NormalVector chain of one device in the dashboard
+    and the two plots it is drawn in.
+    """
+
+    def __init__(self, flowchart, address, row, view):
+        self.address = address
+        self.quiet = True
+        self.last_value_time = None
+        self.new_value = False
+
+        self.dippid_node = flowchart.createNode(DIPPIDNode.nodeName, pos=(0, row * 150))
+        self.buffer_nodes = []
+        for i, axis in enumerate(('accelX', 'accelY', 'accelZ')):
+            buffer_node = flowchart.createNode('Buffer', pos=(100, row * 150 + i * 50))
+            flowchart.connectTerminals(self.dippid_node[axis], buffer_node['dataIn'])
+            self.buffer_nodes.append(buffer_node)
+        self.normal_vector_node = flowchart.createNode(NormalVectorNode.nodeName, pos=(200, row * 150))
+        flowchart.connectTerminals(self.dippid_node['accelX'], self.normal_vector_node[NormalVectorNode.AXIS_1_IN])
+        flowchart.connectTerminals(self.dippid_node['accelZ'], self.normal_vector_node[NormalVectorNode.AXIS_2_IN])
+
+        self.accel_plot = view.addPlot()
+        self.accel_plot.setYRange(-1, 1)
+        self.curves = [self.accel_plot.plot(pen=pen) for pen in ('r', 'g', 'b')]
+        self.normal_plot = view.addPlot()
+        self.normal_plot.setXRange(-1, 1)
+        self.normal_plot.setYRange(-1, 1)
+        self.normal_curve = self.normal_plot.plot()
+
+        self.dippid_node.text.setText(address)
+        self.dippid_node.connect_device()
+        # the dashboard polls all devices with one timer instead of one timer per node
+        self.dippid_node.poll_externally()
+        # a device that can't be connected (e.g. port in use) is shown as not connected
+        self.set_quiet(True)
+        if self.dippid_node.dippid is not None:
+            # only used to notice that new values arrived, so it doesn't have to run for every value
+            self.dippid_node.dippid.register_callback('accelerometer', self.on_value, MaxRate(DASHBOARD_RATE))
+
+    def on_value(self, value):
+        # receive thread
+        self.last_value_time = perf_counter()
+        self.new_value = True
+
+    def set_quiet(self, quiet):
+        self.quiet = quiet
+        if self.dippid_node.dippid is None:
+            self.accel_plot.setTitle(f'{self.address} (not connected)')
+        else:
+            self.accel_plot.setTitle(f'{self.address} (quiet)' if quiet else self.address)
+
+    def redraw(self):
+        for curve, buffer_node in zip(self.curves, self.buffer_nodes):
+            curve.setData(buffer_node['dataOut'].value())
+        normal = self.normal_vector_node[NormalVectorNode.DATA_OUT].value()
+        if normal is not None:
+            self.normal_curve.setData(normal[:, 0], normal[:, 1])
+
+
+class Dashboard:
+    """
+    Monitors many devices in one window: one DashboardDevice per address, all drawn in one GraphicsLayoutWidget.
+    A single timer polls all devices, evaluates the chart once (see FlowchartScheduler)
+    and redraws the plots of all devices that got new values in one batch.
+    Devices without new values for QUIET_TIMEOUT seconds are paused until they send again.
+    """
+
+    def __init__(self, flowchart, addresses, scheduler=None):
+        self.scheduler = scheduler
+        self.view = pg.GraphicsLayoutWidget()
+        self.devices = []
+        for i, address in enumerate(addresses):
+            # two plots per device
+            if i > 0 and i % DASHBOARD_COLUMNS == 0:
+                self.view.nextRow()
+            self.devices.append(DashboardDevice(flowchart, address, i, self.view))
+
+        self.timer = QtCore.QTimer()
+        self.timer.timeout.connect(self.tick)
+        self.timer.start(int(1000 / DASHBOARD_RATE))
+
+    @profiler.profile('Dashboard.tick')
+    def tick(self):
+        now = perf_counter()
+        updated = []
+        for device in self.devices:
+            if device.new_value:
+                device.new_value = False
+                device.dippid_node.update_all_sensors()
+                updated.append(device)
+                if device.quiet:
+                    device.set_quiet(False)
+            elif not device.quiet and now - device.last_value_time > QUIET_TIMEOUT:
+                device.set_quiet(True)
+
+        if not updated:
+            return
+        if self.scheduler is not None:
+            self.scheduler.evaluate()
+
+        self.view.setUpdatesEnabled(False)
+        for device in updated:
+            device.redraw()
+        self.view.setUpdatesEnabled(True)
+
+
+def expand_addresses(addresses):
+    """
+    Addresses for the dashboard, port ranges like 5700-5715 are expanded
+    """
+    expanded = []
+    for address in addresses:
+        first, _, last = address.partition('-')
+        if first.isnumeric() and last.isnumeric():
+            expanded += [str(port) for port in range(int(first), int(last) + 1)]
+        else:
+            expanded.append(address)
+    return expanded
+
+
+def nodes_of_type(node_type):
+    return [node for node in fc.nodes().values() if isinstance(node, node_type)]
+
+
+def scale_timers(timers, factor):
+    for timer in timers:
+        timer.setInterval(max(int(timer.interval() * factor), 1))
+
+
+def create_load_steps(timers):
+    """
+    What the LoadController gives up when the application can't keep up, in this order:
+    half the plot rate (DIPPIDNode polling and the given redraw timers), average 4 samples
+    in the buffers and plot fewer points, no LogNode output.
+    """
+    rates = {}
+
+    def lower_plot_rate():
+        for node in nodes_of_type(DIPPIDNode):
+            rates[node] = node.update_rate_input.value()
+            if rates[node] > 1:
+                node.update_rate_input.setValue(rates[node] // 2)
+        scale_timers(timers, 2)
+
+    def restore_plot_rate():
+        for node, rate in rates.items():
+            node.update_rate_input.setValue(rate)
+        scale_timers(timers, 0.5)
+
+    def set_decimation(decimation):
+        for node in nodes_of_type(BufferNode) + nodes_of_type(ScrollingPlotNode):
+            node.decimation = decimation
+
+    def set_log(enabled):
+        for node in nodes_of_type(LogNode):
+            node.enabled = enabled
+
+    return [
+        LoadStep('plot rate', lower_plot_rate, restore_plot_rate),
+        LoadStep('decimation', lambda: set_decimation(4), lambda: set_decimation(1)),
+        LoadStep('log output', lambda: set_log(False), lambda: set_log(True)),
+    ]
+
+
+def connected_sensors():
+    return [node.dippid for node in nodes_of_type(DIPPIDNode)]
+
+
+def print_receive_latency():
+    for node in nodes_of_type(DIPPIDNode):
+        if node.dippid is not None:
+            print(format_receive_latency(f'{node.name()} ({node.addr})', node.dippid), file=sys.stderr)
+
+
+def register_nodes():
+    DIPPID_pyqtnode.register_nodes()
+    for node_type in (NormalVectorNode, LogNode, WorkerNode):
+        fclib.registerNodeType(node_type, [('Assignment 7',)], override=True)
 
 
 def create_plot_widget_x():
@@ -104,12 +328,16 @@ def create_plot_widget_normal():
     plot_widget_dict[Axis.NORMAL] = pw_n
 
 
-def create_nodes():
+def create_nodes(scrolling=False):
     x_location = 250
     y_location = -100
 
     for key in plot_widget_dict:
-        node = fc.createNode('PlotWidget', pos=(x_location, y_location))
+        # the accelerometer axes can be plotted with their whole history instead of the last 32 samples
+        if scrolling and key != Axis.NORMAL:
+            node = fc.createNode(ScrollingPlotNode.nodeName, pos=(x_location, y_location))
+        else:
+            node = fc.createNode('PlotWidget', pos=(x_location, y_location))
         node.setPlot(plot_widget_dict[key])
 
         node_dict[key] = node
@@ -127,6 +355,23 @@ def connect_nodes():
     fc.connectTerminals(buffer_node_y['dataOut'], node_dict[Axis.Y]['In'])
     fc.connectTerminals(buffer_node_z['dataOut'], node_dict[Axis.Z]['In'])
 
+    connect_normal_vector_and_log_nodes()
+
+
+def connect_scrolling_nodes():
+    # the accelerometer output of the DIPPID Node directly to the ScrollingPlot Nodes,
+    # they append every value of the block and keep the history themselves
+    # (the output is added before the device reports the capability)
+    if 'accelerometer' not in dippid_node.outputs():
+        dippid_node.addOutput('accelerometer')
+    for key, field in ((Axis.X, 'x'), (Axis.Y, 'y'), (Axis.Z, 'z')):
+        node_dict[key].field = field
+        fc.connectTerminals(dippid_node['accelerometer'], node_dict[key]['In'])
+
+    connect_normal_vector_and_log_nodes()
+
+
+def connect_normal_vector_and_log_nodes():
     # Normal Vector Node - Rotation around Y axis
     fc.connectTerminals(dippid_node['accelX'], normal_vector_node[NormalVectorNode.AXIS_1_IN])
     fc.connectTerminals(dippid_node['accelZ'], normal_vector_node[NormalVectorNode.AXIS_2_IN])
@@ -136,25 +381,94 @@ def connect_nodes():
     fc.connectTerminals(dippid_node['accelX'], log_node[LogNode.INPUT])
 
 
-def set_port_from_params():
+def connect_worker_nodes(worker):
+    # DIPPID Node to Worker Node, everything else is computed by the worker
+    worker_node.worker = worker
+    fc.connectTerminals(dippid_node['accelX'], worker_node[WorkerNode.ACCEL_X_IN])
+    fc.connectTerminals(dippid_node['accelY'], worker_node[WorkerNode.ACCEL_Y_IN])
+    fc.connectTerminals(dippid_node['accelZ'], worker_node[WorkerNode.ACCEL_Z_IN])
+
+    for key, plot_widget in plot_widget_dict.items():
+        curve_dict[key] = plot_widget.plot()
+
+
+def draw_worker_results():
+    # only the newest result is drawn, the arrays are ready to draw
+    result = worker.latest_result()
+    if result is None:
+        return
+
+    for key, name in ((Axis.X, analyze_worker.X), (Axis.Y, analyze_worker.Y), (Axis.Z, analyze_worker.Z)):
+        curve_dict[key].setData(result[name])
+
+    normal = result[analyze_worker.NORMAL]
+    curve_dict[Axis.NORMAL].setData(normal[:, 0], normal[:, 1])
+
+
+def parse_params():
+    parser = argparse.ArgumentParser(description="Plots the accelerometer data of a DIPPID device")
+    # if no port is passed, just use the default (5700)
+    parser.add_argument('ports', nargs='*',
+                        help="UDP port of the DIPPID device or shm:<port> for a running dippid_shm.py receiver "
+                             "(with --dashboard: any number of addresses and port ranges like 5700-5715)")
+    parser.add_argument('--dashboard', action='store_true',
+                        help="monitor all given devices, each with its own buffers and normal vector")
+    parser.add_argument('--worker', choices=PipelineWorker.MODES,
+                        help="compute buffers, normal vector and log in a separate process or thread")
+    parser.add_argument('--scrolling', action='store_true',
+                        help="plot the whole history of the accelerometer axes instead of the last 32 samples")
+    parser.add_argument('--scheduler', action='store_true',
+                        help="evaluate the flowchart at most once per frame (faster, but nodes only see the "
+                             "latest value of a frame, e.g. LogNode skips the values in between)")
+    parser.add_argument('--no-load-control', action='store_true',
+                        help="don't lower the plot rate, decimate and stop logging when the application can't keep up")
+    parser.add_argument('--node-timings', action='store_true',
+                        help="print the evaluation time of every node on exit (with --scheduler)")
+    parser.add_argument('--headless', action='store_true',
+                        help="no window, run the pipeline as a stream (see analyze_stream.py)")
+    analyze_stream.add_params(parser)
+    add_scheduling_params(parser)
+    params = parser.parse_args()
+    if params.dashboard and (params.worker or params.scrolling or params.headless):
+        parser.error("--dashboard can't be combined with --worker, --scrolling or --headless")
+    return params
+
+
+def set_port_from_params(port):
     # if no parameter is passed, just use the default (5700)
-    if len(sys.argv) == 1:
+    if port is None:
         return
 
-    if len(sys.argv) > 2:
-        print("Please pass only a port number as parameter")
-        sys.exit(4)
+    if port.startswith('shm:') and port[len('shm:'):].isnumeric():
+        # read from a running dippid_shm.py receiver instead of binding the port
+        dippid_node.addr = port
+        dippid_node.text.setText(port)
     else:
         try:
-            port = int(sys.argv[1])
-            dippid_node.addr = port
-            dippid_node.text.setText(sys.argv[1])
+            dippid_node.addr = int(port)
+            dippid_node.text.setText(port)
         except ValueError:
             print("Please pass a valid port number as parameter")
             sys.exit(4)
 
 
 if __name__ == '__main__':
+    params = parse_params()
+    port = params.ports[0] if params.ports else None
+    # applies to every sensor (and dippid_shm publisher process) created from now on
+    Sensor.scheduling = scheduling_from_params(params)
+
+    if params.headless:
+        # no QApplication is created in this mode
+        try:
+            analyze_stream.run(port, params.capture, params.output, params.record, params.block_size)
+        except KeyboardInterrupt:
+            pass
+        sys.exit(0)
+
+    install_interrupt_handler()
+    register_nodes()
+
     app = QtGui.QApplication([])
     win = QtGui.QMainWindow()
     win.setWindowTitle('DIPPIDNode demo')
@@ -165,28 +479,69 @@ if __name__ == '__main__':
 
     # Create an empty flowchart with a single input and output
     fc = Flowchart(terminals={})
-    layout.addWidget(fc.widget(), 0, 0, 2, 1)
-
-    plot_widget_dict = {}
-    node_dict = {}
-
-    create_plot_widget_x()
-    create_plot_widget_y()
-    create_plot_widget_z()
-    create_plot_widget_normal()
 
-    create_nodes()
-
-    dippid_node = fc.createNode('DIPPID', pos=(0, -50))
-    buffer_node_x = fc.createNode('Buffer', pos=(100, -100))
-    buffer_node_y = fc.createNode('Buffer', pos=(100, -50))
-    buffer_node_z = fc.createNode('Buffer', pos=(100, 0))
-    normal_vector_node = fc.createNode(NormalVectorNode.nodeName, pos=(100, 50))
-    log_node = fc.createNode(LogNode.nodeName, pos=(250, 100))
-
-    set_port_from_params()
-
-    connect_nodes()
+    scheduler = None
+    if params.scheduler:
+        # one evaluation pass per frame instead of one per node update
+        scheduler = FlowchartScheduler(fc)
+        if params.node_timings:
+            atexit.register(scheduler.print_timings)
+    if params.receive_latency:
+        atexit.register(print_receive_latency)
+
+    if params.dashboard:
+        # the chart of many devices is too big to be edited, only the plots are shown
+        dashboard = Dashboard(fc, expand_addresses(params.ports or ['5700']), scheduler)
+        layout.addWidget(dashboard.view, 0, 0)
+    else:
+        layout.addWidget(fc.widget(), 0, 0, 2, 1)
+
+        plot_widget_dict = {}
+        node_dict = {}
+        curve_dict = {}
+
+        create_plot_widget_x()
+        create_plot_widget_y()
+        create_plot_widget_z()
+        create_plot_widget_normal()
+
+        dippid_node = fc.createNode('DIPPID', pos=(0, -50))
+        set_port_from_params(port)
+
+        if params.worker:
+            # the flowchart only collects the samples, the plots are drawn from the worker results
+            worker = PipelineWorker(params.worker, log=True)
+            worker_node = fc.createNode(WorkerNode.nodeName, pos=(100, -50))
+            connect_worker_nodes(worker)
+
+            draw_timer = QtCore.QTimer()
+            draw_timer.timeout.connect(draw_worker_results)
+            draw_timer.start(int(1000 / WORKER_DRAW_RATE))
+        elif params.scrolling:
+            create_nodes(scrolling=True)
+
+            normal_vector_node = fc.createNode(NormalVectorNode.nodeName, pos=(100, 50))
+            log_node = fc.createNode(LogNode.nodeName, pos=(250, 100))
+
+            connect_scrolling_nodes()
+        else:
+            create_nodes()
+
+            buffer_node_x = fc.createNode('Buffer', pos=(100, -100))
+            buffer_node_y = fc.createNode('Buffer', pos=(100, -50))
+            buffer_node_z = fc.createNode('Buffer', pos=(100, 0))
+            normal_vector_node = fc.createNode(NormalVectorNode.nodeName, pos=(100, 50))
+            log_node = fc.createNode(LogNode.nodeName, pos=(250, 100))
+
+            connect_nodes()
+
+    if not params.no_load_control:
+        redraw_timers = [node.redraw_timer for node in nodes_of_type(ScrollingPlotNode)]
+        if params.dashboard:
+            redraw_timers.append(dashboard.timer)
+        if params.worker:
+            redraw_timers.append(draw_timer)
+        load_controller = LoadController(create_load_steps(redraw_timers), connected_sensors)
 
     win.show()
     if (sys.flags.interactive != 1) or not hasattr(QtCore, 'PYQT_VERSION'):
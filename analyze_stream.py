@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+# coding: utf-8
+# -*- coding: utf-8 -*-
+
+"""
+Headless version of the analyze.py pipeline (DIPPID -> buffer -> normal vector -> log) without Qt.
+
+Every stage is a generator that takes an iterator of sample blocks and yields blocks, so the stages
+can be combined freely and a run of any length only keeps a constant number of samples in memory.
+A block is a dict of equally long NumPy arrays ('t', 'x', 'y', 'z', ...); stages add columns to it.
+
+Usage:
+    python3 analyze_stream.py 5700                      live data from a DIPPID device
+    python3 analyze_stream.py shm:5700                  live data from a running dippid_shm.py receiver
+    python3 analyze_stream.py --capture session.txt     recorded data (one DIPPID packet per line)
+    --output -|FILE|tcp:HOST:PORT|udp:HOST:PORT         where the log goes (default: stdout)
+    --record FILE                                       also save the received packets as a capture
+"""
+
+import argparse
+import json
+import socket
+import sys
+from collections import deque
+from threading import Condition
+from time import time
+import numpy as np
+from DIPPID import SensorUDP, profiler
+
+# samples per block, bigger blocks mean less overhead per sample but more latency
+BLOCK_SIZE = 64
+# a block is emitted after this time even if it is not full (seconds)
+BLOCK_TIMEOUT = 0.05
+# same default as BufferNode
+BUFFER_SIZE = 32
+# samples the live source keeps while the pipeline is busy, the oldest are dropped when it is full
+MAX_PENDING_SAMPLES = 100000
+
+AXES = ('x', 'y', 'z')
+
+
+def make_block(rows):
+    rows = np.asarray(rows, dtype=np.float64).reshape(-1, 4)
+    return {'t': rows[:, 0], 'x': rows[:, 1], 'y': rows[:, 2], 'z': rows[:, 3]}
+
+
+def open_sensor(address):
+    if address.startswith('shm:'):
+        from dippid_shm import SharedMemorySensor
+        return SharedMemorySensor(address[len('shm:'):])
+    return SensorUDP(int(address))
+
+
+def sensor_blocks(sensor, block_size=BLOCK_SIZE, block_timeout=BLOCK_TIMEOUT, record=None):
+    """
+    Source: yields blocks of accelerometer samples from a connected sensor.
+    Samples are collected by a callback on the receive thread in a bounded queue.
+    """
+    pending = deque(maxlen=MAX_PENDING_SAMPLES)
+    ready = Condition()
+
+    def on_accelerometer(value):
+        timestamp = time()
+        with ready:
+            pending.append((timestamp, value['x'], value['y'], value['z']))
+            if len(pending) >= block_size:
+                ready.notify()
+        if record is not None:
+            record.write(f'{timestamp}\t{json.dumps({"accelerometer": value})}\n')
+
+    sensor.register_callback('accelerometer', on_accelerometer)
+    try:
+        while True:
+            with ready:
+                ready.wait_for(lambda: len(pending) >= block_size, block_timeout)
+                rows = [pending.popleft() for _ in range(min(len(pending), block_size))]
+            if rows:
+                yield make_block(rows)
+    finally:
+        sensor.unregister_callback('accelerometer', on_accelerometer)
+
+
+def capture_blocks(path, block_size=BLOCK_SIZE):
+    """
+    Source: yields blocks of accelerometer samples from a capture file.
+    Every line is a DIPPID packet, optionally preceded by a timestamp and a tab
+    (the format written with --record). Lines without a timestamp are numbered instead.
+    Malformed lines (invalid JSON, timestamp or values) are skipped.
+    """
+    rows = []
+    with open(path) as capture:
+        for line_number, line in enumerate(capture):
+            timestamp, _, packet = line.rpartition('\t')
+            try:
+                value = json.loads(packet)['accelerometer']
+                row = (float(timestamp) if timestamp else line_number,
+                       float(value['x']), float(value['y']), float(value['z']))
+            except (json.decoder.JSONDecodeError, KeyError, TypeError, ValueError):
+                # malformed packets, values and timestamps are skipped
+                continue
+
+            rows.append(row)
+            if len(rows) == block_size:
+                yield make_block(rows)
+                rows = []
+
+    if rows:
+        yield make_block(rows)
+
+
+def buffer_stage(blocks, buffer_size=BUFFER_SIZE):
+    """
+    Keeps the last buffer_size samples of every axis, like one BufferNode per axis.
+    Adds 'buffer' to each block: an array (n <= buffer_size, 3) with the newest samples last.
+    """
+    buffer = np.zeros((buffer_size, 3))
+    count = 0
+
+    for block in blocks:
+        samples = np.column_stack([block[axis] for axis in AXES])[-buffer_size:]
+        buffer = np.roll(buffer, -len(samples), axis=0)
+        buffer[-len(samples):] = samples
+        count = min(count + len(block['t']), buffer_size)
+        block['buffer'] = buffer[-count:]
+        yield block
+
+
+def normal_vector_stage(blocks):
+    """
+    Adds the end point of the normal vector of every sample ('normal_x', 'normal_y'),
+    the same values NormalVectorNode computes for the rotation around Y.
+    """
+    for block in blocks:
+        block['normal_x'] = -block['x']
+        block['normal_y'] = block['z']
+        yield block
+
+
+def log_stage(blocks, sink, columns=('t', 'x', 'y', 'z', 'normal_x', 'normal_y')):
+    """
+    Writes one line per sample with the given columns to sink (a file-like object with write()).
+    """
+    for block in blocks:
+        with profiler.span('log_stage.write'):
+            lines = np.column_stack([block[column] for column in columns])
+            sink.write('\n'.join(' '.join(f'{value:.6f}' for value in row) for row in lines) + '\n')
+            sink.flush()
+        yield block
+
+
+class SocketSink():
+    """
+    File-like object that sends everything written to it over a TCP connection or as UDP datagrams.
+    """
+
+    def __init__(self, protocol, host, port):
+        if protocol == 'tcp':
+            self._sock = socket.create_connection((host, port))
+        else:
+            self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self._sock.connect((host, port))
+
+    def write(self, text):
+        self._sock.sendall(text.encode())
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self._sock.close()
+
+
+def open_sink(output):
+    if output == '-':
+        return sys.stdout
+    if output.startswith('tcp:') or output.startswith('udp:'):
+        protocol, host, port = output.split(':')
+        return SocketSink(protocol, host, int(port))
+    return open(output, 'w')
+
+
+def build_pipeline(source, sink, buffer_size=BUFFER_SIZE):
+    return log_stage(normal_vector_stage(buffer_stage(source, buffer_size)), sink)
+
+
+def run(address=None, capture=None, output='-', record=None, block_size=BLOCK_SIZE, buffer_size=BUFFER_SIZE):
+    """
+    Runs the pipeline until the capture ends or the program is interrupted.
+    """
+    sink = open_sink(output)
+    record_file = open(record, 'a') if record else None
+    sensor = None
+
+    if capture:
+        source = capture_blocks(capture, block_size)
+    else:
+        sensor = open_sensor(address or '5700')
+        source = sensor_blocks(sensor, block_size, record=record_file)
+
+    try:
+        for _ in build_pipeline(source, sink, buffer_size):
+            pass
+    finally:
+        if sensor is not None:
+            sensor.disconnect()
+        if record_file is not None:
+            record_file.close()
+        if sink is not sys.stdout:
+            sink.close()
+
+
+def add_params(parser):
+    parser.add_argument('--capture', help="read a recorded capture instead of a live device")
+    parser.add_argument('--output', default='-', help="-, a file, tcp:HOST:PORT or udp:HOST:PORT (default: -)")
+    parser.add_argument('--record', help="append the received packets to this capture file")
+    parser.add_argument('--block-size', type=int, default=BLOCK_SIZE, help="samples per block")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Headless DIPPID -> buffer -> normal vector -> log pipeline")
+    parser.add_argument('port', nargs='?', help="UDP port of the DIPPID device or shm:<port> (default: 5700)")
+    add_params(parser)
+    params = parser.parse_args()
+
+    try:
+        run(params.port, params.capture, params.output, params.record, params.block_size)
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,118 @@
+import multiprocessing
+import queue
+import threading
+import numpy as np
+from DIPPID import profiler
+
+# same default as BufferNode
+BUFFER_SIZE = 32
+
+X = "X"
+Y = "Y"
+Z = "Z"
+NORMAL = "Normal"
+LOG = "Log"
+
+
+def normal_vector(accel_1, accel_2):
+    """
+    Returns a vector from the origin that shows the rotation around the third axis.
+    accel_1 is negated because this seemed more intuitive on the device I tested with (Pixel 3)
+    """
+    return np.array([[0, 0], [-accel_1, accel_2]])
+
+
+class Pipeline:
+    """
+    The non-GUI part of the analyze.py flowchart without Qt:
+    one buffer per accelerometer axis, the normal vector (rotation around Y) and the value for the log.
+    process() takes one sample (x, y, z) and returns ready-to-draw arrays.
+    """
+
+    def __init__(self, buffer_size=BUFFER_SIZE):
+        self.buffer_size = buffer_size
+        self._buffers = {X: np.array([]), Y: np.array([]), Z: np.array([])}
+
+    @profiler.profile('Pipeline.process')
+    def process(self, sample):
+        for axis, value in zip((X, Y, Z), sample):
+            self._buffers[axis] = np.append(self._buffers[axis], value)[-self.buffer_size:]
+
+        return {
+            X: self._buffers[X],
+            Y: self._buffers[Y],
+            Z: self._buffers[Z],
+            NORMAL: normal_vector(sample[0], sample[2]),
+            LOG: sample[0],
+        }
+
+
+def run_pipeline(inbox, outbox, buffer_size=BUFFER_SIZE, log=False):
+    """
+    Worker loop: processes all samples that are waiting in inbox and only posts the
+    result of the newest one, the GUI can't draw more than one result per frame anyway.
+    Stops when None is received.
+    """
+    pipeline = Pipeline(buffer_size)
+
+    while True:
+        samples = [inbox.get()]
+        while True:
+            try:
+                samples.append(inbox.get_nowait())
+            except queue.Empty:
+                break
+
+        result = None
+        for sample in samples:
+            if sample is None:
+                return
+            result = pipeline.process(sample)
+            if log:
+                print(result[LOG])
+
+        outbox.put(result)
+
+
+class PipelineWorker:
+    """
+    Runs a Pipeline outside of the GUI thread.
+    mode 'process' uses a separate process (own GIL, other core),
+    mode 'thread' a thread, which is enough when most time is spent in NumPy code that releases the GIL.
+    """
+
+    MODES = ('process', 'thread')
+
+    def __init__(self, mode='process', buffer_size=BUFFER_SIZE, log=False):
+        if mode == 'process':
+            self._inbox = multiprocessing.Queue()
+            self._outbox = multiprocessing.Queue()
+            self._worker = multiprocessing.Process(target=run_pipeline,
+                                                   args=(self._inbox, self._outbox, buffer_size, log), daemon=True)
+        elif mode == 'thread':
+            self._inbox = queue.Queue()
+            self._outbox = queue.Queue()
+            self._worker = threading.Thread(target=run_pipeline,
+                                            args=(self._inbox, self._outbox, buffer_size, log), daemon=True)
+        else:
+            raise ValueError(f'unknown worker mode "{mode}", use one of {PipelineWorker.MODES}')
+
+        self._worker.start()
+
+    def submit(self, sample):
+        self._inbox.put(tuple(float(value) for value in sample))
+
+    def latest_result(self):
+        """
+        Returns the newest result of the worker or None if there is no new result
+        """
+        result = None
+        while True:
+            try:
+                result = self._outbox.get_nowait()
+            except queue.Empty:
+                return result
+
+    def stop(self):
+        self._inbox.put(None)
+        self._worker.join()
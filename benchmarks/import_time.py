@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+# coding: utf-8
+# -*- coding: utf-8 -*-
+
+"""
+Measures the cold start time of the DIPPID modules.
+Every measurement starts a fresh interpreter, the time of an empty interpreter is subtracted.
+
+Usage: python3 benchmarks/import_time.py [runs]
+"""
+
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RUNS = 20
+# the sensor core has to be importable in this time (ms)
+SENSOR_CORE_TARGET_MS = 50
+
+MODULES = [
+    'DIPPID',
+    'dippid_shm',
+    'DIPPID_pyqtnode',
+]
+
+
+def measure(statement, runs):
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', statement], cwd=REPO_DIR, check=True)
+        times.append((time.perf_counter() - start) * 1000)
+    return statistics.median(times)
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else RUNS
+    interpreter = measure('pass', runs)
+    print(f'empty interpreter: {interpreter:.1f} ms (subtracted below)')
+
+    core_ok = True
+    for module in MODULES:
+        try:
+            import_time = measure(f'import {module}', runs) - interpreter
+        except subprocess.CalledProcessError:
+            print(f'{module:<20} could not be imported')
+            continue
+
+        note = ''
+        if module == 'DIPPID':
+            core_ok = import_time < SENSOR_CORE_TARGET_MS
+            note = f'(target < {SENSOR_CORE_TARGET_MS} ms: {"ok" if core_ok else "MISSED"})'
+        print(f'{module:<20} {import_time:8.1f} ms {note}')
+
+    sys.exit(0 if core_ok else 1)
+
+
+if __name__ == '__main__':
+    main()
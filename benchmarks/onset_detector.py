@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# coding: utf-8
+# -*- coding: utf-8 -*-
+
+"""
+Measures the CPU cost per sample of DIPPID.OnsetDetector and checks its detections on a synthetic
+accelerometer stream (100 Hz, noise, slow tilting, taps and shakes at known positions).
+The detection latency is the time a sample needs to be processed plus the samples between
+the start of a tap and the sample on which it was reported.
+
+Usage: python3 benchmarks/onset_detector.py [seconds of signal]
+"""
+
+import os
+import statistics
+import sys
+from time import perf_counter_ns
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from DIPPID import Sensor, SensorCapabilities, OnsetDetector
+
+RATE = 100
+SECONDS = 600
+TAP_INTERVAL = 3.0
+SHAKE_INTERVAL = 37.0
+# seconds after the start of a shake without taps
+SHAKE_MARGIN = 1.5
+# detection latency target (ms)
+LATENCY_TARGET_MS = 10
+
+
+class BenchmarkSensor(Sensor):
+    def __init__(self):
+        Sensor.__init__(self)
+        self._connection_thread = None
+
+
+def synthetic_stream(seconds, rng):
+    t = np.arange(int(seconds * RATE)) / RATE
+    samples = rng.normal(0, 0.02, (len(t), 3))
+    samples[:, 1] += 0.5 * np.sin(2 * np.pi * 0.3 * t)
+    samples[:, 2] += 1.0
+
+    shakes = []
+    for start in np.arange(SHAKE_INTERVAL / 2, seconds - 2, SHAKE_INTERVAL):
+        index = int(start * RATE)
+        burst = np.arange(RATE)
+        samples[index:index + RATE, 0] += 1.5 * np.sin(2 * np.pi * 5 * burst / RATE)
+        shakes.append(index)
+
+    taps = []
+    for start in np.arange(1.0, seconds - 1, TAP_INTERVAL):
+        index = int(start * RATE)
+        # leave room for the shakes
+        if any(-RATE <= index - shake < SHAKE_MARGIN * RATE for shake in shakes):
+            continue
+        samples[index:index + 2, 0] += (1.5, -0.8)
+        taps.append(index)
+
+    return t, samples, taps, shakes
+
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else SECONDS
+    t, samples, taps, shakes = synthetic_stream(seconds, np.random.default_rng(1))
+    values = [{'x': x, 'y': y, 'z': z} for x, y, z in samples.tolist()]
+    timestamps = t.tolist()
+
+    sensor = BenchmarkSensor()
+    detector = OnsetDetector(sensor)
+    detected_taps = []
+    detected_shakes = []
+    sensor.register_callback(SensorCapabilities.TAP, lambda event: detected_taps.append(event['time']))
+    sensor.register_callback(SensorCapabilities.SHAKE, lambda event: detected_shakes.append(event['time']))
+
+    durations = []
+    for value, timestamp in zip(values, timestamps):
+        start = perf_counter_ns()
+        detector.on_sample(value, timestamp)
+        durations.append(perf_counter_ns() - start)
+
+    durations.sort()
+    print(f'{len(values)} samples: mean {statistics.mean(durations) / 1000:.2f} us, '
+          f'p99 {durations[int(len(durations) * 0.99)] / 1000:.2f} us, max {durations[-1] / 1000:.2f} us per sample')
+
+    detected = np.round(np.array(detected_taps) * RATE).astype(int)
+    delays = []
+    for tap in taps:
+        hits = detected[(detected >= tap) & (detected < tap + RATE // 10)]
+        if len(hits):
+            delays.append(hits[0] - tap)
+    # the end of a burst may cause one more onset
+    shake_regions = [(shake, shake + int(SHAKE_MARGIN * RATE)) for shake in shakes]
+    false_taps = sum(1 for d in detected
+                     if not any(0 <= d - tap < RATE // 10 for tap in taps)
+                     and not any(start <= d < end for start, end in shake_regions))
+    found_shakes = sum(1 for start, end in shake_regions if any(start <= d * RATE < end for d in detected_shakes))
+
+    print(f'taps: {len(delays)}/{len(taps)} detected, {false_taps} false detections')
+    print(f'shakes: {found_shakes}/{len(shakes)} detected')
+    if delays:
+        latency = max(delays) * 1000 / RATE + durations[int(len(durations) * 0.99)] / 1e6
+        print(f'tap reported {max(delays)} samples after its start (max), '
+              f'detection latency {latency:.3f} ms (target < {LATENCY_TARGET_MS} ms)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+# coding: utf-8
+# -*- coding: utf-8 -*-
+
+"""
+Tail latency of a SensorUDP receive thread under synthetic CPU load (Linux).
+
+A sender process sends RATE packets per second to a SensorUDP on localhost. For every packet the
+receive latency is measured, i.e. the time from its arrival in the kernel until the receive thread
+handles it (see DIPPID.ReceiveScheduling). The load consists of one busy process per CPU and a
+thread in the receiving process that keeps the GIL busy (like the NumPy and Qt work of analyze.py
+or the game). Every configuration of DIPPID.ReceiveScheduling is measured with the same load.
+
+Configurations that need privileges (negative nice, SCHED_FIFO) are skipped when they are not permitted.
+'isolated' pins the receive thread to the last CPU and keeps the busy processes off it (more than one CPU only).
+
+Usage: python3 benchmarks/receive_latency.py [seconds per configuration]
+"""
+
+import os
+import sys
+import socket
+from multiprocessing import Process, Event
+from threading import Thread
+from time import sleep, perf_counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from DIPPID import Sensor, SensorUDP, ReceiveScheduling
+
+RATE = 500
+SECONDS = 10
+PORT = 5790
+PRIORITY = 50
+PACKET = b'{"accelerometer": {"x": 0.1, "y": 0.2, "z": 9.8}}'
+
+
+def send(port, rate, seconds):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    start = perf_counter()
+    for i in range(int(rate * seconds)):
+        # absolute deadlines, a late packet does not delay the following ones
+        delay = start + i / rate - perf_counter()
+        if delay > 0:
+            sleep(delay)
+        sock.sendto(PACKET, ('127.0.0.1', port))
+
+
+def burn(stop):
+    while not stop.is_set():
+        for _ in range(100000):
+            pass
+
+
+def hold_gil(stop):
+    while not stop.is_set():
+        sum(i * i for i in range(10000))
+
+
+def permitted(scheduling):
+    """
+    Tries the options on a short lived thread, returns False if one of them is not permitted
+    """
+    switch_interval = sys.getswitchinterval()
+    failed = []
+    thread = Thread(target=lambda: failed.extend(scheduling.apply('probe')))
+    thread.start()
+    thread.join()
+    sys.setswitchinterval(switch_interval)
+    return not failed
+
+
+def measure(name, scheduling, port, seconds):
+    switch_interval = sys.getswitchinterval()
+    Sensor.scheduling = scheduling
+    sensor = SensorUDP(port, '127.0.0.1')
+    sender = Process(target=send, args=(port, RATE, seconds))
+    sender.start()
+    sender.join()
+    sleep(0.1)
+    sensor.disconnect()
+    sys.setswitchinterval(switch_interval)
+
+    stats = sensor.receive_latency
+    if stats is None or stats.count == 0:
+        print(f'{name:<36}no packets received')
+        return
+    p999 = stats.percentile(99.9)
+    latency = sensor.get_receive_latency()
+    print(f'{name:<36}{latency["count"]:>8}{latency["mean"]:>9.3f}{latency["jitter"]:>9.3f}{latency["p50"]:>9.3f}'
+          f'{latency["p99"]:>9.3f}{p999:>9.3f}{latency["max"]:>9.3f}')
+
+
+def main():
+    if not sys.platform.startswith('linux'):
+        print('kernel receive timestamps and thread scheduling options need Linux')
+        sys.exit(1)
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else SECONDS
+
+    cpus = sorted(os.sched_getaffinity(0))
+    configurations = [
+        ('default', ReceiveScheduling(measure_latency=True)),
+        ('nice -10', ReceiveScheduling(nice=-10, measure_latency=True)),
+        (f'fifo {PRIORITY}', ReceiveScheduling(realtime=PRIORITY, measure_latency=True)),
+        (f'fifo {PRIORITY}, switch 0.5 ms',
+         ReceiveScheduling(realtime=PRIORITY, switch_interval=0.0005, measure_latency=True)),
+    ]
+    if len(cpus) > 1:
+        configurations.append((f'isolated, fifo {PRIORITY}, switch 0.5 ms',
+                               ReceiveScheduling(cpus={cpus[-1]}, realtime=PRIORITY, switch_interval=0.0005,
+                                                 measure_latency=True)))
+
+    print(f'{RATE} packets/s, {seconds:.0f} s per configuration, {len(cpus)} CPUs, latency in ms')
+    print(f'{"configuration":<36}{"packets":>8}{"mean":>9}{"jitter":>9}{"p50":>9}{"p99":>9}{"p99.9":>9}{"max":>9}')
+    port = PORT
+    measure('idle', ReceiveScheduling(measure_latency=True), port, seconds)
+
+    stop = Event()
+    burners = [Process(target=burn, args=(stop,), daemon=True) for _ in cpus]
+    for burner in burners:
+        burner.start()
+    gil_thread = Thread(target=hold_gil, args=(stop,), daemon=True)
+    gil_thread.start()
+
+    try:
+        for name, scheduling in configurations:
+            port += 1
+            if not permitted(scheduling):
+                print(f'{name:<36}not permitted, skipped')
+                continue
+            isolated = scheduling.cpus is not None
+            if isolated:
+                for burner in burners:
+                    os.sched_setaffinity(burner.pid, set(cpus) - scheduling.cpus)
+            measure(name, scheduling, port, seconds)
+            if isolated:
+                for burner in burners:
+                    os.sched_setaffinity(burner.pid, cpus)
+    finally:
+        stop.set()
+        gil_thread.join()
+        for burner in burners:
+            burner.join()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+# coding: utf-8
+# -*- coding: utf-8 -*-
+
+"""
+Overload controller for the Qt applications.
+
+LoadController watches three signals:
+    frame time          interval between the ticks of a FRAME_RATE heartbeat timer on the GUI thread
+                        (a busy event loop delays the ticks)
+    callback latency    time the receive threads of the watched sensors spend in the callbacks of a packet
+    receive backlog     bytes waiting in the kernel receive queues of the watched UDP sensors (Linux only)
+                        and datagrams the kernel dropped because the queue was full
+
+Once per CHECK_INTERVAL the signals are compared with their budgets. While a budget is exceeded
+the next LoadStep is applied (one per check, in the order they were given, e.g. lower plot rate,
+then more decimation, then no log output). After RECOVER_CHECKS checks in a row well within
+all budgets the last applied step is reverted. Every decision is printed to stderr and kept in
+LoadController.decisions.
+"""
+
+import sys
+from collections import deque, namedtuple
+from time import perf_counter
+from pyqtgraph.Qt import QtCore
+from DIPPID import profiler
+
+FRAME_RATE = 60
+CHECK_INTERVAL = 1.0
+# the mean frame time may be this much longer than 1 / FRAME_RATE
+FRAME_BUDGET = 1.5
+# p95 of the time spent in the callbacks of one packet (seconds)
+CALLBACK_BUDGET = 0.005
+# bytes in the receive queue of a socket
+BACKLOG_BUDGET = 32 * 1024
+# all signals have to be below this fraction of their budget to count as recovered
+RECOVER_FRACTION = 0.5
+RECOVER_CHECKS = 5
+# callback durations kept per check
+CALLBACK_WINDOW = 1000
+
+LoadStep = namedtuple('LoadStep', ['name', 'apply', 'revert'])
+Decision = namedtuple('Decision', ['time', 'action', 'step', 'reason'])
+
+
+def udp_receive_queue(port):
+    """
+    Bytes in the receive queue and drops of the UDP sockets bound to port, from /proc/net/udp(6).
+    Returns None where this is not available.
+    """
+    queued = 0
+    drops = 0
+    found = False
+    for path in ('/proc/net/udp', '/proc/net/udp6'):
+        try:
+            with open(path) as table:
+                next(table)
+                for line in table:
+                    fields = line.split()
+                    if int(fields[1].rsplit(':', 1)[1], 16) != port:
+                        continue
+                    found = True
+                    queued += int(fields[4].split(':')[1], 16)
+                    drops += int(fields[-1])
+        except (OSError, ValueError, IndexError, StopIteration):
+            continue
+    return (queued, drops) if found else None
+
+
+class LoadController(QtCore.QObject):
+    """
+    steps: LoadSteps in the order they are applied
+    sensors: the sensors to watch or a function that returns them (called for every check,
+             so sensors that are connected later are watched as well)
+    """
+
+    def __init__(self, steps, sensors=(), verbose=True):
+        QtCore.QObject.__init__(self)
+        self.steps = list(steps)
+        self.level = 0
+        self.verbose = verbose
+        self.decisions = []
+
+        self._sensors = []
+        self._callback_times = deque(maxlen=CALLBACK_WINDOW)
+        self._frame_times = []
+        self._last_frame = None
+        self._drops = {}
+        self._calm_checks = 0
+
+        self._find_sensors = sensors if callable(sensors) else (lambda: sensors)
+        self._watch_new_sensors()
+
+        self._heartbeat = QtCore.QTimer()
+        self._heartbeat.timeout.connect(self._on_frame)
+        self._heartbeat.start(int(1000 / FRAME_RATE))
+        self._check_timer = QtCore.QTimer()
+        self._check_timer.timeout.connect(self.check)
+        self._check_timer.start(int(CHECK_INTERVAL * 1000))
+
+    def _watch_new_sensors(self):
+        for sensor in self._find_sensors():
+            if sensor is not None and sensor not in self._sensors:
+                self.watch_sensor(sensor)
+
+    def watch_sensor(self, sensor):
+        """
+        Measures the time the sensor spends in the callbacks of every packet (see Sensor.add_dispatch_listener())
+        """
+        sensor.add_dispatch_listener(self._callback_times.append)
+        self._sensors.append(sensor)
+
+    def _on_frame(self):
+        now = perf_counter()
+        if self._last_frame is not None:
+            self._frame_times.append(now - self._last_frame)
+        self._last_frame = now
+
+    def measure(self):
+        """
+        Returns the load since the last measurement, each signal as a fraction of its budget
+        """
+        frame_times, self._frame_times = self._frame_times, []
+        frame = sum(frame_times) / len(frame_times) if frame_times else 1.0 / FRAME_RATE
+        # how much of the allowed delay of the frames is used
+        load = {'frame': max(frame * FRAME_RATE - 1, 0.0) / (FRAME_BUDGET - 1)}
+
+        callback_times = sorted(self._callback_times)
+        self._callback_times.clear()
+        callback = callback_times[int(len(callback_times) * 0.95)] if callback_times else 0.0
+        load['callback'] = callback / CALLBACK_BUDGET
+
+        backlog = 0.0
+        for sensor in self._sensors:
+            port = getattr(sensor, '_port', None)
+            queue = udp_receive_queue(port) if isinstance(port, int) else None
+            if queue is None:
+                continue
+            queued, drops = queue
+            backlog = max(backlog, queued / BACKLOG_BUDGET)
+            # datagrams dropped by the kernel always count as overload
+            if drops > self._drops.get(port, drops):
+                backlog = max(backlog, 2.0)
+            self._drops[port] = drops
+        load['backlog'] = backlog
+
+        return load
+
+    @profiler.profile('LoadController.check')
+    def check(self):
+        self._watch_new_sensors()
+        load = self.measure()
+        worst = max(load, key=load.get)
+        reason = ', '.join(f'{name} {value:.0%}' for name, value in load.items())
+
+        if load[worst] > 1.0:
+            self._calm_checks = 0
+            if self.level < len(self.steps):
+                step = self.steps[self.level]
+                step.apply()
+                self.level += 1
+                self._log('apply', step, f'{worst} over budget: {reason}')
+        elif load[worst] < RECOVER_FRACTION:
+            self._calm_checks += 1
+            if self._calm_checks >= RECOVER_CHECKS and self.level > 0:
+                self._calm_checks = 0
+                self.level -= 1
+                step = self.steps[self.level]
+                step.revert()
+                self._log('revert', step, f'recovered: {reason}')
+        else:
+            self._calm_checks = 0
+
+    def _log(self, action, step, reason):
+        self.decisions.append(Decision(perf_counter(), action, step.name, reason))
+        if self.verbose:
+            print(f'load: {action} "{step.name}" (level {self.level}/{len(self.steps)}, {reason})', file=sys.stderr)
+
+    def stop(self):
+        self._heartbeat.stop()
+        self._check_timer.stop()
+        for sensor in self._sensors:
+            sensor.remove_dispatch_listener(self._callback_times.append)
@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+# coding: utf-8
+# -*- coding: utf-8 -*-
+
+"""
+Relay for DIPPID streams: receives the packets of one device once and forwards them
+unchanged (no decoding) to any number of local subscribers:
+
+    --udp PORT[:N]              UDP on localhost (e.g. for a SensorUDP(PORT, '127.0.0.1'))
+    --multicast GROUP:PORT[:N]  UDP multicast (receive with SensorMulticast)
+    --unix PATH[:N]             Unix datagram socket (receive with SensorUnix)
+    --control PORT              subscribers can subscribe themselves at runtime (see subscribe())
+
+N is an optional decimation factor: only every N-th packet is forwarded to that subscriber.
+Every DIPPID packet contains the complete state of the device, so decimating packets only lowers the rate.
+
+Usage: python3 dippid_relay.py 5700 --udp 5701 --udp 5702:4 --stats 5
+"""
+
+import argparse
+import os
+import selectors
+import socket
+import struct
+import sys
+from time import sleep, perf_counter
+from DIPPID import Sensor, SensorUDP, PacketSequencer, profiler
+from DIPPID import add_scheduling_params, scheduling_from_params, format_receive_latency
+
+# a subscriber that refused this many packets in a row (nobody listening) is removed
+MAX_REFUSED = 100
+
+
+class Subscriber():
+    """
+    Destination of the relay. Counts forwarded packets, packets skipped by the decimation
+    and packets that could not be sent (dropped).
+    """
+
+    def __init__(self, sock, address, decimation=1):
+        self.sock = sock
+        self.address = address
+        self.decimation = max(int(decimation), 1)
+        self.sent = 0
+        self.skipped = 0
+        self.dropped = 0
+        self.refused = 0
+        self._counter = 0
+
+    def forward(self, data):
+        self._counter += 1
+        if self._counter % self.decimation != 0:
+            self.skipped += 1
+            return
+
+        try:
+            self.sock.sendto(data, self.address)
+            self.sent += 1
+            self.refused = 0
+        except (BlockingIOError, ConnectionRefusedError, FileNotFoundError, OSError):
+            # the relay never waits for a slow or missing subscriber
+            self.dropped += 1
+            self.refused += 1
+
+    def __str__(self):
+        return f'{self.address}'
+
+
+def udp_subscriber(port, decimation=1, host='127.0.0.1'):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setblocking(False)
+    return Subscriber(sock, (host, port), decimation)
+
+
+def multicast_subscriber(group, port, decimation=1, ttl=1):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, ttl)
+    sock.setblocking(False)
+    return Subscriber(sock, (group, port), decimation)
+
+
+def unix_subscriber(path, decimation=1):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    sock.setblocking(False)
+    return Subscriber(sock, path, decimation)
+
+
+class SensorRelay(SensorUDP):
+    """
+    SensorUDP that forwards every received packet to its subscribers before (optionally) decoding it.
+    With decode=False the relay does not parse the packets at all.
+    With a control_port, subscribers can register themselves with subscribe() and unsubscribe().
+    """
+
+    def __init__(self, port, ip='0.0.0.0', subscribers=(), decode=False, control_port=None):
+        self.subscribers = list(subscribers)
+        # subscribers that unsubscribed or were removed after MAX_REFUSED refused packets
+        self.removed = []
+        self.received = 0
+        self._decode = decode
+        self._control_port = control_port
+        self._start_time = perf_counter()
+        SensorUDP.__init__(self, port, ip)
+
+    def _connect(self):
+        self._selector = selectors.DefaultSelector()
+        if self._control_port is not None:
+            self._control_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self._control_sock.bind(('127.0.0.1', self._control_port))
+            self._selector.register(self._control_sock, selectors.EVENT_READ)
+        SensorUDP._connect(self)
+        self._selector.register(self._sock, selectors.EVENT_READ)
+
+    def _receive(self):
+        timed = self.receive_latency is not None
+        self._receiving = True
+        while self._receiving:
+            for key, _ in self._selector.select(timeout=PacketSequencer.REORDER_TIMEOUT):
+                if timed and key.fileobj is self._sock:
+                    data, addr = self._recvfrom_timed(self._sock)
+                else:
+                    data, addr = key.fileobj.recvfrom(1024)
+                if key.fileobj is self._sock:
+                    self._relay(data)
+                else:
+                    self._handle_control(data, addr)
+
+            if self._decode:
+                self._flush_packets()
+
+    @profiler.profile('SensorRelay._relay')
+    def _relay(self, data):
+        self.received += 1
+        for subscriber in self.subscribers[:]:
+            subscriber.forward(data)
+            if subscriber.refused >= MAX_REFUSED:
+                self.subscribers.remove(subscriber)
+                self.removed.append(subscriber)
+
+        if self._decode:
+            try:
+                data_decoded = data.decode()
+            except UnicodeDecodeError:
+                return
+            self._update(data_decoded)
+
+    # control messages: "subscribe PORT [DECIMATION]" and "unsubscribe PORT" (localhost only)
+    def _handle_control(self, data, addr):
+        try:
+            command, *args = data.decode().split()
+            port = int(args[0])
+            decimation = int(args[1]) if len(args) > 1 else 1
+        except (UnicodeDecodeError, ValueError, IndexError):
+            return
+
+        for subscriber in [s for s in self.subscribers if s.address == (addr[0], port)]:
+            self.subscribers.remove(subscriber)
+            self.removed.append(subscriber)
+        if command == 'subscribe':
+            self.subscribers.append(udp_subscriber(port, decimation, addr[0]))
+
+    def add_subscriber(self, subscriber):
+        self.subscribers.append(subscriber)
+
+    # counters of the current subscribers and, marked "(removed)", of the removed ones
+    # (summed up per address if a subscriber was removed several times)
+    def stats(self):
+        elapsed = perf_counter() - self._start_time
+        subscribers = {str(s): {'sent': s.sent, 'skipped': s.skipped, 'dropped': s.dropped}
+                       for s in self.subscribers}
+        for s in self.removed:
+            counters = subscribers.setdefault(f'{s} (removed)', {'sent': 0, 'skipped': 0, 'dropped': 0})
+            counters['sent'] += s.sent
+            counters['skipped'] += s.skipped
+            counters['dropped'] += s.dropped
+        return {
+            'received': self.received,
+            'rate': self.received / elapsed if elapsed > 0 else 0,
+            'subscribers': subscribers,
+        }
+
+    def disconnect(self):
+        SensorUDP.disconnect(self)
+        self._selector.close()
+        self._sock.close()
+        if self._control_port is not None:
+            self._control_sock.close()
+
+
+# asks a relay with a control port to forward its packets to a local UDP port
+def subscribe(control_port, port, decimation=1):
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.sendto(f'subscribe {port} {decimation}'.encode(), ('127.0.0.1', control_port))
+
+
+def unsubscribe(control_port, port):
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.sendto(f'unsubscribe {port}'.encode(), ('127.0.0.1', control_port))
+
+
+# receives a relayed stream from a multicast group
+class SensorMulticast(SensorUDP):
+    def __init__(self, group, port):
+        self._group = group
+        SensorUDP.__init__(self, port)
+
+    def _connect(self):
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        # several local subscribers may listen to the same group and port
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._sock.bind(('', self._port))
+        membership = struct.pack('4sl', socket.inet_aton(self._group), socket.INADDR_ANY)
+        self._sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, membership)
+        # like SensorUDP, so held back packets are released and disconnect() is noticed
+        self._sock.settimeout(PacketSequencer.REORDER_TIMEOUT)
+        self._measure_receive_latency(self._sock)
+        self._start_receive_thread()
+
+
+# receives a relayed stream from a Unix datagram socket
+class SensorUnix(SensorUDP):
+    def __init__(self, path):
+        self._path = path
+        Sensor.__init__(self)
+        self._connect()
+
+    def _connect(self):
+        if os.path.exists(self._path):
+            os.remove(self._path)
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._sock.bind(self._path)
+        self._sock.settimeout(PacketSequencer.REORDER_TIMEOUT)
+        self._measure_receive_latency(self._sock)
+        self._start_receive_thread()
+
+    def disconnect(self):
+        SensorUDP.disconnect(self)
+        self._sock.close()
+        if os.path.exists(self._path):
+            os.remove(self._path)
+
+
+def parse_destination(text, parts):
+    """
+    Splits "A:B[:N]" into its parts and the optional decimation
+    """
+    values = text.split(':')
+    if len(values) == parts + 1:
+        return values[:parts], int(values[parts])
+    return values, 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Forwards a DIPPID stream to several local subscribers")
+    parser.add_argument('port', type=int, help="UDP port the device sends to")
+    parser.add_argument('--udp', action='append', default=[], help="PORT[:N] on localhost")
+    parser.add_argument('--multicast', action='append', default=[], help="GROUP:PORT[:N]")
+    parser.add_argument('--unix', action='append', default=[], help="PATH[:N]")
+    parser.add_argument('--control', type=int, help="port for subscribe/unsubscribe messages")
+    parser.add_argument('--stats', type=float, default=0, help="print statistics every n seconds")
+    add_scheduling_params(parser)
+    params = parser.parse_args()
+    Sensor.scheduling = scheduling_from_params(params)
+
+    relay = SensorRelay(params.port, control_port=params.control)
+    for destination in params.udp:
+        (port,), decimation = parse_destination(destination, 1)
+        relay.add_subscriber(udp_subscriber(int(port), decimation))
+    for destination in params.multicast:
+        (group, port), decimation = parse_destination(destination, 2)
+        relay.add_subscriber(multicast_subscriber(group, int(port), decimation))
+    for destination in params.unix:
+        (path,), decimation = parse_destination(destination, 1)
+        relay.add_subscriber(unix_subscriber(path, decimation))
+
+    try:
+        while True:
+            sleep(params.stats or 1)
+            if params.stats:
+                stats = relay.stats()
+                print(f'received {stats["received"]} ({stats["rate"]:.1f}/s)', file=sys.stderr)
+                for name, counters in stats['subscribers'].items():
+                    print(f'  {name}: sent {counters["sent"]}, skipped {counters["skipped"]}, '
+                          f'dropped {counters["dropped"]}', file=sys.stderr)
+                if params.receive_latency:
+                    print('  ' + format_receive_latency('relay', relay), file=sys.stderr)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        relay.disconnect()
+        if params.receive_latency:
+            print(format_receive_latency('relay', relay), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+# coding: utf-8
+# -*- coding: utf-8 -*-
+
+"""
+Evaluation scheduler for pyqtgraph flowcharts.
+
+By default a Flowchart re-evaluates everything downstream of a node every time the node emits
+sigOutputChanged, so several DIPPIDNodes updating in one frame cause several passes over
+the same nodes. FlowchartScheduler replaces this: nodes that emit sigOutputChanged are only
+marked dirty, and at most once per frame all dirty nodes are propagated in one pass in
+topological order. A node is only evaluated if one of its inputs received a new value,
+so e.g. a BufferNode does not append a sample again when the DIPPIDNode polled an unchanged value.
+Nodes only see the latest value of their inputs per pass: a node that emits several values
+within one frame (e.g. a DIPPIDNode in callback mode) passes on only the last one, so nodes
+that need every sample (LogNode, BufferNode) miss the values in between. analyze.py therefore
+only uses the scheduler with --scheduler.
+
+Usage:
+    scheduler = FlowchartScheduler(fc)
+    ...
+    scheduler.print_timings()
+"""
+
+from pyqtgraph.Qt import QtCore
+import pyqtgraph as pg
+from time import perf_counter
+from DIPPID import profiler
+
+FRAME_RATE = 60
+
+
+class NodeTiming():
+    """
+    Evaluation time of one node (seconds)
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.last = 0.0
+
+    def add(self, duration):
+        self.count += 1
+        self.total += duration
+        self.max = max(self.max, duration)
+        self.last = duration
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+
+class FlowchartScheduler(QtCore.QObject):
+    def __init__(self, flowchart, frame_rate=FRAME_RATE):
+        QtCore.QObject.__init__(self)
+        self.flowchart = flowchart
+        self.frame_interval = 1.0 / frame_rate
+        # node name -> NodeTiming
+        self.timings = {}
+        self.passes = 0
+        self.skipped = 0
+
+        self._dirty = set()
+        # output terminal -> value that was propagated last
+        self._propagated = {}
+        self._last_pass = 0.0
+        self._timer = QtCore.QTimer()
+        self._timer.setSingleShot(True)
+        self._timer.timeout.connect(self.evaluate)
+
+        for node in flowchart.nodes().values():
+            self._take_over(node)
+        flowchart.sigChartChanged.connect(self._chart_changed)
+
+    def _take_over(self, node):
+        if node is self.flowchart.inputNode or node is self.flowchart.outputNode:
+            return
+        try:
+            node.sigOutputChanged.disconnect(self.flowchart.nodeOutputChanged)
+        except (TypeError, RuntimeError):
+            # already disconnected
+            pass
+        node.sigOutputChanged.connect(self.mark_dirty)
+
+    def _chart_changed(self, flowchart, action, node):
+        if action == 'add':
+            self._take_over(node)
+        elif action == 'remove':
+            self._dirty.discard(node)
+            for terminal in node.outputs().values():
+                self._propagated.pop(terminal, None)
+
+    def mark_dirty(self, node):
+        """
+        Called instead of Flowchart.nodeOutputChanged, the node is propagated with the next pass
+        """
+        self._dirty.add(node)
+        if not self._timer.isActive():
+            # not more than one pass per frame
+            wait = max(self._last_pass + self.frame_interval - perf_counter(), 0)
+            self._timer.start(int(wait * 1000))
+
+    def _order(self):
+        nodes = [node for node in self.flowchart.nodes().values()
+                 if node is not self.flowchart.inputNode and node is not self.flowchart.outputNode]
+        # the connections may change at any time in the editor, so the order is computed for every pass
+        return pg.functions.toposort({node: node.dependentNodes() for node in nodes})
+
+    def _changed_outputs(self, node, changed):
+        for terminal in node.outputs().values():
+            value = terminal.value()
+            if value is not self._propagated.get(terminal):
+                self._propagated[terminal] = value
+                changed.add(terminal)
+
+    @profiler.profile('FlowchartScheduler.evaluate')
+    def evaluate(self):
+        """
+        Propagates the outputs of all dirty nodes through the chart in one pass.
+        Can also be called directly, e.g. by a render loop that needs the results right away.
+        """
+        self._timer.stop()
+        dirty, self._dirty = self._dirty, set()
+        self._last_pass = perf_counter()
+        self.passes += 1
+
+        # output terminals with a value that was not propagated yet
+        changed = set()
+        for node in self._order():
+            received = False
+            inputs_changed = False
+            for terminal in node.inputs().values():
+                for source in terminal.connections():
+                    if source not in changed:
+                        continue
+                    received = True
+                    before = terminal.value()
+                    terminal.inputChanged(source, process=False)
+                    # a terminal keeps its old value when the new one is equal
+                    inputs_changed |= terminal.isMultiValue() or terminal.value() is not before
+
+            if inputs_changed:
+                start = perf_counter()
+                with profiler.span(f'{type(node).__name__}.update'):
+                    node.update(signal=False)
+                self.timings.setdefault(node.name(), NodeTiming()).add(perf_counter() - start)
+            elif node not in dirty:
+                self.skipped += received
+                continue
+
+            # dirty nodes already updated themselves before they emitted sigOutputChanged
+            self._changed_outputs(node, changed)
+
+        self.flowchart.sigStateChanged.emit()
+
+    def timing_summary(self):
+        """
+        Returns (name, NodeTiming) of all evaluated nodes, most expensive (total time) first
+        """
+        return sorted(self.timings.items(), key=lambda item: item[1].total, reverse=True)
+
+    def print_timings(self):
+        print(f'{self.passes} passes, {self.skipped} evaluations skipped (inputs unchanged)')
+        print(f'{"node":<24}{"count":>8}{"total ms":>12}{"mean ms":>10}{"max ms":>10}')
+        for name, timing in self.timing_summary():
+            print(f'{name:<24}{timing.count:>8}{timing.total * 1000:>12.1f}'
+                  f'{timing.mean * 1000:>10.3f}{timing.max * 1000:>10.3f}')
@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+# coding: utf-8
+# -*- coding: utf-8 -*-
+
+"""
+Storage for long recording sessions of sensor samples.
+
+A session is a directory:
+    meta.json       channels and block sizes
+    chunks.bin      compressed chunks of CHUNK_SIZE samples: timestamps (float64) and one column
+                    per channel (float32), each column delta encoded on its bit pattern (lossless)
+    index.bin       one INDEX_DTYPE record per chunk (position in chunks.bin and time range)
+    level_<k>.bin   overview pyramid: min, max and sum of every block of BASE_BLOCK * FANOUT**k samples
+
+All files are only appended to, so the writer needs constant memory and readers can open a session
+while it is still recorded. Readers memory-map the index and the pyramid, a query only decompresses
+the chunks it needs and overview() picks the pyramid level that returns at most max_points blocks.
+
+Usage:
+    python3 dippid_store.py record PORT DIR [CAPABILITY]    record a DIPPID device until ctrl+c
+    python3 dippid_store.py info DIR                        print the time range and size of a session
+"""
+
+import json
+import os
+import sys
+import zlib
+from threading import Event
+from time import time
+import numpy as np
+
+# samples per compressed chunk, a multiple of BASE_BLOCK
+CHUNK_SIZE = 4096
+# samples per block in the finest pyramid level
+BASE_BLOCK = 64
+# blocks of a level that are combined into one block of the next level
+FANOUT = 8
+LEVELS = 6
+COMPRESSION_LEVEL = 6
+
+INDEX_DTYPE = np.dtype([('offset', 'u8'), ('size', 'u4'), ('count', 'u4'), ('t_start', 'f8'), ('t_end', 'f8')])
+
+
+def level_dtype(channels):
+    return np.dtype([('t_start', 'f8'), ('t_end', 'f8'), ('count', 'u4'),
+                     ('min', 'f4', (channels,)), ('max', 'f4', (channels,)), ('sum', 'f8', (channels,))])
+
+
+def encode_column(column, integer_type):
+    # differences of the bit patterns, integer overflow wraps around and is undone by the cumsum
+    bits = column.view(integer_type)
+    return np.diff(bits, prepend=integer_type(0)).tobytes()
+
+
+def decode_column(data, integer_type, float_type):
+    return np.cumsum(np.frombuffer(data, dtype=integer_type), dtype=integer_type).view(float_type)
+
+
+def encode_chunk(timestamps, values):
+    columns = [encode_column(timestamps, np.int64)]
+    columns += [encode_column(np.ascontiguousarray(values[:, channel]), np.int32) for channel in range(values.shape[1])]
+    return zlib.compress(b''.join(columns), COMPRESSION_LEVEL)
+
+
+def decode_chunk(data, count, channels):
+    raw = zlib.decompress(data)
+    timestamps = decode_column(raw[:count * 8], np.int64, np.float64)
+    columns = [decode_column(raw[count * 8 + channel * count * 4:count * 8 + (channel + 1) * count * 4],
+                             np.int32, np.float32) for channel in range(channels)]
+    return timestamps, np.column_stack(columns)
+
+
+def summarize(timestamps, values, block_size, dtype):
+    """
+    One pyramid record per block_size samples (the last block may be shorter)
+    """
+    starts = np.arange(0, len(timestamps), block_size)
+    records = np.zeros(len(starts), dtype=dtype)
+    records['t_start'] = timestamps[starts]
+    records['t_end'] = timestamps[np.minimum(starts + block_size, len(timestamps)) - 1]
+    records['count'] = np.diff(np.append(starts, len(timestamps)))
+    records['min'] = np.minimum.reduceat(values, starts)
+    records['max'] = np.maximum.reduceat(values, starts)
+    records['sum'] = np.add.reduceat(values.astype(np.float64), starts)
+    return records
+
+
+def merge(records, dtype):
+    merged = np.zeros(1, dtype=dtype)
+    merged['t_start'] = records['t_start'][0]
+    merged['t_end'] = records['t_end'][-1]
+    merged['count'] = records['count'].sum()
+    merged['min'] = records['min'].min(axis=0)
+    merged['max'] = records['max'].max(axis=0)
+    merged['sum'] = records['sum'].sum(axis=0)
+    return merged
+
+
+def open_array(path, dtype):
+    """
+    Memory-maps an append-only file of records, only the complete records that exist right now
+    """
+    count = os.path.getsize(path) // dtype.itemsize if os.path.exists(path) else 0
+    if count == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='r', shape=(count,))
+
+
+class SessionWriter():
+    """
+    Appends samples to a new session directory. Memory use does not depend on the length of the session:
+    one chunk of samples and at most FANOUT pending records per pyramid level are kept.
+    """
+
+    def __init__(self, path, channels=('x', 'y', 'z'), chunk_size=CHUNK_SIZE):
+        if chunk_size % BASE_BLOCK != 0:
+            raise ValueError(f'chunk_size has to be a multiple of {BASE_BLOCK}')
+
+        os.makedirs(path)
+        self.path = path
+        self.channels = list(channels)
+        self.chunk_size = chunk_size
+        self.count = 0
+        self._dtype = level_dtype(len(self.channels))
+
+        with open(os.path.join(path, 'meta.json'), 'w') as meta:
+            json.dump({'channels': self.channels, 'chunk_size': chunk_size,
+                       'base_block': BASE_BLOCK, 'fanout': FANOUT, 'levels': LEVELS}, meta)
+
+        self._chunks = open(os.path.join(path, 'chunks.bin'), 'ab')
+        self._index = open(os.path.join(path, 'index.bin'), 'ab')
+        self._levels = [open(os.path.join(path, f'level_{level}.bin'), 'ab') for level in range(LEVELS)]
+        self._pending = [[] for _ in range(LEVELS)]
+
+        self._timestamps = np.zeros(chunk_size, dtype=np.float64)
+        self._values = np.zeros((chunk_size, len(self.channels)), dtype=np.float32)
+        self._filled = 0
+
+    def append(self, timestamps, values):
+        """
+        Appends one sample (a timestamp and one value per channel) or a block of samples
+        (timestamps of shape (n,), values of shape (n, channels)). Timestamps have to increase.
+        """
+        timestamps = np.atleast_1d(np.asarray(timestamps, dtype=np.float64))
+        values = np.asarray(values, dtype=np.float32).reshape(len(timestamps), len(self.channels))
+
+        while len(timestamps):
+            n = min(len(timestamps), self.chunk_size - self._filled)
+            self._timestamps[self._filled:self._filled + n] = timestamps[:n]
+            self._values[self._filled:self._filled + n] = values[:n]
+            self._filled += n
+            self.count += n
+            timestamps, values = timestamps[n:], values[n:]
+
+            if self._filled == self.chunk_size:
+                self._write_chunk()
+
+    def _write_chunk(self):
+        timestamps = self._timestamps[:self._filled]
+        values = self._values[:self._filled]
+
+        data = encode_chunk(timestamps, values)
+        record = np.zeros(1, dtype=INDEX_DTYPE)
+        record['offset'] = self._chunks.tell()
+        record['size'] = len(data)
+        record['count'] = self._filled
+        record['t_start'] = timestamps[0]
+        record['t_end'] = timestamps[-1]
+
+        # the chunk is complete on disk before the index refers to it
+        self._chunks.write(data)
+        self._chunks.flush()
+        self._add_records(0, summarize(timestamps, values, BASE_BLOCK, self._dtype))
+        self._index.write(record.tobytes())
+        self._index.flush()
+        self._filled = 0
+
+    def _add_records(self, level, records, final=False):
+        self._levels[level].write(records.tobytes())
+        self._levels[level].flush()
+        if level + 1 == LEVELS:
+            return
+
+        self._pending[level].extend(records)
+        while len(self._pending[level]) >= FANOUT or (final and self._pending[level]):
+            group = np.array(self._pending[level][:FANOUT], dtype=self._dtype)
+            del self._pending[level][:FANOUT]
+            self._add_records(level + 1, merge(group, self._dtype), final)
+
+    def close(self):
+        """
+        Writes the last (shorter) chunk and the incomplete blocks of all levels
+        """
+        if self._filled:
+            self._write_chunk()
+        for level in range(LEVELS - 1):
+            if self._pending[level]:
+                group = np.array(self._pending[level], dtype=self._dtype)
+                self._pending[level] = []
+                self._add_records(level + 1, merge(group, self._dtype), final=True)
+
+        for stored in [self._chunks, self._index] + self._levels:
+            stored.close()
+
+
+class SessionReader():
+    """
+    Reads a session, also while it is still recorded (only completed chunks and blocks are visible).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'meta.json')) as meta:
+            self.meta = json.load(meta)
+        self.channels = self.meta['channels']
+        self._dtype = level_dtype(len(self.channels))
+
+    def _index(self):
+        return open_array(os.path.join(self.path, 'index.bin'), INDEX_DTYPE)
+
+    def _level(self, level):
+        return open_array(os.path.join(self.path, f'level_{level}.bin'), self._dtype)
+
+    def __len__(self):
+        return int(self._index()['count'].sum())
+
+    def time_range(self):
+        index = self._index()
+        if len(index) == 0:
+            return None
+        return float(index['t_start'][0]), float(index['t_end'][-1])
+
+    def read(self, t_start=-np.inf, t_end=np.inf):
+        """
+        Returns all samples in [t_start, t_end] as timestamps (n,) and values (n, channels)
+        """
+        index = self._index()
+        first = np.searchsorted(index['t_end'], t_start, side='left')
+        last = np.searchsorted(index['t_start'], t_end, side='right')
+
+        timestamps = [np.zeros(0)]
+        values = [np.zeros((0, len(self.channels)), dtype=np.float32)]
+        with open(os.path.join(self.path, 'chunks.bin'), 'rb') as chunks:
+            for record in index[first:last]:
+                chunks.seek(int(record['offset']))
+                chunk_timestamps, chunk_values = decode_chunk(chunks.read(int(record['size'])),
+                                                              int(record['count']), len(self.channels))
+                inside = (chunk_timestamps >= t_start) & (chunk_timestamps <= t_end)
+                timestamps.append(chunk_timestamps[inside])
+                values.append(chunk_values[inside])
+
+        return np.concatenate(timestamps), np.concatenate(values)
+
+    def overview(self, t_start=-np.inf, t_end=np.inf, max_points=2000):
+        """
+        Returns at most max_points points for [t_start, t_end] as a dict of arrays:
+        't' (start of each block), 'min', 'max' and 'mean' (each (n, channels)).
+        Uses the finest pyramid level that fits, or the raw samples if they fit.
+        Blocks at the edges may reach slightly outside of the range.
+        """
+        for level in range(-1, LEVELS):
+            if level == -1:
+                records = self._level(0)
+                block_size = BASE_BLOCK
+            else:
+                records = self._level(level)
+                block_size = 1
+
+            first = np.searchsorted(records['t_end'], t_start, side='left')
+            last = np.searchsorted(records['t_start'], t_end, side='right')
+            if (last - first) * block_size > max_points and level + 1 < LEVELS:
+                continue
+
+            if level == -1:
+                timestamps, values = self.read(t_start, t_end)
+                return {'t': timestamps, 'min': values, 'max': values, 'mean': values}
+
+            records = records[first:last]
+            return {
+                't': np.array(records['t_start']),
+                'min': np.array(records['min']),
+                'max': np.array(records['max']),
+                'mean': records['sum'] / np.maximum(records['count'], 1)[:, None],
+            }
+
+
+class SensorRecorder():
+    """
+    Appends every value of a capability of a Sensor (e.g. 'accelerometer') to a SessionWriter.
+    """
+
+    def __init__(self, sensor, writer, capability='accelerometer'):
+        self.sensor = sensor
+        self.writer = writer
+        self.capability = capability
+        sensor.register_callback(capability, self.on_value)
+
+    def on_value(self, value):
+        self.writer.append(time(), [value[channel] for channel in self.writer.channels])
+
+    def stop(self):
+        self.sensor.unregister_callback(self.capability, self.on_value)
+        self.writer.close()
+
+
+def print_info(path):
+    reader = SessionReader(path)
+    time_range = reader.time_range()
+    size = sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+    print(f'{path}: {len(reader)} samples, channels {reader.channels}, {size / 1024:.1f} KiB')
+    if time_range:
+        print(f'time range: {time_range[0]:.3f} - {time_range[1]:.3f} ({time_range[1] - time_range[0]:.1f} s)')
+
+
+if __name__ == '__main__':
+    if len(sys.argv) >= 4 and sys.argv[1] == 'record':
+        from DIPPID import SensorUDP
+
+        sensor = SensorUDP(int(sys.argv[2]))
+        recorder = SensorRecorder(sensor, SessionWriter(sys.argv[3]), *sys.argv[4:5])
+        print(f'recording to {sys.argv[3]}, press ctrl+c to stop')
+        try:
+            Event().wait()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            sensor.disconnect()
+            recorder.stop()
+            print_info(sys.argv[3])
+    elif len(sys.argv) == 3 and sys.argv[1] == 'info':
+        print_info(sys.argv[2])
+    else:
+        print("Usage: python3 dippid_store.py record PORT DIR [CAPABILITY] | info DIR")
+        sys.exit(4)
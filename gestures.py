@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+# coding: utf-8
+# -*- coding: utf-8 -*-
+
+"""
+Gesture recognition over accelerometer and gyroscope samples.
+
+Samples are collected in a sliding window. Every HOP samples the features of all new windows
+(energy, zero crossings, spectral peak per channel) are computed in one vectorized pass.
+Windows with enough energy are compared to the recorded templates with DTW and the closest
+template below the threshold is emitted as a GestureEvent.
+The work per sample is bounded (at most one DTW comparison per hop), so several devices
+can be handled on one core.
+
+Standalone usage:
+    python3 gestures.py 5700 record shake       record a template (perform the gesture once)
+    python3 gestures.py 5700                    print recognized gestures
+"""
+
+import sys
+from collections import namedtuple
+from threading import Event
+from time import sleep
+import numpy as np
+from DIPPID import SensorUDP, SensorCapabilities, profiler
+
+# accelerometer x, y, z and gyroscope x, y, z
+CHANNELS = 6
+# samples per window and samples between two evaluations
+WINDOW = 64
+HOP = 8
+# windows and templates are resampled to this length before DTW
+TEMPLATE_LENGTH = 32
+# Sakoe-Chiba band of the DTW (in resampled samples)
+DTW_BAND = 4
+# windows with less mean energy (after removing the mean) are treated as rest
+ENERGY_THRESHOLD = 0.02
+# maximum DTW distance (per resampled sample) of a match
+DISTANCE_THRESHOLD = 0.5
+TEMPLATE_FILE = 'gesture_templates.npz'
+
+GestureEvent = namedtuple('GestureEvent', ['name', 'distance', 'sample'])
+
+
+def extract_features(windows):
+    """
+    Features of a batch of windows (shape: windows, samples, channels), each of shape (windows, channels):
+    energy (mean square after removing the mean), zero crossings and the index of the strongest frequency.
+    """
+    centered = windows - windows.mean(axis=1, keepdims=True)
+    energy = (centered ** 2).mean(axis=1)
+
+    signs = np.signbit(centered)
+    zero_crossings = np.count_nonzero(signs[:, 1:] != signs[:, :-1], axis=1)
+
+    spectrum = np.abs(np.fft.rfft(centered, axis=1))
+    # ignore the DC component
+    peak_frequency = spectrum[:, 1:].argmax(axis=1) + 1
+
+    return {'energy': energy, 'zero_crossings': zero_crossings, 'peak_frequency': peak_frequency}
+
+
+def normalize(sequence, length=TEMPLATE_LENGTH):
+    """
+    Resamples a sequence (samples, channels) to the given length and removes the mean of every channel
+    """
+    positions = np.linspace(0, len(sequence) - 1, length)
+    resampled = np.column_stack([np.interp(positions, np.arange(len(sequence)), channel)
+                                 for channel in sequence.T])
+    return resampled - resampled.mean(axis=0)
+
+
+def dtw_distances(sequence, templates, band=DTW_BAND):
+    """
+    DTW distance between a normalized sequence (length, channels) and every template
+    (templates, length, channels), computed for all templates at once.
+    """
+    length = len(sequence)
+    cost = np.linalg.norm(templates[:, None, :, :] - sequence[None, :, None, :], axis=3)
+
+    accumulated = np.full((len(templates), length + 1, length + 1), np.inf)
+    accumulated[:, 0, 0] = 0
+    for i in range(1, length + 1):
+        for j in range(max(1, i - band), min(length, i + band) + 1):
+            accumulated[:, i, j] = cost[:, i - 1, j - 1] + np.minimum(
+                np.minimum(accumulated[:, i - 1, j - 1], accumulated[:, i - 1, j]), accumulated[:, i, j - 1])
+
+    return accumulated[:, length, length] / length
+
+
+class GestureRecognizer():
+    """
+    Recognizes gestures of one device. Call add_samples() with blocks of samples (samples, CHANNELS);
+    it returns the GestureEvents that were recognized in the block.
+    """
+
+    def __init__(self, templates=None, window=WINDOW, hop=HOP,
+                 energy_threshold=ENERGY_THRESHOLD, distance_threshold=DISTANCE_THRESHOLD):
+        self.window = window
+        self.hop = hop
+        self.energy_threshold = energy_threshold
+        self.distance_threshold = distance_threshold
+        self.names = []
+        self.templates = np.empty((0, TEMPLATE_LENGTH, CHANNELS))
+        self.features = None
+
+        self._history = np.zeros((window, CHANNELS))
+        self._count = 0
+        # after a gesture, the device has to be at rest once before the next gesture is recognized
+        self._armed = True
+
+        for name, template in (templates or {}).items():
+            self.add_template(name, template)
+
+    def add_template(self, name, samples):
+        self.names.append(name)
+        self.templates = np.concatenate((self.templates, normalize(np.asarray(samples, dtype=np.float64))[None]))
+
+    # number of samples added so far
+    @property
+    def samples(self):
+        return self._count
+
+    def last_window(self):
+        return self._history.copy()
+
+    @profiler.profile('GestureRecognizer.add_samples')
+    def add_samples(self, samples):
+        samples = np.asarray(samples, dtype=np.float64).reshape(-1, CHANNELS)
+        if len(samples) == 0:
+            return []
+
+        data = np.concatenate((self._history, samples))
+        self._history = data[-self.window:]
+        first_sample = self._count - self.window
+        self._count += len(samples)
+
+        # sample numbers at which a window ends and an evaluation is due
+        # (the window ending at the previous sample count was evaluated by the previous call)
+        ends = np.arange(first_sample + self.window + 1, self._count + 1)
+        ends = ends[(ends % self.hop == 0) & (ends >= self.window)]
+        if len(ends) == 0:
+            return []
+
+        windows = np.lib.stride_tricks.sliding_window_view(data, self.window, axis=0)
+        windows = windows[ends - first_sample - self.window].transpose(0, 2, 1)
+        self.features = extract_features(windows)
+
+        if len(self.templates) == 0:
+            return []
+
+        moving = self.features['energy'].mean(axis=1) > self.energy_threshold
+        if not self._armed:
+            resting = np.flatnonzero(~moving)
+            if len(resting) == 0:
+                return []
+            self._armed = True
+            moving[:resting[0]] = False
+
+        # only the newest window with enough energy is compared to the templates
+        active = np.flatnonzero(moving)
+        if len(active) == 0:
+            return []
+
+        newest = active[-1]
+        distances = dtw_distances(normalize(windows[newest]), self.templates)
+        best = int(distances.argmin())
+        if distances[best] > self.distance_threshold:
+            return []
+
+        self._armed = False
+        return [GestureEvent(self.names[best], float(distances[best]), int(ends[newest]))]
+
+    def save_templates(self, path=TEMPLATE_FILE):
+        np.savez(path, names=np.array(self.names), templates=self.templates)
+
+    def load_templates(self, path=TEMPLATE_FILE):
+        stored = np.load(path)
+        self.names = [str(name) for name in stored['names']]
+        self.templates = stored['templates']
+
+
+class SensorGestures():
+    """
+    Connects a GestureRecognizer to a Sensor: every accelerometer sample (together with the
+    latest gyroscope value) is added to the recognizer and callback is called for every gesture.
+    """
+
+    def __init__(self, sensor, recognizer, callback):
+        self.sensor = sensor
+        self.recognizer = recognizer
+        self.callback = callback
+        sensor.register_callback(SensorCapabilities.ACCELEROMETER, self.on_accelerometer)
+
+    def on_accelerometer(self, accel):
+        gyro = self.sensor.get_value(SensorCapabilities.GYROSCOPE) or {'x': 0, 'y': 0, 'z': 0}
+        sample = (accel['x'], accel['y'], accel['z'], gyro['x'], gyro['y'], gyro['z'])
+        for event in self.recognizer.add_samples(sample):
+            self.callback(event)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) not in (2, 4) or (len(sys.argv) == 4 and sys.argv[2] != 'record'):
+        print("Usage: python3 gestures.py PORT [record NAME]")
+        sys.exit(4)
+
+    recognizer = GestureRecognizer()
+    try:
+        recognizer.load_templates()
+    except FileNotFoundError:
+        pass
+
+    sensor = SensorUDP(int(sys.argv[1]))
+    try:
+        if len(sys.argv) == 4:
+            print(f'perform "{sys.argv[3]}" now')
+            SensorGestures(sensor, recognizer, lambda event: None)
+            # wait until one full window was recorded after the start
+            start = recognizer.samples
+            while recognizer.samples - start < recognizer.window:
+                sleep(0.05)
+            recognizer.add_template(sys.argv[3], recognizer.last_window())
+            recognizer.save_templates()
+            print(f'saved template "{sys.argv[3]}" to {TEMPLATE_FILE}')
+        else:
+            print(f'recognizing {recognizer.names}, press ctrl+c to stop')
+            SensorGestures(sensor, recognizer, lambda event: print(f'{event.name} (distance {event.distance:.2f})'))
+            Event().wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sensor.disconnect()
@@ -0,0 +1,171 @@
+import numpy as np
+
+# maximum number of balls that can be in the game at the same time
+MAX_BALLS = 1000
+# chance that a ball splits into SPLIT_COUNT new balls when it breaks a brick
+SPLIT_CHANCE = 0.3
+SPLIT_COUNT = 2
+# maximum random change of the horizontal speed when a ball hits a paddle (same as Ball.randomly_adjust_angle())
+PADDLE_ANGLE_ADJUSTMENT = 1.0
+
+
+class BrickGrid:
+    """
+    Geometry of the regular brick field: the cell (row, col) covers
+    x = col * cell_width ... (col + 1) * cell_width and
+    y = top + row * cell_height ... top + (row + 1) * cell_height.
+    hits holds the hits that are left for every cell (0 = no brick).
+    """
+
+    def __init__(self, hits, top, cell_width, cell_height):
+        self.hits = hits
+        self.top = top
+        self.cell_width = cell_width
+        self.cell_height = cell_height
+
+    def cell_rect(self, row, col):
+        """
+        Returns x, y, width and height of the given cell
+        """
+        return (col * self.cell_width, self.top + row * self.cell_height, self.cell_width, self.cell_height)
+
+    def bricks_in_area(self, x, y, width, height):
+        """
+        Returns (row, col) of all bricks that overlap with the given area
+        """
+        first_row = max(int((y - self.top) // self.cell_height), 0)
+        last_row = min(int((y + height - self.top) // self.cell_height), self.hits.shape[0] - 1)
+        first_col = max(int(x // self.cell_width), 0)
+        last_col = min(int((x + width) // self.cell_width), self.hits.shape[1] - 1)
+
+        return [(row, col) for row in range(first_row, last_row + 1) for col in range(first_col, last_col + 1)
+                if self.hits[row, col] > 0]
+
+    def cells_at(self, x, y):
+        """
+        Returns the rows and columns of the cells at the given coordinates and a mask of the
+        coordinates that lie inside the grid.
+        """
+        rows = np.floor((y - self.top) / self.cell_height).astype(np.intp)
+        cols = np.floor(x / self.cell_width).astype(np.intp)
+        inside = (rows >= 0) & (rows < self.hits.shape[0]) & (cols >= 0) & (cols < self.hits.shape[1])
+        # clip so the arrays can be used as indices, outside cells are masked anyway
+        rows = np.clip(rows, 0, self.hits.shape[0] - 1)
+        cols = np.clip(cols, 0, self.hits.shape[1] - 1)
+        return rows, cols, inside
+
+
+class BallSwarm:
+    """
+    All balls of the multi-ball mode.
+    Positions (top left corner, like Ball) and velocities live in NumPy arrays of shape (n, 2),
+    so all collisions of a frame are computed for every ball at once.
+    """
+
+    def __init__(self, x, y, diameter, speed, rng=None):
+        self.diameter = diameter
+        self.radius = diameter / 2
+        self.rng = rng if rng is not None else np.random.default_rng()
+        self.pos = np.array([[x, y]], dtype=np.float64)
+        self.vel = np.array([[speed, -speed]], dtype=np.float64)
+
+    def __len__(self):
+        return len(self.pos)
+
+    def centers(self):
+        return self.pos + self.radius
+
+    def step(self, width, height, paddles, grid):
+        """
+        Moves all balls by one frame and handles collisions with the walls, the paddles and the bricks.
+        Returns the number of brick hits in this frame.
+        """
+        self.pos += self.vel
+
+        self.check_for_window_collision(width)
+        self.check_for_paddle_collision(paddles)
+        hits = self.check_for_brick_collision(grid)
+        self.remove_lost_balls(height)
+        return hits
+
+    def check_for_window_collision(self, width):
+        x = self.pos[:, 0]
+        hit_side = ((x + self.diameter > width) & (self.vel[:, 0] > 0)) | ((x <= 0) & (self.vel[:, 0] < 0))
+        self.vel[hit_side, 0] *= -1
+
+        hit_top = (self.pos[:, 1] <= 0) & (self.vel[:, 1] < 0)
+        self.vel[hit_top, 1] *= -1
+
+    def check_for_paddle_collision(self, paddles):
+        centers = self.centers()
+
+        for paddle in paddles:
+            # closest point of the paddle to each ball center
+            closest_x = np.clip(centers[:, 0], paddle.left(), paddle.left() + paddle.width())
+            closest_y = np.clip(centers[:, 1], paddle.top(), paddle.top() + paddle.height())
+            dist_sq = (centers[:, 0] - closest_x) ** 2 + (centers[:, 1] - closest_y) ** 2
+
+            # only balls that are falling bounce off, so they can't get stuck inside the paddle
+            hit = (dist_sq <= self.radius ** 2) & (self.vel[:, 1] > 0)
+            count = np.count_nonzero(hit)
+            if count == 0:
+                continue
+
+            self.vel[hit, 1] *= -1
+            self.vel[hit, 0] += self.rng.uniform(-PADDLE_ANGLE_ADJUSTMENT, PADDLE_ANGLE_ADJUSTMENT, count)
+
+    def check_for_brick_collision(self, grid):
+        """
+        Each ball tests the cell in front of it in vertical and in horizontal direction.
+        Balls that hit a brick are reflected and the brick loses one hit per ball.
+        """
+        centers = self.centers()
+        lead_x = centers[:, 0] + np.sign(self.vel[:, 0]) * self.radius
+        lead_y = centers[:, 1] + np.sign(self.vel[:, 1]) * self.radius
+
+        rows_v, cols_v, inside_v = grid.cells_at(centers[:, 0], lead_y)
+        hit_v = inside_v & (grid.hits[rows_v, cols_v] > 0)
+
+        rows_h, cols_h, inside_h = grid.cells_at(lead_x, centers[:, 1])
+        # a ball that already hit a brick vertically does not also bounce sideways in the same frame
+        hit_h = inside_h & (grid.hits[rows_h, cols_h] > 0) & ~hit_v
+
+        self.vel[hit_v, 1] *= -1
+        self.vel[hit_h, 0] *= -1
+
+        rows = np.concatenate((rows_v[hit_v], rows_h[hit_h]))
+        cols = np.concatenate((cols_v[hit_v], cols_h[hit_h]))
+        if len(rows) == 0:
+            return 0
+
+        # several balls may hit the same brick in one frame
+        np.subtract.at(grid.hits, (rows, cols), 1)
+        np.maximum(grid.hits, 0, out=grid.hits)
+
+        broken = grid.hits[rows, cols] == 0
+        self.split(np.concatenate((np.flatnonzero(hit_v), np.flatnonzero(hit_h)))[broken])
+        return len(rows)
+
+    def split(self, indices):
+        """
+        Powerup: some of the balls that broke a brick split into SPLIT_COUNT new balls
+        that fly off in random directions.
+        """
+        indices = indices[self.rng.random(len(indices)) < SPLIT_CHANCE]
+        free = MAX_BALLS - len(self.pos)
+        if len(indices) == 0 or free <= 0:
+            return
+
+        parents = np.repeat(indices, SPLIT_COUNT)[:free]
+        speed = np.hypot(self.vel[parents, 0], self.vel[parents, 1])
+        angle = self.rng.uniform(-np.pi * 0.8, -np.pi * 0.2, len(parents))
+        new_vel = np.column_stack((np.cos(angle) * speed, np.sin(angle) * speed))
+
+        self.pos = np.concatenate((self.pos, self.pos[parents]))
+        self.vel = np.concatenate((self.vel, new_vel))
+
+    def remove_lost_balls(self, height):
+        alive = self.pos[:, 1] <= height
+        if not alive.all():
+            self.pos = self.pos[alive]
+            self.vel = self.vel[alive]
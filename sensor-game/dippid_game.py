@@ -1,9 +1,17 @@
 import math
 import random
+import argparse
 import sys
 from enum import Enum
+import numpy as np
 from PyQt5 import QtGui, QtCore, QtWidgets
-from DIPPID import SensorUDP
+from time import perf_counter
+from DIPPID import Sensor, Decimate, OnsetDetector, profiler, install_interrupt_handler
+from DIPPID import add_scheduling_params, scheduling_from_params, format_receive_latency
+from dippid_hub import SensorHub
+from ball_physics import BallSwarm, BrickGrid
+from levels import LevelCache
+from input_filter import FILTERS, TiltInput
 
 ROW_TOP_BUFFER = 40                     # size of the space at the top of the screen that should be empty
 BRICKS_PER_ROW = 15
@@ -13,6 +21,7 @@ NUM_ROWS = 5
 PADDLE_WIDTH = 130
 PADDLE_HEIGHT = 20
 PADDLE_SPEED = 10
+PADDLE_DASH = 150                       # a tap with the device moves the paddle this far in the direction of the tilt
 
 BALL_DIAMETER = 25
 BALL_SPEED = 2.5
@@ -20,6 +29,12 @@ BALL_SPEED = 2.5
 WINDOW_WIDTH = 1280
 WINDOW_HEIGHT = 720
 
+DEFAULT_PORT = 5700
+DEFAULT_FILTER = 'one-euro'
+# paddle colors of the players, the first player keeps the original red paddle
+PLAYER_COLORS = [QtCore.Qt.red, QtCore.Qt.blue, QtCore.Qt.darkGreen, QtCore.Qt.magenta,
+                 QtCore.Qt.darkCyan, QtCore.Qt.darkYellow, QtCore.Qt.darkRed, QtCore.Qt.darkBlue]
+
 app = QtWidgets.QApplication(sys.argv)
 
 
@@ -46,17 +61,7 @@ class SensorCapabilities:
     ACCELEROMETER = 'accelerometer'
     GYROSCOPE = 'gyroscope'
     GRAVITY = 'gravity'
-
-
-class Brick(QtCore.QRect):
-    """
-    Class representing the bricks.
-    Has an additional field for how many hits it takes to break the brick.
-    """
-
-    def __init__(self, hits_to_break, x, y, width, height):
-        super().__init__(x, y, width, height)
-        self.hits_to_break = hits_to_break
+    TAP = 'tap'
 
 
 class Paddle(QtCore.QRect):
@@ -65,11 +70,12 @@ class Paddle(QtCore.QRect):
     Can be moved within the boundaries of the widget.
     """
 
-    def __init__(self, x, y, width, height, window):
+    def __init__(self, x, y, width, height, window, color=QtCore.Qt.red):
         super().__init__(x, y, width, height)
         self.paddle_width = width
         self.paddle_height = height
         self.window = window
+        self.color = color
 
     def move(self, delta):
         self.moveLeft(self.x() + delta)
@@ -114,22 +120,26 @@ class Ball:
         self.check_for_brick_collision()
 
     def check_for_brick_collision(self):
-        for brick in self.window.bricks[:]:
-            direction = self.intersects_rectangle(brick)
+        # only the bricks around the ball need to be checked
+        for cell in self.window.brick_grid.bricks_in_area(self.x, self.y, self.diameter, self.diameter):
+            direction = self.intersects_rectangle(self.window.brick_rect(*cell))
             if direction == CollisionDirection.TOP_BOTTOM:
-                self.on_brick_hit(brick)
+                self.on_brick_hit(cell)
                 self.speed_y *= -1
             elif direction == CollisionDirection.LEFT_RIGHT:
-                self.on_brick_hit(brick)
+                self.on_brick_hit(cell)
                 self.speed_x *= -1
 
     def check_for_paddle_collision(self):
-        collision = self.intersects_rectangle(self.window.paddle)
-        if collision == CollisionDirection.TOP_BOTTOM:
-            self.speed_y *= -1
-            self.randomly_adjust_angle()  # not sure if we should include this, makes the game more fun though imo
-        elif collision == CollisionDirection.LEFT_RIGHT:
-            self.speed_x *= -1
+        for player in self.window.players:
+            collision = self.intersects_rectangle(player.paddle)
+            if collision == CollisionDirection.TOP_BOTTOM:
+                self.speed_y *= -1
+                self.randomly_adjust_angle()  # not sure if we should include this, makes the game more fun though imo
+                return
+            elif collision == CollisionDirection.LEFT_RIGHT:
+                self.speed_x *= -1
+                return
 
     def check_for_window_collision(self):
         if self.x + self.radius * 2 > self.window.frameGeometry().width() or self.x <= 0:
@@ -171,12 +181,12 @@ class Ball:
         if self.y > self.window.frameGeometry().height():
             self.window.on_game_over()
 
-    def on_brick_hit(self, brick):
-        brick.hits_to_break -= 1
+    def on_brick_hit(self, cell):
+        hits = self.window.brick_grid.hits
+        hits[cell] -= 1
         self.window.score += 1
 
-        if brick.hits_to_break <= 0:
-            self.window.bricks.remove(brick)
+        if hits[cell] <= 0:
             self.window.check_for_win()
 
     def randomly_adjust_angle(self):
@@ -184,6 +194,25 @@ class Ball:
         self.speed_x += random_adjustment
 
 
+class Player:
+    """
+    One player of the game: a DIPPID device, the filtered tilt input of the device and the paddle it controls.
+    """
+
+    def __init__(self, number, sensor, tilt, paddle):
+        self.number = number
+        self.sensor = sensor
+        self.tilt = tilt
+        self.paddle = paddle
+        # set on the receive thread when the device was tapped, the next frame performs the dash
+        self.dash = False
+        self.onsets = OnsetDetector(sensor)
+        sensor.register_callback(SensorCapabilities.TAP, self.on_tap)
+
+    def on_tap(self, event):
+        self.dash = True
+
+
 class PongPing(QtWidgets.QWidget):
     """
     Main game class.
@@ -191,40 +220,59 @@ class PongPing(QtWidgets.QWidget):
     Press "Button 1" on your phone to start the game.
     Hold your phone sideways and tilt it left or right to move the paddle.
     The game loop is handled by a QTimer and runs at "60 fps".
+    Several players can play together, each device sends to its own port and controls its own paddle.
+    All devices are received by a single SensorHub thread.
+    In multi-ball mode, balls split when they break a brick and are simulated all at once by a BallSwarm.
+    The bricks are stored as an array of hit counts (see levels.py), a restart only copies the cached level.
+    The tilt of each device (accelerometer or gravity) is smoothed by an input filter (see input_filter.py)
+    and predicted for the render time.
+    Tapping the device makes the paddle dash in the direction it is tilted (see DIPPID.OnsetDetector).
     """
 
-    sensor = ()
-    paddle = ()
+    hub = ()
     ball = ()
     timer = ()
     last_frame_timestamp = None
-    bricks = []
+    brick_grid = ()
     score = 0
 
-    def __init__(self):
+    def __init__(self, ports=(DEFAULT_PORT,), multiball=False, level_path=None, seed=None,
+                 input_filter=DEFAULT_FILTER, input_decimation=1, tilt_source=SensorCapabilities.ACCELEROMETER):
         super().__init__()
         self.resize(WINDOW_WIDTH, WINDOW_HEIGHT)
         self.game_state = GameState.INTRO
-
-        self.init_sensor()
+        self.multiball = multiball
+        self.input_filter = input_filter
+        self.input_decimation = input_decimation
+        self.tilt_source = tilt_source
+        self.level_path = level_path
+        self.seed = seed
+        self.levels = LevelCache()
+
+        self.init_sensors(ports)
         self.init_bricks()
-        self.init_paddle()
+        self.init_players()
         self.init_ball()
         self.init_game_loop_timer()
         self.setFocusPolicy(QtCore.Qt.StrongFocus)
         self.score_rect = QtCore.QRect(10, 0, self.frameGeometry().width(), 30)
         self.victory_rect = QtCore.QRect(0, self.frameGeometry().height() / 1.5,
                                          self.frameGeometry().width(), 100)
+        self.latency_rect = QtCore.QRect(0, 0, self.frameGeometry().width() - 10, 30)
         self.show()
 
+    @profiler.profile('PongPing.paintEvent')
     def paintEvent(self, event):
         painter = QtGui.QPainter(self)
 
         self.draw_bricks(painter)
-        self.draw_paddle(painter)
+        self.draw_paddles(painter)
         self.draw_ball(painter)
         self.draw_score(painter)
 
+        if len(self.players) > 1:
+            self.draw_latency(painter)
+
         if self.game_state == GameState.INTRO:
             self.draw_intro_message(painter)
 
@@ -237,17 +285,24 @@ class PongPing(QtWidgets.QWidget):
     def draw_bricks(self, painter):
         painter.setPen(QtGui.QPen(QtCore.Qt.black, 2, QtCore.Qt.SolidLine))
 
-        for brick in self.bricks:
-            self.set_brush_to_brick_color(brick, painter)
-            painter.drawRect(brick)
+        hits = self.brick_grid.hits
+        for row, col in zip(*np.nonzero(hits)):
+            self.set_brush_to_brick_color(hits[row, col], painter)
+            painter.drawRect(self.brick_rect(row, col))
 
-    def draw_paddle(self, painter):
-        painter.setBrush(QtGui.QBrush(QtCore.Qt.red, QtCore.Qt.SolidPattern))
-        painter.drawRect(self.paddle)
+    def draw_paddles(self, painter):
+        for player in self.players:
+            painter.setBrush(QtGui.QBrush(player.paddle.color, QtCore.Qt.SolidPattern))
+            painter.drawRect(player.paddle)
 
     def draw_ball(self, painter):
         painter.setBrush(QtGui.QBrush(QtCore.Qt.black, QtCore.Qt.SolidPattern))
-        painter.drawEllipse(self.ball.x, self.ball.y, self.ball.radius, self.ball.radius)
+
+        if self.multiball:
+            for x, y in self.ball.pos:
+                painter.drawEllipse(x, y, self.ball.radius, self.ball.radius)
+        else:
+            painter.drawEllipse(self.ball.x, self.ball.y, self.ball.radius, self.ball.radius)
 
     def draw_score(self, painter):
         painter.setPen(QtGui.QColor(55, 55, 55))
@@ -255,6 +310,22 @@ class PongPing(QtWidgets.QWidget):
         text = "Score: " + str(self.score)
         painter.drawText(self.score_rect, QtCore.Qt.AlignLeft, text)
 
+    def draw_latency(self, painter):
+        """
+        Shows the mean input latency of every player in the top right corner
+        (age of the applied sensor value + lag of the input filter)
+        """
+        painter.setFont(QtGui.QFont('Decorative', 10))
+        texts = []
+        for player in self.players:
+            stats = player.sensor.latency.summary()
+            filter_stats = player.tilt.filter_latency.summary()
+            if stats is None or filter_stats is None:
+                texts.append(f"P{player.number}: -")
+            else:
+                texts.append(f"P{player.number}: {stats['mean']:.1f}+{filter_stats['mean']:.1f}ms")
+        painter.drawText(self.latency_rect, QtCore.Qt.AlignRight, "  ".join(texts))
+
     def draw_victory_message(self, painter):
         text = "You won!\nPress Button 1 to start another round"
         painter.drawText(self.victory_rect, QtCore.Qt.AlignCenter, text)
@@ -265,32 +336,59 @@ class PongPing(QtWidgets.QWidget):
 
     def draw_intro_message(self, painter):
         text = "Hold your phone sideways.\nPress 'Button 1' to start the game.\nWhen the game is started," \
-               " tilt your phone sideways to move the paddle."
+               " tilt your phone sideways to move the paddle.\nTap your phone to dash."
         painter.drawText(self.victory_rect, QtCore.Qt.AlignCenter, text)
 
     def init_bricks(self):
-        width = self.frameGeometry().width() / BRICKS_PER_ROW
-        height = (self.frameGeometry().height() / 2) / NUM_ROWS  # uncomment this line for height auto-calculation
-        # height = BRICK_HEIGHT                                  # uncomment this line for manual height assignment
-        for x in range(0, BRICKS_PER_ROW):
-            for y in range(0, NUM_ROWS):
-                hits_to_break = random.randrange(1, 4)
-                self.bricks.append(Brick(hits_to_break, x * width, y * height + ROW_TOP_BUFFER, width, height))
-
-    def init_paddle(self):
-        xPos = self.frameGeometry().width() / 2 - PADDLE_WIDTH / 2
+        """
+        Copies the level (hits per brick) from the level cache.
+        Without level file and seed, a new random level is generated.
+        """
+        hits = self.levels.get(self.level_path, NUM_ROWS, BRICKS_PER_ROW, self.seed)
+        rows, cols = hits.shape
+
+        width = self.frameGeometry().width() / cols
+        height = (self.frameGeometry().height() / 2) / rows  # uncomment this line for height auto-calculation
+        # height = BRICK_HEIGHT                              # uncomment this line for manual height assignment
+        self.brick_grid = BrickGrid(hits, ROW_TOP_BUFFER, width, height)
+
+    def brick_rect(self, row, col):
+        x, y, width, height = self.brick_grid.cell_rect(row, col)
+        return QtCore.QRect(int(x), int(y), int(width), int(height))
+
+    def init_players(self):
+        """
+        Creates one paddle per sensor. The paddles are spread evenly over the width of the window.
+        """
+        self.players = []
+        section_width = self.frameGeometry().width() / len(self.hub.sensors)
         yPos = self.frameGeometry().height() - PADDLE_HEIGHT - 10
 
-        self.paddle = Paddle(xPos, yPos, PADDLE_WIDTH, PADDLE_HEIGHT, self)
+        for i, sensor in enumerate(self.hub.sensors):
+            xPos = section_width * (i + 0.5) - PADDLE_WIDTH / 2
+            color = PLAYER_COLORS[i % len(PLAYER_COLORS)]
+            paddle = Paddle(xPos, yPos, PADDLE_WIDTH, PADDLE_HEIGHT, self, color)
+            # the sensor averages input_decimation samples before the filter sees them
+            policy = Decimate(self.input_decimation) if self.input_decimation > 1 else None
+            tilt = TiltInput(sensor, FILTERS[self.input_filter](), self.tilt_source, 'y', policy)
+            self.players.append(Player(i + 1, sensor, tilt, paddle))
 
-    def init_sensor(self):
-        self.sensor = SensorUDP(5700)
-        self.sensor.register_callback(SensorCapabilities.BUTTON_1, self.handle_button_1_press)
+    def init_sensors(self, ports):
+        self.hub = SensorHub(ports)
+        for sensor in self.hub.sensors:
+            sensor.register_callback(SensorCapabilities.BUTTON_1, self.handle_button_1_press)
 
     def init_ball(self):
-        xPos = self.paddle.x() + self.paddle.paddle_width / 2
-        yPos = self.paddle.y() - BALL_DIAMETER - 5
-        self.ball = Ball(xPos, yPos, BALL_DIAMETER, self)
+        # the ball starts above the paddle of the first player
+        paddle = self.players[0].paddle
+        xPos = paddle.x() + paddle.paddle_width / 2
+        yPos = paddle.y() - BALL_DIAMETER - 5
+
+        if self.multiball:
+            # a seeded game also splits the balls reproducibly
+            self.ball = BallSwarm(xPos, yPos, BALL_DIAMETER, BALL_SPEED, np.random.default_rng(self.seed))
+        else:
+            self.ball = Ball(xPos, yPos, BALL_DIAMETER, self)
 
     def init_game_loop_timer(self):
         self.timer = QtCore.QTimer(self)
@@ -309,7 +407,6 @@ class PongPing(QtWidgets.QWidget):
             self.restart_game()
 
     def restart_game(self):
-        self.bricks = []
         self.init_bricks()
 
         self.init_ball()
@@ -321,25 +418,52 @@ class PongPing(QtWidgets.QWidget):
         self.update()
         self.game_state = GameState.INTRO
 
+    @profiler.profile('PongPing.game_loop')
     def game_loop(self):
         if self.game_state == GameState.STARTED:
-            self.move_paddle()
+            frame_time = perf_counter()
+            for player in self.players:
+                self.move_paddle(player, frame_time)
+                player.sensor.record_frame(frame_time)
             self.move_ball()
 
             self.update()
-
-    def move_paddle(self):
-        if self.sensor.has_capability(SensorCapabilities.ACCELEROMETER):
-            sensorVal = self.sensor.get_value(SensorCapabilities.ACCELEROMETER)
         else:
+            # the paddles don't move, the filters start over with the first frame of the game
+            # and taps before the start don't dash
+            for player in self.players:
+                player.tilt.discard()
+                player.dash = False
+
+    def move_paddle(self, player, frame_time):
+        y_value = player.tilt.value_at(frame_time)
+        if y_value is None:
             return
 
-        y_value = sensorVal['y']
+        player.paddle.move(y_value * PADDLE_SPEED)
+        if player.dash:
+            player.dash = False
+            player.paddle.move(int(math.copysign(PADDLE_DASH, y_value)))
+
+    def print_latency_stats(self):
+        for player in self.players:
+            stats = player.sensor.latency.summary()
+            if stats is None:
+                print(f"Player {player.number}: no input received")
+                continue
+            print(f"Player {player.number}: {player.sensor.packets} packets, input latency "
+                  f"mean {stats['mean']:.1f}ms, p95 {stats['p95']:.1f}ms, max {stats['max']:.1f}ms")
+
+            filter_stats = player.tilt.filter_latency.summary()
+            if filter_stats is not None:
+                print(f"Player {player.number}: {self.input_filter} filter lag "
+                      f"mean {filter_stats['mean']:.1f}ms, p95 {filter_stats['p95']:.1f}ms")
 
-        self.paddle.move(y_value * PADDLE_SPEED)
+            if player.sensor.receive_latency is not None:
+                print(format_receive_latency(f"Player {player.number}", player.sensor))
 
     def check_for_win(self):
-        if len(self.bricks) <= 0:
+        if not self.brick_grid.hits.any():
             self.game_state = GameState.WON
             self.update()
 
@@ -347,23 +471,75 @@ class PongPing(QtWidgets.QWidget):
         self.game_state = GameState.LOST
         self.update()
 
-    def set_brush_to_brick_color(self, brick, painter):
+    def set_brush_to_brick_color(self, hits_to_break, painter):
         """
         Color the bricks according to how many hits it takes to break them
         """
-        if brick.hits_to_break > 3:
+        if hits_to_break > 3:
             painter.setBrush(QtGui.QBrush(QtCore.Qt.black, QtCore.Qt.SolidPattern))
-        elif brick.hits_to_break == 3:
+        elif hits_to_break == 3:
             painter.setBrush(QtGui.QBrush(QtCore.Qt.blue, QtCore.Qt.SolidPattern))
-        elif brick.hits_to_break == 2:
+        elif hits_to_break == 2:
             painter.setBrush(QtGui.QBrush(QtCore.Qt.green, QtCore.Qt.SolidPattern))
-        elif brick.hits_to_break == 1:
+        elif hits_to_break == 1:
             painter.setBrush(QtGui.QBrush(QtCore.Qt.yellow, QtCore.Qt.SolidPattern))
 
     def move_ball(self):
-        self.ball.move()
+        if self.multiball:
+            self.move_balls()
+        else:
+            self.ball.move()
+
+    def move_balls(self):
+        """
+        Multi-ball mode: moves all balls at once, the brick hits are applied directly to the brick grid.
+        The game is lost when the last ball left the window.
+        """
+        hits = self.ball.step(self.frameGeometry().width(), self.frameGeometry().height(),
+                              [player.paddle for player in self.players], self.brick_grid)
+        if hits > 0:
+            self.score += hits
+            self.check_for_win()
+
+        if len(self.ball) == 0:
+            self.on_game_over()
+
+
+def player_address(text):
+    port = text[len('shm:'):] if text.startswith('shm:') else text
+    if not port.isnumeric():
+        raise argparse.ArgumentTypeError(f'invalid port "{text}"')
+    return text if text.startswith('shm:') else int(text)
+
+
+def parse_params():
+    parser = argparse.ArgumentParser(description="PongPing - a breakout game controlled with DIPPID devices")
+    # if no port is passed, just use the default port (single player)
+    parser.add_argument('ports', type=player_address, nargs='*', default=[DEFAULT_PORT],
+                        help="one DIPPID port per player (default: 5700) or shm:<port> "
+                             "to share a device with a running dippid_shm.py receiver (e.g. for analyze.py)")
+    parser.add_argument('--multiball', action='store_true', help="balls split when they break a brick")
+    parser.add_argument('--level', help="level file (.txt with one digit per brick or .npy)")
+    parser.add_argument('--seed', type=int, help="seed for a reproducible random level")
+    parser.add_argument('--filter', choices=FILTERS.keys(), default=DEFAULT_FILTER,
+                        help="filter for the tilt input (default: one-euro)")
+    parser.add_argument('--input-decimation', type=int, default=1,
+                        help="average n tilt samples into one before filtering (default: 1)")
+    parser.add_argument('--tilt-source', default=SensorCapabilities.ACCELEROMETER,
+                        choices=(SensorCapabilities.ACCELEROMETER, SensorCapabilities.GRAVITY),
+                        help="capability the tilt is read from, gravity is smoother if the device sends it "
+                             "in the same unit (default: accelerometer)")
+    add_scheduling_params(parser)
+    return parser.parse_args()
 
 
 if __name__ == "__main__":
-    game = PongPing()
+    params = parse_params()
+    # before the hub starts its receive thread
+    Sensor.scheduling = scheduling_from_params(params)
+    install_interrupt_handler()
+    game = PongPing(params.ports, params.multiball, params.level, params.seed, params.filter,
+                    params.input_decimation, params.tilt_source)
     app.exec()
+    game.print_latency_stats()
+    game.hub.disconnect()
@@ -0,0 +1,191 @@
+import selectors
+import socket
+from collections import deque
+from threading import Thread
+from time import perf_counter, time
+from DIPPID import Sensor, PacketSequencer, profiler
+from dippid_shm import SharedMemorySensor
+
+# how long the receive loop blocks in select() before checking if it should stop
+# and releasing packets that were held back for reordering (seconds)
+SELECT_TIMEOUT = PacketSequencer.REORDER_TIMEOUT
+# number of frames that are kept for the latency statistics of each player
+LATENCY_WINDOW = 600
+
+
+class LatencyStats:
+    """
+    Keeps the input latency (in ms) of the last LATENCY_WINDOW frames.
+    The latency of a frame is the age of the sensor value that was applied in this frame.
+    """
+
+    def __init__(self, window=LATENCY_WINDOW):
+        self.samples = deque(maxlen=window)
+
+    def add(self, latency_ms):
+        self.samples.append(latency_ms)
+
+    def summary(self):
+        if not self.samples:
+            return None
+
+        ordered = sorted(self.samples)
+        return {
+            'mean': sum(ordered) / len(ordered),
+            'p95': ordered[int(0.95 * (len(ordered) - 1))],
+            'max': ordered[-1],
+        }
+
+
+class InputTelemetry:
+    """
+    Input latency of a player: packets received and the age of the latest value in every frame.
+    Mixed into the sensors of the hub, which set packets and last_receive_time (perf_counter()).
+    """
+
+    def _init_telemetry(self):
+        self.packets = 0
+        self.last_receive_time = None
+        self.latency = LatencyStats()
+        self._last_applied_time = None
+
+    def record_frame(self, frame_time):
+        """
+        Called once per frame after the latest value of this sensor has been applied.
+        Only frames that got a new packet count, otherwise a player that holds still would
+        show an ever growing latency.
+        """
+        receive_time = self.last_receive_time
+        if receive_time is None or receive_time == self._last_applied_time:
+            return
+
+        self._last_applied_time = receive_time
+        self.latency.add((frame_time - receive_time) * 1000)
+
+
+class HubSensor(InputTelemetry, Sensor):
+    """
+    A Sensor that does not own a socket or a thread.
+    It is fed by a SensorHub and otherwise behaves like a SensorUDP
+    (register_callback(), get_value(), ... work as usual).
+    """
+
+    def __init__(self, hub, port):
+        Sensor.__init__(self)
+        self._hub = hub
+        self._port = port
+        self._connection_thread = None
+        self._init_telemetry()
+
+    def _on_packet(self, data, receive_time):
+        try:
+            data_decoded = data.decode()
+        except UnicodeDecodeError:
+            return
+        self.packets += 1
+        self.last_receive_time = receive_time
+        self._update(data_decoded)
+
+    def disconnect(self):
+        Sensor.disconnect(self)
+        self._hub.remove(self)
+
+
+class SharedMemoryHubSensor(InputTelemetry, SharedMemorySensor):
+    """
+    A player that reads a device from a running dippid_shm.py receiver (address "shm:<port>"),
+    so the game and analyze.py can use the same device at the same time.
+    Reads the shared memory with its own thread, the latency includes the time in the publisher.
+    """
+
+    def __init__(self, hub, port):
+        self._hub = hub
+        self._init_telemetry()
+        self._last_record_time = None
+        SharedMemorySensor.__init__(self, port)
+
+    def _update(self, key, value):
+        record_time = self.last_record_time
+        if record_time != self._last_record_time:
+            # all capabilities of a packet have the same time
+            self._last_record_time = record_time
+            self.packets += 1
+            # when the publisher received the packet, on the clock of perf_counter()
+            self.last_receive_time = perf_counter() - (time() - record_time)
+        SharedMemorySensor._update(self, key, value)
+
+    def disconnect(self):
+        SharedMemorySensor.disconnect(self)
+        self._hub.remove(self)
+
+
+class SensorHub:
+    """
+    Receives DIPPID packets for several devices with a single thread.
+    Every device sends to its own UDP port, all sockets are served by one selector loop.
+    Each port is represented by a HubSensor in self.sensors (same order as the ports).
+    A port "shm:<port>" is read from a running dippid_shm.py receiver instead (SharedMemoryHubSensor).
+    """
+
+    def __init__(self, ports, ip='0.0.0.0'):
+        self._selector = selectors.DefaultSelector()
+        self.sensors = []
+
+        for port in ports:
+            if isinstance(port, str) and port.startswith('shm:'):
+                self.sensors.append(SharedMemoryHubSensor(self, port[len('shm:'):]))
+                continue
+
+            port = int(port)
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.bind((ip, port))
+            sock.setblocking(False)
+            sensor = HubSensor(self, port)
+            sensor._measure_receive_latency(sock)
+            self._selector.register(sock, selectors.EVENT_READ, sensor)
+            self.sensors.append(sensor)
+
+        self._receiving = True
+        self._connection_thread = Thread(target=self._run_receive)
+        self._connection_thread.start()
+
+    def _run_receive(self):
+        Sensor.scheduling.apply('SensorHub receive thread')
+        self._receive()
+
+    def _receive(self):
+        while self._receiving:
+            for key, _ in self._selector.select(timeout=SELECT_TIMEOUT):
+                sensor = key.data
+                # drain the socket, the game only needs the latest state anyway
+                while True:
+                    try:
+                        if sensor.receive_latency is not None:
+                            data, addr = sensor._recvfrom_timed(key.fileobj)
+                        else:
+                            data, addr = key.fileobj.recvfrom(1024)
+                    except BlockingIOError:
+                        break
+                    profiler.count('SensorHub.packets')
+                    sensor._on_packet(data, perf_counter())
+
+            for sensor in self.sensors[:]:
+                sensor._flush_packets()
+
+    # disconnects all sensors of the hub and stops the receive loop
+    def disconnect(self):
+        for sensor in self.sensors[:]:
+            sensor.disconnect()
+
+    # called by the disconnect() of the sensors, stops the loop once no sensor is left
+    def remove(self, sensor):
+        if sensor in self.sensors:
+            self.sensors.remove(sensor)
+        if self.sensors:
+            return
+
+        self._receiving = False
+        self._connection_thread.join()
+        for key in list(self._selector.get_map().values()):
+            key.fileobj.close()
+        self._selector.close()
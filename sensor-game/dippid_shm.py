@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+# coding: utf-8
+# -*- coding: utf-8 -*-
+
+"""
+Shared memory fan-out for DIPPID sensors.
+
+A single receiver process owns the UDP socket, parses every packet once and publishes all
+capabilities into a multiprocessing.shared_memory block. Any number of local processes can
+attach to it with SharedMemorySensor, which behaves like a SensorUDP (callbacks, get_value(), ...)
+but never touches the network.
+Only numbers and x/y/z vectors are published, other values (e.g. strings) are skipped.
+
+Start the receiver with:
+    python3 dippid_shm.py 5700
+and connect the DIPPIDNode (or any script) to "shm:5700".
+"""
+
+import argparse
+import json
+import signal
+import socket
+import sys
+from multiprocessing import Process, resource_tracker, shared_memory
+from time import perf_counter, sleep, time
+import numpy as np
+from DIPPID import Sensor, profiler, add_scheduling_params, scheduling_from_params
+
+# number of records in the ring buffer (one record per capability and packet)
+RING_SLOTS = 4096
+MAX_CAPABILITIES = 32
+CAPABILITY_NAME_LENGTH = 32
+# how long a client sleeps when there is no new record (seconds)
+POLL_INTERVAL = 0.001
+
+HEADER_DTYPE = np.dtype([('write_count', 'u8'), ('capability_count', 'u8')])
+CAPABILITY_DTYPE = np.dtype([('name', f'S{CAPABILITY_NAME_LENGTH}'), ('vector', 'u1')], align=True)
+# seqlock: the writer sets seq to 0 before and to the record number after writing a record,
+# a reader copies the record and reads seq again, the copy is consistent if both seqs are the expected one
+RECORD_DTYPE = np.dtype([('seq', 'u8'), ('time', 'f8'), ('capability', 'u8'), ('values', 'f8', (3,))], align=True)
+
+AXES = ('x', 'y', 'z')
+
+
+def is_number(value):
+    # bool is an int, buttons may be sent as true/false
+    return isinstance(value, (int, float))
+
+
+def record_values(value):
+    """
+    The three values of a record for a capability value:
+    a number is stored as (value, 0, 0), a dict with numbers for (a subset of) x, y and z as
+    (x, y, z) with 0 for missing axes.
+    Returns None for anything else (strings, lists, dicts with other keys), records only hold float64 numbers.
+    """
+    if is_number(value):
+        values = [value, 0, 0]
+    elif isinstance(value, dict) and value.keys() <= set(AXES) and all(is_number(v) for v in value.values()):
+        values = [value.get(axis, 0) for axis in AXES]
+    else:
+        return None
+
+    try:
+        return [float(v) for v in values]
+    except OverflowError:
+        # an integer too large for a float64
+        return None
+
+
+def shared_memory_name(port):
+    return f'dippid_{port}'
+
+
+class SharedMemoryLayout():
+    """
+    NumPy views on the shared memory block:
+    header (write counter), capability table, latest record per capability and the ring buffer.
+    """
+
+    SIZE = HEADER_DTYPE.itemsize + CAPABILITY_DTYPE.itemsize * MAX_CAPABILITIES + \
+        RECORD_DTYPE.itemsize * (MAX_CAPABILITIES + RING_SLOTS)
+
+    def __init__(self, shm):
+        offset = 0
+        self.header = np.ndarray((1,), HEADER_DTYPE, shm.buf, offset)[0]
+        offset += HEADER_DTYPE.itemsize
+        self.capabilities = np.ndarray((MAX_CAPABILITIES,), CAPABILITY_DTYPE, shm.buf, offset)
+        offset += CAPABILITY_DTYPE.itemsize * MAX_CAPABILITIES
+        self.latest = np.ndarray((MAX_CAPABILITIES,), RECORD_DTYPE, shm.buf, offset)
+        offset += RECORD_DTYPE.itemsize * MAX_CAPABILITIES
+        self.ring = np.ndarray((RING_SLOTS,), RECORD_DTYPE, shm.buf, offset)
+
+
+class SharedMemoryPublisher():
+    """
+    Receives DIPPID packets on a UDP port and publishes them into shared memory.
+    Runs in its own process (see run_publisher() and start_publisher_process()).
+    """
+
+    def __init__(self, port, ip='0.0.0.0', name=None):
+        self.name = name or shared_memory_name(port)
+        self._shm = shared_memory.SharedMemory(self.name, create=True, size=SharedMemoryLayout.SIZE)
+        self._layout = SharedMemoryLayout(self._shm)
+        self._layout.header['write_count'] = 0
+        self._layout.header['capability_count'] = 0
+        self._capability_index = {}
+
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._sock.bind((ip, port))
+
+    def run(self):
+        try:
+            while True:
+                data, addr = self._sock.recvfrom(1024)
+                profiler.count('SharedMemoryPublisher.packets')
+                try:
+                    self.publish(data)
+                except (TypeError, ValueError, OverflowError):
+                    # a malformed packet must not stop the publisher
+                    profiler.count('SharedMemoryPublisher.parse_errors')
+        finally:
+            self.close()
+
+    @profiler.profile('SharedMemoryPublisher.publish')
+    def publish(self, data):
+        try:
+            data_json = json.loads(data)
+        except (json.decoder.JSONDecodeError, UnicodeDecodeError):
+            profiler.count('SharedMemoryPublisher.parse_errors')
+            return
+        if not isinstance(data_json, dict):
+            profiler.count('SharedMemoryPublisher.parse_errors')
+            return
+
+        timestamp = time()
+        for key, value in data_json.items():
+            values = record_values(value)
+            if values is None:
+                # not representable in a record, see record_values()
+                profiler.count('SharedMemoryPublisher.skipped_values')
+                continue
+            index = self._get_capability_index(key, isinstance(value, dict))
+            if index is None:
+                continue
+            self._write(index, timestamp, values)
+
+    def _get_capability_index(self, key, vector):
+        index = self._capability_index.get(key)
+        if index is not None:
+            return index
+
+        index = len(self._capability_index)
+        if index >= MAX_CAPABILITIES:
+            return None
+
+        entry = self._layout.capabilities[index]
+        entry['name'] = key.encode()[:CAPABILITY_NAME_LENGTH]
+        entry['vector'] = vector
+        self._capability_index[key] = index
+        self._layout.header['capability_count'] = index + 1
+        return index
+
+    def _write(self, index, timestamp, values):
+        header = self._layout.header
+        seq = int(header['write_count'])
+        record = self._layout.ring[seq % RING_SLOTS]
+
+        # invalidate the slot while it is written
+        record['seq'] = 0
+        record['time'] = timestamp
+        record['capability'] = index
+        record['values'] = values
+        record['seq'] = seq + 1
+
+        self._layout.latest[index] = record
+        header['write_count'] = seq + 1
+
+    def close(self):
+        self._sock.close()
+        # drop the NumPy views before the buffer is released
+        self._layout = None
+        self._shm.close()
+        self._shm.unlink()
+
+
+# scheduling: ReceiveScheduling for the receiving (main) thread of the process
+def run_publisher(port, name=None, scheduling=None):
+    # terminate() sends SIGTERM, exit normally so the shared memory is unlinked
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    if scheduling is not None:
+        scheduling.apply('publisher process')
+    SharedMemoryPublisher(port, name=name).run()
+
+
+# starts the receiver in a separate process and returns the process
+# the process is scheduled like the receive threads (Sensor.scheduling)
+def start_publisher_process(port, name=None):
+    process = Process(target=run_publisher, args=(port, name, Sensor.scheduling), daemon=True)
+    process.start()
+    return process
+
+
+def _attach(name):
+    shm = shared_memory.SharedMemory(name)
+    # only the publisher may unlink the block, the resource tracker would remove it when a client exits
+    try:
+        resource_tracker.unregister(shm._name, 'shared_memory')
+    except Exception:
+        pass
+    return shm
+
+
+class SharedMemorySensor(Sensor):
+    """
+    Sensor that reads from the shared memory of a SharedMemoryPublisher.
+    Callbacks and get_value() work like for SensorUDP. get_array() returns a NumPy view of the
+    latest values of a capability directly in shared memory (no copy).
+    """
+
+    def __init__(self, port=None, name=None):
+        Sensor.__init__(self)
+        self._name = name or shared_memory_name(port)
+        self.overruns = 0
+        # time (time.time()) at which the publisher received the record that was read last
+        self.last_record_time = None
+        self._connect()
+
+    def _connect(self):
+        self._shm = _attach(self._name)
+        self._layout = SharedMemoryLayout(self._shm)
+        self._capability_names = []
+        # start with the records that are currently in the ring
+        self._read_count = max(int(self._layout.header['write_count']) - RING_SLOTS, 0)
+        self._start_receive_thread()
+
+    def _receive(self):
+        self._receiving = True
+        while self._receiving:
+            if not self._read_new_records():
+                sleep(POLL_INTERVAL)
+
+        self._layout = None
+        self._shm.close()
+
+    def _read_new_records(self):
+        write_count = int(self._layout.header['write_count'])
+        if write_count == self._read_count:
+            return False
+
+        # the publisher was faster than this reader, skip the records that were overwritten
+        if write_count - self._read_count > RING_SLOTS:
+            self.overruns += write_count - self._read_count - RING_SLOTS
+            self._read_count = write_count - RING_SLOTS
+
+        while self._read_count < write_count:
+            slot = self._layout.ring[self._read_count % RING_SLOTS]
+            record = slot.copy()
+            self._read_count += 1
+            if record['seq'] != self._read_count or slot['seq'] != self._read_count:
+                # overwritten before or while copying, the record is lost
+                self.overruns += 1
+                continue
+            self.last_record_time = float(record['time'])
+            key, vector = self._capability(int(record['capability']))
+            self._update(key, self._to_value(record['values'], vector))
+        return True
+
+    def _capability(self, index):
+        while index >= len(self._capability_names):
+            entry = self._layout.capabilities[len(self._capability_names)]
+            self._capability_names.append((entry['name'].decode(), bool(entry['vector'])))
+        return self._capability_names[index]
+
+    @staticmethod
+    def _to_value(values, vector):
+        if vector:
+            return {axis: float(v) for axis, v in zip(AXES, values)}
+        return int(values[0]) if values[0].is_integer() else float(values[0])
+
+    @profiler.profile('SharedMemorySensor._update')
+    def _update(self, key, value):
+        self._add_capability(key)
+
+        # do not notify callbacks on initialization
+        if self._data[key] == []:
+            self._data[key] = value
+            return
+
+        # notify callbacks only if data has changed
+        if self._data[key] != value:
+            self._data[key] = value
+            start = perf_counter() if self._dispatch_listeners else None
+            self._notify_callbacks(key)
+            if start is not None:
+                self._report_dispatch(start)
+
+    # returns the latest values of a capability as a view into shared memory
+    # (x, y, z for vectors, the value in the first element otherwise)
+    def get_array(self, key):
+        for index in range(int(self._layout.header['capability_count'])):
+            if self._capability(index)[0] == key:
+                return self._layout.latest[index]['values']
+        return None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Publishes a DIPPID stream into shared memory")
+    parser.add_argument('port', type=int, help="UDP port of the DIPPID device")
+    add_scheduling_params(parser, latency=False)
+    params = parser.parse_args()
+
+    print(f'publishing port {params.port} to shared memory "{shared_memory_name(params.port)}"')
+    try:
+        run_publisher(params.port, scheduling=scheduling_from_params(params))
+    except KeyboardInterrupt:
+        pass
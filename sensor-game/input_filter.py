@@ -0,0 +1,236 @@
+import math
+from collections import deque
+from threading import Lock
+from time import perf_counter
+from dippid_hub import LatencyStats
+from DIPPID import SlidingWindowStats
+
+# the prediction never reaches further into the future than this (seconds), so a lost connection
+# does not let the paddle drift away
+MAX_EXTRAPOLATION = 0.05
+# samples that arrive faster than this are treated as arriving at the same time (seconds)
+MIN_DT = 1e-4
+# samples a TiltInput keeps between two frames, older ones are dropped if nobody reads them
+MAX_PENDING_SAMPLES = 64
+
+
+class NoFilter:
+    """
+    Passes the samples through unchanged, like the original game did.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.value = None
+        self.velocity = 0.0
+
+    def filter(self, x, t):
+        self.value = x
+        return x
+
+    def lag(self):
+        return 0.0
+
+
+class OneEuroFilter:
+    """
+    1€ filter (Casiez et al. 2012): a low-pass filter whose cutoff frequency rises with the speed of the signal.
+    Slow movements are smoothed strongly (less jitter), fast movements hardly (less lag).
+    min_cutoff and d_cutoff are in Hz, beta controls how fast the cutoff rises with speed.
+    """
+
+    def __init__(self, min_cutoff=3.0, beta=0.5, d_cutoff=1.0):
+        self.min_cutoff = min_cutoff
+        self.beta = beta
+        self.d_cutoff = d_cutoff
+        self.reset()
+
+    def reset(self):
+        self.value = None
+        self.velocity = 0.0
+        self._cutoff = self.min_cutoff
+        self._last_time = None
+
+    @staticmethod
+    def alpha(cutoff, dt):
+        tau = 1 / (2 * math.pi * cutoff)
+        return 1 / (1 + tau / dt)
+
+    def filter(self, x, t):
+        if self.value is None:
+            self.value = x
+            self._last_time = t
+            return x
+
+        dt = max(t - self._last_time, MIN_DT)
+        self._last_time = t
+
+        raw_velocity = (x - self.value) / dt
+        a_d = self.alpha(self.d_cutoff, dt)
+        self.velocity = a_d * raw_velocity + (1 - a_d) * self.velocity
+
+        self._cutoff = self.min_cutoff + self.beta * abs(self.velocity)
+        a = self.alpha(self._cutoff, dt)
+        self.value = a * x + (1 - a) * self.value
+        return self.value
+
+    def lag(self):
+        """
+        Time constant of the current low-pass filter (seconds)
+        """
+        return 1 / (2 * math.pi * self._cutoff)
+
+
+class KalmanFilter:
+    """
+    Kalman filter with a constant velocity model for a single axis.
+    process_noise describes how much the velocity may change (per s^2),
+    measurement_noise the variance of the sensor values.
+    """
+
+    def __init__(self, process_noise=200.0, measurement_noise=0.01):
+        self.process_noise = process_noise
+        self.measurement_noise = measurement_noise
+        self.reset()
+
+    def reset(self):
+        self.value = None
+        self.velocity = 0.0
+        # covariance matrix [[p_xx, p_xv], [p_xv, p_vv]]
+        self._p = [1.0, 0.0, 1.0]
+        self._gain = 1.0
+        self._dt = MIN_DT
+        self._last_time = None
+
+    def filter(self, x, t):
+        if self.value is None:
+            self.value = x
+            self._last_time = t
+            return x
+
+        dt = max(t - self._last_time, MIN_DT)
+        self._last_time = t
+        self._dt = dt
+        p_xx, p_xv, p_vv = self._p
+        q = self.process_noise
+
+        # predict
+        self.value += self.velocity * dt
+        p_xx += dt * (2 * p_xv + dt * p_vv) + q * dt ** 4 / 4
+        p_xv += dt * p_vv + q * dt ** 3 / 2
+        p_vv += q * dt ** 2
+
+        # correct with the measured value
+        s = p_xx + self.measurement_noise
+        k_x = p_xx / s
+        k_v = p_xv / s
+        residual = x - self.value
+        self.value += k_x * residual
+        self.velocity += k_v * residual
+        self._p = [(1 - k_x) * p_xx, (1 - k_x) * p_xv, p_vv - k_v * p_xv]
+        self._gain = k_x
+        return self.value
+
+    def lag(self):
+        """
+        Lag of the position estimate (seconds), the same as for an exponential smoothing with the current gain
+        """
+        return self._dt * (1 - self._gain) / max(self._gain, MIN_DT)
+
+
+class MovingAverageFilter:
+    """
+    Mean of the last `window` samples (see DIPPID.SlidingWindowStats, O(1) per sample).
+    Removes jitter reliably but lags by half the window.
+    """
+
+    def __init__(self, window=8):
+        self.stats = SlidingWindowStats(window)
+        self.reset()
+
+    def reset(self):
+        self.stats.reset()
+        self.value = None
+        self.velocity = 0.0
+        self._dt = MIN_DT
+        self._last_time = None
+
+    def filter(self, x, t):
+        self.stats.add(x)
+        if self._last_time is not None:
+            self._dt = max(t - self._last_time, MIN_DT)
+            # change of the mean per second
+            self.velocity = (self.stats.mean - self.value) / self._dt
+        self._last_time = t
+        self.value = self.stats.mean
+        return self.value
+
+    def lag(self):
+        return (self.stats.count - 1) / 2 * self._dt
+
+
+FILTERS = {
+    'none': NoFilter,
+    'one-euro': OneEuroFilter,
+    'kalman': KalmanFilter,
+    'moving-average': MovingAverageFilter,
+}
+
+
+class TiltInput:
+    """
+    Input stage between a Sensor and the game.
+    Collects every sample of one axis with its arrival time (callback on the receive thread),
+    runs all samples that arrived since the last frame through the filter and extrapolates the
+    filtered value to the render time of the frame.
+    The lag the filter adds is recorded in self.filter_latency (ms per frame).
+    An optional callback policy (see DIPPID.register_callback()) reduces the samples before they are collected.
+    Call value_at() or discard() every frame, at most MAX_PENDING_SAMPLES samples are kept in between.
+    """
+
+    def __init__(self, sensor, input_filter, capability='accelerometer', axis='y', policy=None):
+        self.input_filter = input_filter
+        self.axis = axis
+        self.filter_latency = LatencyStats()
+        self._samples = deque(maxlen=MAX_PENDING_SAMPLES)
+        self._lock = Lock()
+        self._last_sample_time = None
+        sensor.register_callback(capability, self.on_sample, policy)
+
+    def on_sample(self, data):
+        with self._lock:
+            self._samples.append((perf_counter(), data[self.axis]))
+
+    def value_at(self, render_time):
+        """
+        Returns the filtered value at render_time or None if no sample was received yet
+        """
+        with self._lock:
+            samples = self._samples
+            self._samples = deque(maxlen=MAX_PENDING_SAMPLES)
+
+        for t, x in samples:
+            self.input_filter.filter(x, t)
+            self._last_sample_time = t
+
+        if self._last_sample_time is None:
+            return None
+
+        if samples:
+            self.filter_latency.add(self.input_filter.lag() * 1000)
+
+        # predict where the value will be at render time
+        horizon = min(render_time - self._last_sample_time, MAX_EXTRAPOLATION)
+        return self.input_filter.value + self.input_filter.velocity * horizon
+
+    def discard(self):
+        """
+        Drops the samples that arrived since the last frame, for frames that do not use the input
+        (the filter then starts over with the next sample instead of one long time step)
+        """
+        with self._lock:
+            self._samples.clear()
+        self.input_filter.reset()
+        self._last_sample_time = None
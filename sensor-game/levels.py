@@ -0,0 +1,61 @@
+import numpy as np
+
+# hits of a brick in a generated level are chosen randomly from 1 to MAX_HITS
+MAX_HITS = 3
+
+
+def generate_level(rows, cols, seed=None, max_hits=MAX_HITS):
+    """
+    Returns a random level as an array of hit counts (one cell per brick).
+    The same seed always generates the same level.
+    """
+    rng = np.random.default_rng(seed)
+    return rng.integers(1, max_hits + 1, size=(rows, cols), dtype=np.int8)
+
+
+def load_level(path):
+    """
+    Loads a level from a .npy file or from a text file with one row of bricks per line
+    and one digit per brick (0 = no brick), e.g.
+
+        3333
+        2112
+        0110
+    """
+    if path.endswith('.npy'):
+        return np.load(path).astype(np.int8)
+
+    with open(path) as level_file:
+        lines = [line.strip() for line in level_file if line.strip()]
+
+    if len({len(line) for line in lines}) != 1:
+        raise ValueError(f'all rows of the level "{path}" must have the same length')
+
+    return np.array([[int(cell) for cell in line] for line in lines], dtype=np.int8)
+
+
+class LevelCache:
+    """
+    Generates or loads every level only once.
+    get() returns a fresh copy of the cached array, so a restart only costs one array copy.
+    """
+
+    def __init__(self):
+        self._levels = {}
+
+    def get(self, path=None, rows=None, cols=None, seed=None):
+        """
+        Returns a copy of the level from the given file or of the generated level with the given seed.
+        Levels without file and seed are random and therefore generated every time.
+        """
+        if path is None and seed is None:
+            return generate_level(rows, cols)
+
+        key = path if path is not None else (rows, cols, seed)
+        if key not in self._levels:
+            if path is not None:
+                self._levels[key] = load_level(path)
+            else:
+                self._levels[key] = generate_level(rows, cols, seed)
+
+        return self._levels[key].copy()
@@ -0,0 +1,20 @@
+from analyze_stream import capture_blocks
+
+
+def test_capture_skips_malformed_records(tmp_path):
+    capture = tmp_path / 'capture.txt'
+    capture.write_text(
+        '1.5\t{"accelerometer": {"x": 1, "y": 2, "z": 3}}\n'
+        'now\t{"accelerometer": {"x": 1, "y": 2, "z": 3}}\n'
+        '2\t{"accelerometer": [1, 2, 3]}\n'
+        '3\t{"accelerometer": {"x": "a", "y": 2, "z": 3}}\n'
+        '4\t{"accelerometer": {"x": 1, "y": 2}}\n'
+        '5\t[1, 2, 3]\n'
+        '6\t{"accelerometer": {"x": 4, "y"\n'
+        '7\t{"accelerometer": {"x": 4, "y": 5, "z": 6}}\n')
+
+    blocks = list(capture_blocks(capture))
+
+    assert len(blocks) == 1
+    assert blocks[0]['t'].tolist() == [1.5, 7.0]
+    assert blocks[0]['x'].tolist() == [1.0, 4.0]
@@ -0,0 +1,15 @@
+from dippid_shm import record_values
+
+
+def test_record_values_of_numbers_and_vectors():
+    assert record_values(1) == [1.0, 0.0, 0.0]
+    assert record_values(True) == [1.0, 0.0, 0.0]
+    assert record_values({'x': 1, 'z': 0.5}) == [1.0, 0.0, 0.5]
+
+
+def test_record_values_skips_other_values():
+    assert record_values('pressed') is None
+    assert record_values([1, 2, 3]) is None
+    assert record_values({'x': 1, 'w': 2}) is None
+    assert record_values({'x': '1'}) is None
+    assert record_values(10 ** 400) is None
@@ -0,0 +1,54 @@
+import numpy as np
+
+import gestures
+from gestures import GestureRecognizer, CHANNELS
+
+
+def moving_samples(count, seed=0):
+    return np.random.default_rng(seed).normal(0, 1, (count, CHANNELS))
+
+
+def count_evaluations(monkeypatch):
+    evaluations = []
+    dtw_distances = gestures.dtw_distances
+
+    def counting(window, templates):
+        evaluations.append(window)
+        return dtw_distances(window, templates)
+
+    monkeypatch.setattr(gestures, 'dtw_distances', counting)
+    return evaluations
+
+
+def test_one_evaluation_per_hop(monkeypatch):
+    evaluations = count_evaluations(monkeypatch)
+    # a negative threshold never matches, so the recognizer stays armed
+    recognizer = GestureRecognizer({'shake': moving_samples(64, seed=1)}, distance_threshold=-1)
+
+    for sample in moving_samples(160):
+        recognizer.add_samples(sample)
+
+    # windows end at 64, 72, ..., 160
+    assert len(evaluations) == (160 - recognizer.window) // recognizer.hop + 1
+
+
+def test_no_evaluation_between_hops(monkeypatch):
+    evaluations = count_evaluations(monkeypatch)
+    recognizer = GestureRecognizer({'shake': moving_samples(64, seed=1)}, distance_threshold=-1)
+
+    recognizer.add_samples(moving_samples(64))
+    assert len(evaluations) == 1
+    for sample in moving_samples(recognizer.hop - 1, seed=2):
+        recognizer.add_samples(sample)
+    assert len(evaluations) == 1
+    recognizer.add_samples(moving_samples(1, seed=3))
+    assert len(evaluations) == 2
+
+
+def test_features_cover_new_windows_only():
+    recognizer = GestureRecognizer()
+
+    recognizer.add_samples(moving_samples(64))
+    assert len(recognizer.features['energy']) == 1
+    recognizer.add_samples(moving_samples(24, seed=1))
+    assert len(recognizer.features['energy']) == 3
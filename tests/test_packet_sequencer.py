@@ -0,0 +1,46 @@
+from DIPPID import PacketSequencer
+
+
+def push_all(sequencer, seqs):
+    delivered = []
+    for seq in seqs:
+        delivered += sequencer.push(seq, seq)
+    return delivered
+
+
+def test_old_duplicate_is_dropped():
+    sequencer = PacketSequencer()
+    push_all(sequencer, range(1, 101))
+
+    assert sequencer.push(50, 50) == []
+    assert push_all(sequencer, range(101, 111)) == list(range(101, 111))
+    assert sequencer.stats['duplicates'] == 1
+    assert sequencer.stats['resets'] == 0
+
+
+def test_restart_with_zero():
+    sequencer = PacketSequencer()
+    push_all(sequencer, range(1, 101))
+
+    assert push_all(sequencer, range(0, 10)) == list(range(0, 10))
+    assert sequencer.stats['resets'] == 1
+
+
+def test_restart_without_zero():
+    sequencer = PacketSequencer()
+    push_all(sequencer, range(1, 101))
+
+    # the first packet of the restarted sender was lost,
+    # the restart is recognized after more than REORDER_WINDOW packets in a row behind
+    delivered = push_all(sequencer, range(1, 20))
+    first = PacketSequencer.REORDER_WINDOW + 1
+    assert delivered == list(range(first, 20))
+    assert sequencer.stats['resets'] == 1
+
+
+def test_restart_far_behind():
+    sequencer = PacketSequencer()
+    push_all(sequencer, range(1, PacketSequencer.LATE_DISTANCE + 101))
+
+    assert sequencer.push(50, 50) == [50]
+    assert sequencer.stats['resets'] == 1
@@ -0,0 +1,23 @@
+from DIPPID import Sensor
+
+
+def test_dispatch_listener_is_called_once_per_packet():
+    sensor = Sensor()
+    values = []
+    durations = []
+    sensor.register_callback('accelerometer', values.append)
+    sensor.register_callback('gyroscope', values.append)
+    sensor.add_dispatch_listener(durations.append)
+
+    for i in range(3):
+        sensor._apply({'accelerometer': {'x': i}, 'gyroscope': {'x': i}})
+
+    assert len(values) == 4
+    assert len(durations) == 3
+    assert all(duration >= 0 for duration in durations)
+
+    assert sensor.remove_dispatch_listener(durations.append)
+    assert not sensor.remove_dispatch_listener(durations.append)
+    sensor._apply({'accelerometer': {'x': 3}})
+    assert len(durations) == 3
+    Sensor.instances.remove(sensor)